@@ -0,0 +1,68 @@
+# core/actividad.py
+"""
+Contadores diarios de actividad por usuario (modelo ActividadDiaria).
+
+Cada escritura relevante (conversación nueva, mensaje del usuario, quiz completado,
+repaso de flashcard) suma sobre la fila del día con un UPDATE ... SET campo = campo + n;
+si la fila aún no existe se crea. El historial previo se carga con
+`python manage.py backfill_actividad`.
+
+Al borrar una conversación se descuentan ella y sus mensajes de los días en que se
+registraron (`descontar_conversacion`), para que los contadores sigan coincidiendo con
+las tablas crudas, como al reconstruirlos con backfill_actividad.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ActividadDiaria, Mensaje
+
+logger = logging.getLogger('core')
+
+
+def registrar_actividad(usuario, fecha=None, **incrementos):
+    """
+    Suma `incrementos` (p. ej. mensajes=1) a la fila de (usuario, fecha). Un fallo aquí
+    solo se registra en el log: nunca debe romper el request que lo llama.
+    """
+    fecha = fecha or timezone.localdate()
+    valores = {campo: F(campo) + n for campo, n in incrementos.items()}
+    filtro = ActividadDiaria.objects.filter(usuario=usuario, fecha=fecha)
+    try:
+        if filtro.update(**valores):
+            return
+        try:
+            with transaction.atomic():
+                ActividadDiaria.objects.create(usuario=usuario, fecha=fecha, **incrementos)
+        except IntegrityError:
+            # Otro request creó la fila del día en medio
+            filtro.update(**valores)
+    except Exception as e:
+        logger.error(f"[Actividad] No se pudo registrar {incrementos} para {usuario.pk}: {e}", exc_info=True)
+
+
+def _descontar(usuario_id, fecha, **decrementos):
+    valores = {campo: Greatest(F(campo) - n, Value(0)) for campo, n in decrementos.items()}
+    ActividadDiaria.objects.filter(usuario_id=usuario_id, fecha=fecha).update(**valores)
+
+
+def descontar_conversacion(conversacion):
+    """
+    Resta de ActividadDiaria la conversación y los mensajes del usuario que contiene.
+    Llamar ANTES de borrarla (los mensajes se borran en cascada). Como registrar_actividad,
+    un fallo solo se registra en el log.
+    """
+    try:
+        # Savepoint propio: si un UPDATE falla dentro de la transacción del que llama (el
+        # borrado), en PostgreSQL la dejaría abortada y el DELETE siguiente fallaría
+        with transaction.atomic():
+            _descontar(conversacion.usuario_id, timezone.localdate(conversacion.fecha_inicio), conversaciones=1)
+            por_dia = (Mensaje.objects.filter(conversacion=conversacion, rol='usuario')
+                       .values('timestamp__date').annotate(n=Count('id_mensaje')))
+            for fila in por_dia:
+                _descontar(conversacion.usuario_id, fila['timestamp__date'], mensajes=fila['n'])
+    except Exception as e:
+        logger.error(f"[Actividad] No se pudo descontar la conversación {conversacion.pk}: {e}", exc_info=True)
@@ -0,0 +1,26 @@
+# core/archivos.py
+"""
+Utilidades de archivos compartidas por las cachés en disco (TTS, índices de hechos,
+reportes PDF), pensadas para varios procesos escribiendo en el mismo directorio.
+"""
+import os
+import tempfile
+
+
+def escribir_atomico(ruta, contenido):
+    """
+    Escribe `contenido` (bytes) en `ruta` vía archivo temporal + os.replace: un lector
+    concurrente ve el archivo viejo o el nuevo completo, nunca uno a medio escribir.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(contenido)
+        os.replace(tmp, ruta)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
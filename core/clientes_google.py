@@ -0,0 +1,164 @@
+# core/clientes_google.py
+"""
+Clientes de Google Cloud compartidos por proceso.
+
+Crear un TextToSpeechClient (o un SpeechClient) implica canal gRPC nuevo, carga de credenciales y handshake
+TLS. Aquí se crea UNO por proceso (perezosamente, la primera vez que se usa) y lo
+comparten los hilos del worker de gunicorn (los clientes gRPC son thread-safe).
+
+- Fork-safe: el cliente recuerda el PID que lo creó; en un proceso hijo se crea otro.
+- Health check: si el cliente estuvo inactivo un rato se verifica el canal antes de usarlo.
+- Reconexión: un error de canal (UNAVAILABLE) descarta el cliente y se reintenta una vez.
+
+Todos los ClienteGestionado quedan en un registro del proceso. Tras un fork se descartan
+los clientes y se rehacen los locks heredados (`reiniciar_tras_fork`, enganchado con
+os.register_at_fork), y `precalentar` crea y verifica los canales al arrancar cada worker
+(gunicorn.conf.py), para que el primer request de voz no pague la creación del cliente.
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger('core')
+
+# Errores que indican canal roto/no disponible (reintentar con un cliente nuevo es seguro)
+ERRORES_DE_CANAL = (google_exceptions.ServiceUnavailable,)
+
+# Todos los clientes gestionados del proceso (débil: los pools de prueba no se acumulan)
+_registro = weakref.WeakSet()
+
+
+class ClienteGestionado:
+    """Un cliente de Google por proceso, creado bajo lock y recreado tras fork o fallo."""
+
+    # Segundos de inactividad tras los cuales se verifica el canal antes de reusarlo
+    VERIFICAR_TRAS_INACTIVIDAD = 300
+
+    def __init__(self, nombre, fabrica):
+        self.nombre = nombre
+        self._fabrica = fabrica
+        self._cliente = None
+        self._pid = None
+        self._ultimo_uso = 0.0
+        self._lock = threading.Lock()
+        self.creaciones = 0
+        self.reconexiones = 0
+        _registro.add(self)
+
+    def obtener(self):
+        """Devuelve el cliente del proceso actual (lo crea si hace falta)."""
+        cliente = self._cliente
+        if cliente is not None and self._pid == os.getpid():
+            if time.monotonic() - self._ultimo_uso > self.VERIFICAR_TRAS_INACTIVIDAD and not self.verificar(cliente):
+                self.invalidar(cliente)
+            else:
+                return cliente
+
+        with self._lock:
+            if self._cliente is None or self._pid != os.getpid():
+                # Tras un fork el canal gRPC heredado no es utilizable: se crea uno nuevo
+                inicio = time.monotonic()
+                self._cliente = self._fabrica()
+                self._pid = os.getpid()
+                self._ultimo_uso = time.monotonic()
+                self.creaciones += 1
+                logger.info(f"[Google] Cliente {self.nombre} creado en pid {self._pid} "
+                            f"({(time.monotonic() - inicio) * 1000:.0f} ms)")
+            return self._cliente
+
+    def invalidar(self, cliente=None):
+        """Descarta el cliente actual (solo si sigue siendo `cliente`, cuando se indica)."""
+        with self._lock:
+            if cliente is None or self._cliente is cliente:
+                self._cliente = None
+
+    def verificar(self, cliente=None, timeout=5):
+        """True si el canal gRPC del cliente está (o queda) listo dentro del timeout."""
+        import grpc
+        cliente = cliente or self.obtener()
+        canal = getattr(cliente.transport, 'grpc_channel', None)
+        if canal is None:
+            return True  # Transporte REST: no hay canal que verificar
+        try:
+            grpc.channel_ready_future(canal).result(timeout=timeout)
+            self._ultimo_uso = time.monotonic()
+            return True
+        except grpc.FutureTimeoutError:
+            logger.warning(f"[Google] Canal de {self.nombre} no está listo; se recreará")
+            return False
+
+    def llamar(self, funcion):
+        """
+        Ejecuta funcion(cliente). Si falla por error de canal, recrea el cliente y
+        reintenta una sola vez.
+        """
+        cliente = self.obtener()
+        try:
+            resultado = funcion(cliente)
+        except ERRORES_DE_CANAL as e:
+            logger.warning(f"[Google] Error de canal en {self.nombre}: {e}. Reconectando...")
+            self.invalidar(cliente)
+            self.reconexiones += 1
+            resultado = funcion(self.obtener())
+        self._ultimo_uso = time.monotonic()
+        return resultado
+
+    def _reiniciar_en_hijo(self):
+        # Si otro hilo del padre tenía el lock durante el fork, en el hijo quedaría tomado
+        # para siempre. El canal heredado no se cierra: sigue siendo del padre.
+        self._lock = threading.Lock()
+        self._cliente = None
+        self._pid = None
+
+
+def clientes_registrados():
+    return list(_registro)
+
+
+def reiniciar_tras_fork():
+    """Descarta en el proceso hijo todos los clientes heredados del padre."""
+    for gestionado in clientes_registrados():
+        gestionado._reiniciar_en_hijo()
+
+
+def precalentar(clientes=None, timeout=10):
+    """
+    Crea los clientes y espera a que sus canales estén listos. Un fallo solo se registra:
+    el cliente se volverá a crear en el primer uso. Devuelve {nombre: ok}.
+    """
+    resultado = {}
+    for gestionado in clientes if clientes is not None else clientes_registrados():
+        inicio = time.monotonic()
+        try:
+            ok = gestionado.verificar(gestionado.obtener(), timeout=timeout)
+            if not ok:
+                gestionado.invalidar()
+        except Exception as e:
+            logger.warning(f"[Google] No se pudo precalentar {gestionado.nombre}: {e}")
+            ok = False
+        resultado[gestionado.nombre] = ok
+        logger.info(f"[Google] Precalentado {gestionado.nombre}: {'ok' if ok else 'falló'} "
+                    f"({(time.monotonic() - inicio) * 1000:.0f} ms)")
+    return resultado
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reiniciar_tras_fork)
+
+
+def _crear_cliente_tts():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient()
+
+
+def _crear_cliente_stt():
+    from google.cloud import speech
+    return speech.SpeechClient()
+
+
+cliente_tts = ClienteGestionado('TextToSpeech', _crear_cliente_tts)
+cliente_stt = ClienteGestionado('Speech', _crear_cliente_stt)
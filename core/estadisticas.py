@@ -0,0 +1,170 @@
+# core/estadisticas.py
+"""
+Estadísticas del dashboard de quizzes (quiz_dashboard).
+
+Antes la vista hacía más de 40 consultas (conteos día por día, por categoría, por badge y
+varias por cada quiz). Aquí todo sale de unas pocas consultas agregadas con GROUP BY y
+un único queryset de Quiz anotado con los datos de sus intentos; el resto se arma en
+Python a partir de esos resultados. El top 5 del ranking sale de la caché de leaderboard.
+
+La actividad por día (calendario, semana, metas de hoy) y los totales de los badges se
+leen de ActividadDiaria (a lo sumo 30 filas + una suma), no de las tablas crudas.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import leaderboard
+from .models import (
+    ActividadDiaria, ConfiguracionVoz, ProgresoUsuario, Quiz, RespuestaIntento, Vocabulario,
+    estado_reintento,
+)
+
+DIAS_CALENDARIO = 30
+DIAS_SEMANA = 7
+ETIQUETAS_DIA = {'Mon': 'Lun', 'Tue': 'Mar', 'Wed': 'Mié', 'Thu': 'Jue', 'Fri': 'Vie', 'Sat': 'Sáb', 'Sun': 'Dom'}
+CATEGORIAS = [('vocabulario', 'Vocabulario'), ('gramatica', 'Gramática'), ('conjugacion', 'Conjugación')]
+
+
+def _quizzes_con_estado(user, ahora):
+    """Quizzes del usuario anotados con mejor puntaje, último intento y cantidad de intentos (1 consulta)."""
+    completados = Q(intentos__completado=True)
+    quizzes = Quiz.objects.filter(usuario=user).annotate(
+        mejor=Max('intentos__puntaje', filter=completados),
+        ultimo=Max('intentos__fecha', filter=completados),
+        intentos_completados=Count('intentos', filter=completados),
+    ).order_by('-fecha_creacion')
+
+    config = ConfiguracionVoz.objects.filter(usuario=user).only('dias_cooldown').first()
+    dias_cooldown = config.dias_cooldown if config else 3
+
+    quizzes_data = []
+    for quiz in quizzes:
+        puede_reintentar, dias_restantes = estado_reintento(quiz.ultimo, dias_cooldown, ahora)
+        quizzes_data.append({
+            'quiz': quiz,
+            'mejor_puntaje': quiz.mejor,
+            'puede_reintentar': puede_reintentar,
+            'dias_restantes': dias_restantes,
+            'num_intentos': quiz.intentos_completados,
+        })
+    return quizzes_data
+
+
+def _actividad_por_dia(user, desde):
+    """{fecha: ActividadDiaria} desde `desde` (1 consulta, a lo sumo DIAS_CALENDARIO filas)."""
+    return {fila.fecha: fila for fila in ActividadDiaria.objects.filter(usuario=user, fecha__gte=desde)}
+
+
+def _convos_y_quizzes(fila):
+    return (fila.conversaciones, fila.quizzes_completados) if fila else (0, 0)
+
+
+def estadisticas_dashboard(user):
+    """Todo el contexto de quiz_dashboard salvo el request."""
+    ahora = timezone.now()
+    today = ahora.date()
+
+    progreso, _ = ProgresoUsuario.objects.get_or_create(usuario=user)
+    quizzes_data = _quizzes_con_estado(user, ahora)
+
+    # Totales históricos (score acumulativo y badges) sumando el rollup diario
+    totales = ActividadDiaria.objects.filter(usuario=user).aggregate(
+        conversaciones=Sum('conversaciones'),
+        mensajes=Sum('mensajes'),
+        quizzes=Sum('quizzes_completados'),
+        suma_puntajes=Sum('suma_puntajes'),
+        perfectos=Sum('quizzes_perfectos'),
+    )
+    totales = {campo: valor or 0 for campo, valor in totales.items()}
+    total_intentos = totales['quizzes']
+    score_acumulativo = round(totales['suma_puntajes'] / total_intentos, 1) if total_intentos else None
+
+    vocab = Vocabulario.objects.filter(usuario=user).aggregate(
+        total=Count('id'),
+        pendientes=Count('id', filter=Q(proximo_repaso__lte=ahora)),
+    )
+
+    # Calendario (30 días), semana (7 días) y metas de hoy salen de la misma actividad
+    inicio_calendario = today - timedelta(days=DIAS_CALENDARIO - 1)
+    actividad = _actividad_por_dia(user, inicio_calendario)
+
+    calendar_data = []
+    for i in range(DIAS_CALENDARIO):
+        day = inicio_calendario + timedelta(days=i)
+        convos, quizzes = _convos_y_quizzes(actividad.get(day))
+        calendar_data.append({
+            'date': day.isoformat(),
+            'day_num': day.day,
+            'weekday': day.strftime('%a'),
+            'count': convos + quizzes,
+        })
+
+    weekly_data = []
+    for i in range(DIAS_SEMANA):
+        day = today - timedelta(days=DIAS_SEMANA - 1 - i)
+        convos, quizzes = _convos_y_quizzes(actividad.get(day))
+        en_label = day.strftime('%a')
+        weekly_data.append({
+            'label': ETIQUETAS_DIA.get(en_label, en_label),
+            'date': day.isoformat(),
+            'convos': convos,
+            'quizzes': quizzes,
+            'total': convos + quizzes,
+        })
+    max_weekly = max((d['total'] for d in weekly_data), default=1) or 1
+
+    badges = [
+        {'icon': 'chat', 'name': 'Primera Conversación', 'desc': 'Inicia tu primera conversación', 'unlocked': totales['conversaciones'] >= 1},
+        {'icon': 'quiz', 'name': 'Primer Quiz', 'desc': 'Completa tu primer quiz', 'unlocked': total_intentos >= 1},
+        {'icon': 'local_fire_department', 'name': 'Racha de 7', 'desc': 'Mantén una racha de 7 días', 'unlocked': progreso.racha_actual >= 7},
+        {'icon': 'emoji_events', 'name': 'Score Perfecto', 'desc': 'Obtén 100% en un quiz', 'unlocked': totales['perfectos'] > 0},
+        {'icon': 'menu_book', 'name': '50 Palabras', 'desc': 'Aprende 50 palabras nuevas', 'unlocked': vocab['total'] >= 50},
+        {'icon': 'military_tech', 'name': 'Nivel 5', 'desc': 'Alcanza el nivel 5', 'unlocked': progreso.nivel >= 5},
+        {'icon': 'forum', 'name': '100 Mensajes', 'desc': 'Envía 100 mensajes', 'unlocked': totales['mensajes'] >= 100},
+        {'icon': 'school', 'name': '10 Quizzes', 'desc': 'Completa 10 quizzes', 'unlocked': total_intentos >= 10},
+    ]
+
+    convos_today, quizzes_today = _convos_y_quizzes(actividad.get(today))
+    flashcards_today = actividad[today].flashcards_repasadas if today in actividad else 0
+    daily_goals = [
+        {'icon': 'chat', 'label': 'Conversaciones', 'current': min(convos_today, 3), 'target': 3, 'pct': min(100, round(convos_today / 3 * 100))},
+        {'icon': 'quiz', 'label': 'Quizzes', 'current': min(quizzes_today, 1), 'target': 1, 'pct': min(100, round(quizzes_today / 1 * 100))},
+        {'icon': 'style', 'label': 'Flashcards', 'current': min(flashcards_today, 5), 'target': 5, 'pct': min(100, round(flashcards_today / 5 * 100))},
+    ]
+
+    # Precisión por categoría de pregunta (1 consulta agrupada)
+    por_categoria = {
+        fila['pregunta__categoria']: fila
+        for fila in RespuestaIntento.objects.filter(intento__usuario=user, intento__completado=True)
+        .values('pregunta__categoria')
+        .annotate(total=Count('id'), correctas=Count('id', filter=Q(es_correcta=True)))
+    }
+    skill_progress = []
+    for cat_code, cat_name in CATEGORIAS:
+        fila = por_categoria.get(cat_code, {'total': 0, 'correctas': 0})
+        skill_progress.append({
+            'name': cat_name,
+            'accuracy': round(fila['correctas'] / fila['total'] * 100) if fila['total'] > 0 else 0,
+            'total': fila['total'],
+            'correct': fila['correctas'],
+        })
+
+    return {
+        'quizzes_data': quizzes_data,
+        'score_acumulativo': score_acumulativo,
+        'total_intentos': total_intentos,
+        'total_quizzes': len(quizzes_data),
+        'progreso': progreso,
+        'flashcards_pendientes': vocab['pendientes'],
+        'leaderboard': leaderboard.top(5),
+        'calendar_data': calendar_data,
+        'weekly_data': weekly_data,
+        'max_weekly': max_weekly,
+        'badges': badges,
+        'badges_unlocked': sum(1 for b in badges if b['unlocked']),
+        'badges_total': len(badges),
+        'daily_goals': daily_goals,
+        'skill_progress': skill_progress,
+    }
@@ -0,0 +1,82 @@
+# core/exportacion.py
+"""
+Exportación del historial completo de una conversación (mensajes, errores gramaticales y
+de pronunciación) como JSON o NDJSON, generado en streaming.
+
+Las filas se leen con .iterator(chunk_size=...) (cursor del lado del servidor en
+PostgreSQL) y se serializan de a una, agrupando el texto en bloques de ~64 KB para el
+StreamingHttpResponse. La memoria usada no depende del tamaño de la conversación.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ErrorPronunciacion, Mensaje, RegistroError
+
+FILAS_POR_LOTE = 2000
+BYTES_POR_BLOQUE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+CAMPOS_MENSAJE = ('id_mensaje', 'rol', 'contenido_texto', 'audio_url', 'timestamp')
+CAMPOS_ERROR = ('id_error', 'mensaje_id', 'texto_original', 'texto_corregido', 'explicacion_regla', 'timestamp')
+CAMPOS_PRONUNCIACION = ('id', 'texto_original', 'texto_corregido_fonetico', 'tip_fonetico', 'confidence', 'timestamp')
+
+
+def _secciones(conversacion):
+    """(clave en JSON, tipo en NDJSON, queryset de dicts) de cada sección, en orden cronológico."""
+    return [
+        ('mensajes', 'mensaje', Mensaje.objects.filter(conversacion=conversacion)
+         .order_by('timestamp', 'id_mensaje').values(*CAMPOS_MENSAJE)),
+        ('errores', 'error', RegistroError.objects.filter(mensaje__conversacion=conversacion)
+         .order_by('timestamp', 'id_error').values(*CAMPOS_ERROR)),
+        ('errores_pronunciacion', 'error_pronunciacion', ErrorPronunciacion.objects.filter(conversacion=conversacion)
+         .order_by('timestamp', 'id').values(*CAMPOS_PRONUNCIACION)),
+    ]
+
+
+def _cabecera(conversacion):
+    return {
+        'id': conversacion.id_conversacion,
+        'titulo': conversacion.titulo,
+        'idioma': conversacion.idioma_actual,
+        'fecha_inicio': conversacion.fecha_inicio,
+    }
+
+
+def _en_bloques(piezas):
+    """Junta las piezas de texto en bloques de ~BYTES_POR_BLOQUE (menos escrituras al socket)."""
+    bloque, tamano = [], 0
+    for pieza in piezas:
+        bloque.append(pieza)
+        tamano += len(pieza)
+        if tamano >= BYTES_POR_BLOQUE:
+            yield ''.join(bloque)
+            bloque, tamano = [], 0
+    if bloque:
+        yield ''.join(bloque)
+
+
+def _piezas_ndjson(conversacion):
+    yield _encoder.encode({'tipo': 'conversacion', **_cabecera(conversacion)}) + '\n'
+    for _, tipo, filas in _secciones(conversacion):
+        for fila in filas.iterator(chunk_size=FILAS_POR_LOTE):
+            yield _encoder.encode({'tipo': tipo, **fila}) + '\n'
+
+
+def _piezas_json(conversacion):
+    yield '{"conversacion": ' + _encoder.encode(_cabecera(conversacion))
+    for seccion, _, filas in _secciones(conversacion):
+        yield f', {json.dumps(seccion)}: ['
+        separador = ''
+        for fila in filas.iterator(chunk_size=FILAS_POR_LOTE):
+            yield separador + _encoder.encode(fila)
+            separador = ', '
+        yield ']'
+    yield '}\n'
+
+
+def exportar_conversacion(conversacion, formato='json'):
+    """Generador de bloques de texto con el historial completo en `formato` ('json' o 'ndjson')."""
+    piezas = _piezas_ndjson(conversacion) if formato == 'ndjson' else _piezas_json(conversacion)
+    return _en_bloques(piezas)
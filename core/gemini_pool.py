@@ -0,0 +1,255 @@
+# core/gemini_pool.py
+"""
+Pool de clientes de Gemini, uno por API key, con seguimiento de salud por key.
+
+Antes se rotaba la key con genai.configure(), que cambia estado GLOBAL del SDK: con
+varios hilos por worker (gunicorn --threads) dos requests podían pisarse la key.
+Aquí cada key tiene su propio GenerativeServiceClient (creado con client_options) y cada
+request "arrienda" uno del pool; ningún request toca la configuración global de genai.
+
+Salud (circuit breaker por key):
+- Cerrado: la key se usa normalmente. Se guarda el resultado de sus últimas llamadas.
+- Abierto: tras un 429 / cuota agotada, o si la tasa de error reciente es alta, la key
+  descansa un tiempo que crece exponencialmente con cada apertura seguida.
+- Semiabierto: vencido el descanso, UN request la prueba. Si sale bien se cierra; si no,
+  vuelve a abrirse con más espera.
+Las keys disponibles se ordenan de la más sana a la menos sana.
+
+Los clientes se crean perezosamente, uno por proceso (ver ClienteGestionado). El estado de
+salud también es por proceso.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from .clientes_google import ClienteGestionado, ERRORES_DE_CANAL
+
+logger = logging.getLogger('core')
+
+# Errores que indican cuota agotada / rate limit (HTTP 429)
+ERRORES_DE_CUOTA = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+def _crear_cliente_gemini(api_key):
+    from google.ai import generativelanguage as glm
+    return glm.GenerativeServiceClient(client_options={'api_key': api_key})
+
+
+class SaludKey:
+    """Estado del circuit breaker de una key. Se modifica siempre bajo el lock del pool."""
+
+    VENTANA = 20            # Últimas llamadas consideradas para la tasa de error
+    MIN_MUESTRAS = 5        # Llamadas mínimas antes de abrir por tasa de error
+    TASA_ERROR_MAXIMA = 0.5
+    ESPERA_BASE = 30        # Segundos de descanso en la primera apertura
+    ESPERA_MAXIMA = 15 * 60
+    PLAZO_RESERVA_PRUEBA = 30  # Segundos que dura la reserva de prueba si el request no llega a usarla
+
+    def __init__(self):
+        self.estado = CERRADO
+        self.resultados = deque(maxlen=self.VENTANA)
+        self.aperturas_seguidas = 0
+        self.abierto_hasta = 0.0
+        self.probando = False
+        self.probando_hasta = 0.0
+        self.ultimo_error = None
+        self.exitos = 0
+        self.fallos = 0
+        self.fallos_cuota = 0
+
+    def tasa_error(self):
+        if not self.resultados:
+            return 0.0
+        return self.resultados.count(False) / len(self.resultados)
+
+    def disponible(self, ahora):
+        """True si la key puede recibir un request ahora (pasa a semiabierto si venció la espera)."""
+        if self.estado == ABIERTO and ahora >= self.abierto_hasta:
+            self.estado = SEMIABIERTO
+            self.probando = False
+        if self.estado == SEMIABIERTO:
+            if self.probando and ahora >= self.probando_hasta:
+                self.probando = False  # Reserva vencida: el request que la tomó usó otra key
+            return not self.probando
+        return self.estado == CERRADO
+
+    def reservar_prueba(self, hasta):
+        """Aparta la key semiabierta para un único request de prueba (hasta `hasta`)."""
+        self.probando = True
+        self.probando_hasta = hasta
+
+    def registrar_exito(self):
+        self.exitos += 1
+        self.resultados.append(True)
+        if self.estado != CERRADO:
+            logger.info("[API Key] Key recuperada, circuito cerrado")
+        self.estado = CERRADO
+        self.aperturas_seguidas = 0
+        self.probando = False
+
+    def registrar_fallo(self, error, ahora):
+        self.fallos += 1
+        self.ultimo_error = str(error)[:200]
+        es_cuota = isinstance(error, ERRORES_DE_CUOTA)
+        if es_cuota:
+            self.fallos_cuota += 1
+        if self.estado == ABIERTO:
+            # Request arrendado antes de la apertura que termina tarde: no alarga el descanso
+            return
+        self.resultados.append(False)
+        if (es_cuota or self.estado == SEMIABIERTO
+                or (len(self.resultados) >= self.MIN_MUESTRAS and self.tasa_error() >= self.TASA_ERROR_MAXIMA)):
+            self._abrir(ahora)
+
+    def _abrir(self, ahora):
+        espera = min(self.ESPERA_BASE * (2 ** self.aperturas_seguidas), self.ESPERA_MAXIMA)
+        self.aperturas_seguidas += 1
+        self.estado = ABIERTO
+        self.abierto_hasta = ahora + espera
+        self.probando = False
+        # Al volver se empieza con la ventana limpia (si no, se reabriría al primer fallo)
+        self.resultados.clear()
+        return espera
+
+
+class PoolGemini:
+    """Un cliente por API key; cada request prueba primero las keys más sanas."""
+
+    def __init__(self, api_keys):
+        self._keys = [k for k in api_keys if k]
+        self._clientes = [
+            ClienteGestionado(f'Gemini key #{i + 1}', partial(_crear_cliente_gemini, key))
+            for i, key in enumerate(self._keys)
+        ]
+        self._salud = [SaludKey() for _ in self._keys]
+        self._siguiente = 0
+        self._lock = threading.Lock()
+        self._en_uso = [0] * len(self._keys)
+        self._arriendos = [0] * len(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def orden_de_intento(self):
+        """
+        Índices de key a probar en este request: solo las disponibles, de la más sana
+        (menor tasa de error, menos requests en curso) a la menos sana. A igualdad se rota
+        para repartir la cuota. Las keys semiabiertas van al final, como prueba, y quedan
+        reservadas para este request: los concurrentes no las reciben hasta que la prueba
+        termine o venza la reserva (si este request no llega a usarlas).
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            inicio = self._siguiente
+            self._siguiente = (self._siguiente + 1) % max(len(self._keys), 1)
+            candidatas = []
+            for i, salud in enumerate(self._salud):
+                if not salud.disponible(ahora):
+                    continue
+                if salud.estado == SEMIABIERTO:
+                    salud.reservar_prueba(ahora + salud.PLAZO_RESERVA_PRUEBA)
+                rotacion = (i - inicio) % len(self._keys)
+                candidatas.append((salud.estado != CERRADO, round(salud.tasa_error(), 1),
+                                   self._en_uso[i], rotacion, i))
+        return [i for *_, i in sorted(candidatas)]
+
+    @contextmanager
+    def arrendar(self, indice):
+        """
+        Presta el cliente de la key `indice` mientras dure el bloque. El resultado se
+        registra al salir: excepción = fallo, salida normal = éxito, salvo que el bloque
+        haya llamado a arriendo.fallo(error) (para errores que captura él mismo).
+        Si falla por error de canal, el cliente se descarta para recrearlo.
+        """
+        gestionado = self._clientes[indice]
+        arriendo = Arriendo(indice, gestionado.obtener())
+        with self._lock:
+            self._en_uso[indice] += 1
+            self._arriendos[indice] += 1
+            if self._salud[indice].estado == SEMIABIERTO:
+                # Solo un request a la vez prueba una key que viene de enfriamiento; mientras
+                # la prueba está en curso la reserva no vence
+                self._salud[indice].reservar_prueba(float('inf'))
+        logger.info(f"[API Key] Usando API Key #{indice + 1} de {len(self._keys)}")
+        try:
+            yield arriendo
+        except GeneratorExit:
+            # El consumidor del stream lo abandonó: no dice nada de la salud de la key
+            arriendo.resultado_registrado = True
+            raise
+        except Exception as e:
+            arriendo.fallo(e)
+            raise
+        finally:
+            if arriendo.error is not None:
+                if isinstance(arriendo.error, ERRORES_DE_CANAL):
+                    gestionado.invalidar(arriendo.cliente)
+                self._registrar(indice, arriendo.error)
+            elif not arriendo.resultado_registrado:
+                self._registrar(indice, None)
+            with self._lock:
+                self._en_uso[indice] -= 1
+                if self._salud[indice].estado == SEMIABIERTO:
+                    self._salud[indice].probando = False  # Prueba abandonada: otra puede intentarlo
+
+    def _registrar(self, indice, error):
+        with self._lock:
+            salud = self._salud[indice]
+            if error is None:
+                salud.registrar_exito()
+                return
+            estado_anterior = salud.estado
+            salud.registrar_fallo(error, time.monotonic())
+            if salud.estado == ABIERTO and estado_anterior != ABIERTO:
+                espera = salud.abierto_hasta - time.monotonic()
+                logger.warning(f"[API Key] Key #{indice + 1} en enfriamiento {espera:.0f}s "
+                               f"({type(error).__name__})")
+
+    def estadisticas(self):
+        """Estado de salud y uso de cada key (sin la key en sí)."""
+        ahora = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'key': i + 1,
+                    'estado': salud.estado,
+                    'tasa_error': round(salud.tasa_error(), 3),
+                    'enfriamiento_restante_s': max(0, round(salud.abierto_hasta - ahora)) if salud.estado == ABIERTO else 0,
+                    'aperturas_seguidas': salud.aperturas_seguidas,
+                    'exitos': salud.exitos,
+                    'fallos': salud.fallos,
+                    'fallos_cuota': salud.fallos_cuota,
+                    'ultimo_error': salud.ultimo_error,
+                    'en_uso': self._en_uso[i],
+                    'arriendos': self._arriendos[i],
+                    'clientes_creados': self._clientes[i].creaciones,
+                }
+                for i, salud in enumerate(self._salud)
+            ]
+
+
+class Arriendo:
+    """Cliente prestado por el pool para un request."""
+
+    def __init__(self, indice, cliente):
+        self.indice = indice
+        self.cliente = cliente
+        self.error = None
+        self.resultado_registrado = False
+
+    def fallo(self, error):
+        """Marca el arriendo como fallido aunque el bloque termine sin excepción."""
+        self.error = error
+
+
+pool_gemini = PoolGemini(getattr(settings, 'GEMINI_API_KEYS', []) or [settings.GEMINI_API_KEY])
@@ -0,0 +1,254 @@
+# core/hechos.py
+"""
+Recuperación de UserFacts relevantes para el mensaje actual.
+
+Usuarios antiguos acumulan cientos de hechos; mandarlos todos en cada turno infla el
+prompt. Aquí cada usuario tiene un índice TF-IDF local (vectores dispersos con hashing de
+términos, sin red ni dependencias) y al prompt solo van los TOP_K hechos más parecidos al
+mensaje actual y a los últimos mensajes del historial.
+
+- El índice se guarda en disco (un JSON por usuario, escritura atómica) y en una LRU en
+  memoria. Se identifica por (cantidad de hechos, id máximo, última modificación): si algo
+  cambió (altas, bajas o ediciones de un hecho), se reconstruye.
+- Si el usuario tiene TOP_K hechos o menos, se mandan todos sin pasar por el índice (y su
+  índice, si lo tenía, se borra). Los de usuarios eliminados se borran con
+  `borrar_indice` / `purgar_indices_huerfanos`.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, Max
+
+from .historial import estimar_tokens
+from .models import UserFact
+from .archivos import escribir_atomico
+
+logger = logging.getLogger('core')
+
+TOP_K = getattr(settings, 'HECHOS_TOP_K', 8)
+DIMENSIONES = 2 ** 18
+DIRECTORIO_INDICES = getattr(settings, 'HECHOS_INDICE_DIR', os.path.join(settings.BASE_DIR, 'cache_hechos'))
+MAX_INDICES_MEMORIA = 256
+PESO_HISTORIAL = 0.5   # El mensaje actual pesa el doble que el historial reciente
+
+_PALABRAS_VACIAS = set("""
+a al algo como con de del el en es esta este ella ellos era fue ha hay la las le lo los me mi
+mis muy no o para pero por que se si sin son su sus te tu un una uno y ya yo
+the and or of to in on at is are was were be it its i you he she we they my your his her
+do does did have has had not a an this that with for as by from
+""".split())
+
+_estadisticas = {'consultas': 0, 'con_indice': 0, 'ms_total': 0.0, 'tokens_ahorrados': 0}
+_estadisticas_lock = threading.Lock()
+
+
+def _terminos(texto):
+    """Palabras normalizadas (minúsculas, sin tildes, sin palabras vacías)."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r'\w+', texto) if len(t) > 1 and t not in _PALABRAS_VACIAS]
+
+
+def _dimension(termino):
+    # crc32 es estable entre procesos (hash() de Python no lo es)
+    return zlib.crc32(termino.encode('utf-8')) % DIMENSIONES
+
+
+def _frecuencias(texto):
+    """Frecuencias de término (log) por dimensión."""
+    conteo = Counter(_dimension(t) for t in _terminos(texto))
+    return {d: 1 + math.log(n) for d, n in conteo.items()}
+
+
+def _normalizar(vector):
+    norma = math.sqrt(sum(v * v for v in vector.values()))
+    return {d: v / norma for d, v in vector.items()} if norma else {}
+
+
+class IndiceHechos:
+    """Vectores TF-IDF normalizados de los hechos de un usuario."""
+
+    def __init__(self, version, ids, datos, idf, vectores):
+        self.version = version
+        self.ids = ids
+        self.datos = datos
+        self.idf = idf
+        self.vectores = vectores
+
+    @classmethod
+    def construir(cls, version, filas):
+        ids = [fid for fid, _ in filas]
+        datos = [dato for _, dato in filas]
+        frecuencias = [_frecuencias(dato) for dato in datos]
+        df = Counter(d for f in frecuencias for d in f)
+        n = len(datos)
+        idf = {d: math.log((1 + n) / (1 + c)) + 1 for d, c in df.items()}
+        vectores = [_normalizar({d: tf * idf[d] for d, tf in f.items()}) for f in frecuencias]
+        return cls(version, ids, datos, idf, vectores)
+
+    def vector_consulta(self, texto, peso=1.0):
+        # Términos que no aparecen en ningún hecho no aportan a la similitud
+        return {d: tf * self.idf[d] * peso for d, tf in _frecuencias(texto).items() if d in self.idf}
+
+    def mas_relevantes(self, consulta, k):
+        """Los k hechos con mayor coseno; a igual puntaje, los más recientes."""
+        consulta = _normalizar(consulta)
+        puntajes = [
+            (sum(peso * vector.get(d, 0.0) for d, peso in consulta.items()), fid, dato)
+            for fid, dato, vector in zip(self.ids, self.datos, self.vectores)
+        ]
+        puntajes.sort(key=lambda p: (p[0], p[1]), reverse=True)
+        return [dato for _, _, dato in puntajes[:k]]
+
+    # --- Disco ---
+    def a_json(self):
+        return json.dumps({
+            'version': list(self.version),
+            'ids': self.ids,
+            'datos': self.datos,
+            'idf': self.idf,
+            'vectores': self.vectores,
+        }, ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def desde_json(cls, contenido):
+        crudo = json.loads(contenido)
+        return cls(
+            tuple(crudo['version']), crudo['ids'], crudo['datos'],
+            {int(d): v for d, v in crudo['idf'].items()},
+            [{int(d): v for d, v in vector.items()} for vector in crudo['vectores']],
+        )
+
+
+_indices = OrderedDict()
+_indices_lock = threading.Lock()
+
+
+def _ruta_indice(usuario_id):
+    return os.path.join(DIRECTORIO_INDICES, f"{usuario_id}.json")
+
+
+def _ruta_indice_existe(usuario_id):
+    with _indices_lock:
+        if usuario_id in _indices:
+            return True
+    return os.path.exists(_ruta_indice(usuario_id))
+
+
+def borrar_indice(usuario_id):
+    """Borra el índice del usuario de memoria y de disco (si existía)."""
+    with _indices_lock:
+        _indices.pop(usuario_id, None)
+    try:
+        os.unlink(_ruta_indice(usuario_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"[Hechos] No se pudo borrar el índice del usuario {usuario_id}: {e}")
+
+
+def purgar_indices_huerfanos():
+    """Borra los índices en disco de usuarios que ya no existen. Devuelve cuántos borró."""
+    try:
+        nombres = os.listdir(DIRECTORIO_INDICES)
+    except FileNotFoundError:
+        return 0
+    en_disco = {int(n[:-len('.json')]) for n in nombres if n.endswith('.json') and n[:-len('.json')].isdigit()}
+    huerfanos = en_disco - set(User.objects.filter(pk__in=en_disco).values_list('pk', flat=True))
+    for usuario_id in huerfanos:
+        borrar_indice(usuario_id)
+    return len(huerfanos)
+
+
+def _version(resumen):
+    ultima = resumen['modificado']
+    return (resumen['n'], resumen['ultimo'], ultima.isoformat() if ultima else '')
+
+
+def _obtener_indice(usuario_id, version):
+    """Índice vigente del usuario: memoria, luego disco, y si no coincide la versión, se reconstruye."""
+    with _indices_lock:
+        indice = _indices.get(usuario_id)
+        if indice is not None and indice.version == version:
+            _indices.move_to_end(usuario_id)
+            return indice
+
+    indice = None
+    try:
+        with open(_ruta_indice(usuario_id), 'rb') as f:
+            indice = IndiceHechos.desde_json(f.read())
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"[Hechos] Índice en disco ilegible para usuario {usuario_id}: {e}")
+
+    if indice is None or indice.version != version:
+        filas = list(UserFact.objects.filter(usuario_id=usuario_id).order_by('id').values_list('id', 'dato'))
+        indice = IndiceHechos.construir(version, filas)
+        try:
+            escribir_atomico(_ruta_indice(usuario_id), indice.a_json())
+        except OSError as e:
+            logger.warning(f"[Hechos] No se pudo guardar el índice en disco: {e}")
+
+    with _indices_lock:
+        _indices[usuario_id] = indice
+        _indices.move_to_end(usuario_id)
+        while len(_indices) > MAX_INDICES_MEMORIA:
+            _indices.popitem(last=False)
+    return indice
+
+
+def hechos_relevantes(usuario, texto_usuario, historial_chat=(), k=TOP_K):
+    """
+    Devuelve los hechos del usuario que van al prompt de este turno (a lo sumo k).
+    `historial_chat` es el historial en formato Gemini; se usan los últimos mensajes.
+    """
+    inicio = time.perf_counter()
+    resumen = UserFact.objects.filter(usuario=usuario).aggregate(
+        n=Count('id'), ultimo=Max('id'), modificado=Max('fecha_modificacion')
+    )
+    if resumen['n'] <= k:
+        hechos = list(UserFact.objects.filter(usuario=usuario).values_list('dato', flat=True))
+        if _ruta_indice_existe(usuario.pk):
+            borrar_indice(usuario.pk)  # Ya no hace falta: bajó de TOP_K hechos
+        with _estadisticas_lock:
+            _estadisticas['consultas'] += 1
+        return hechos
+
+    indice = _obtener_indice(usuario.pk, _version(resumen))
+    consulta = indice.vector_consulta(texto_usuario)
+    for mensaje in list(historial_chat)[-4:]:
+        for d, peso in indice.vector_consulta(' '.join(mensaje['parts']), PESO_HISTORIAL).items():
+            consulta[d] = consulta.get(d, 0.0) + peso
+    hechos = indice.mas_relevantes(consulta, k)
+
+    ms = (time.perf_counter() - inicio) * 1000
+    ahorrados = sum(estimar_tokens(d) for d in indice.datos) - sum(estimar_tokens(d) for d in hechos)
+    with _estadisticas_lock:
+        _estadisticas['consultas'] += 1
+        _estadisticas['con_indice'] += 1
+        _estadisticas['ms_total'] += ms
+        _estadisticas['tokens_ahorrados'] += ahorrados
+    logger.info(f"[Hechos] Usuario {usuario.pk}: {len(hechos)}/{resumen['n']} hechos en {ms:.1f} ms "
+                f"(~{ahorrados} tokens menos en el prompt)")
+    return hechos
+
+
+def estadisticas():
+    """Contadores de este proceso: consultas, tiempo medio de recuperación y tokens ahorrados."""
+    with _estadisticas_lock:
+        stats = dict(_estadisticas)
+    stats['ms_promedio'] = round(stats['ms_total'] / stats['con_indice'], 2) if stats['con_indice'] else None
+    stats['ms_total'] = round(stats['ms_total'], 1)
+    stats['pid'] = os.getpid()
+    return stats
@@ -0,0 +1,222 @@
+# core/historial.py
+"""
+Historial de chat que se manda a Gemini, con presupuesto de tokens.
+
+- Los mensajes más recientes van textuales mientras quepan en el presupuesto.
+- Los más antiguos quedan representados por un resumen acumulado guardado en
+  Conversacion.resumen_historial (cubre hasta Conversacion.resumen_hasta_id).
+- El resumen se actualiza de forma incremental (resumen anterior + mensajes nuevos) en un
+  hilo aparte, y solo cuando se juntaron RESUMIR_CADA mensajes fuera del presupuesto.
+  Los mensajes fuera del presupuesto no se mandan aunque el resumen todavía no los cubra
+  (o falle): el presupuesto se respeta siempre.
+
+Caché write-through por conversación (en memoria de cada worker, LRU + TTL):
+- registrar_mensaje() agrega cada mensaje nuevo a la caché y avanza
+  Conversacion.ultimo_mensaje_id con un UPDATE condicional.
+- Una entrada solo es válida si su último id coincide con el de la Conversacion; si otro
+  worker escribió en medio, el UPDATE condicional lo detecta y la entrada se descarta.
+- En un miss se lee de la base de datos como siempre.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Conversacion, Mensaje
+from .utils import resumir_historial_gemini
+
+logger = logging.getLogger('core')
+
+PRESUPUESTO_TOKENS = getattr(settings, 'HISTORIAL_PRESUPUESTO_TOKENS', 3000)
+MAX_MENSAJES = 30     # Tope de mensajes textuales, aunque sobre presupuesto
+RESUMIR_CADA = 6      # Mensajes fuera del presupuesto que disparan una actualización del resumen
+
+CACHE_MAX_CONVERSACIONES = getattr(settings, 'HISTORIAL_CACHE_CONVERSACIONES', 500)
+CACHE_TTL = getattr(settings, 'HISTORIAL_CACHE_TTL', 30 * 60)
+
+_executor_resumen = ThreadPoolExecutor(max_workers=2, thread_name_prefix='resumen')
+_resumiendo = set()   # Conversaciones con un resumen en curso (una a la vez por conversación)
+_resumiendo_lock = threading.Lock()
+
+
+class CacheHistorial:
+    """
+    Por conversación: los MAX_MENSAJES + 1 mensajes más nuevos como (id, rol, texto), del
+    más nuevo al más viejo, y el id del último mensaje que vio la entrada.
+    """
+
+    def __init__(self, max_conversaciones, ttl):
+        self.max_conversaciones = max_conversaciones
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, conversacion_id, ultimo_mensaje_id):
+        """Mensajes cacheados o None si no hay entrada, venció o quedó desactualizada."""
+        with self._lock:
+            entrada = self._entradas.get(conversacion_id)
+            if (entrada is None or entrada['ultimo_id'] != ultimo_mensaje_id
+                    or time.monotonic() - entrada['creada'] > self.ttl):
+                self._entradas.pop(conversacion_id, None)
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(conversacion_id)
+            self.hits += 1
+            return list(entrada['mensajes'])
+
+    def guardar(self, conversacion_id, ultimo_mensaje_id, mensajes):
+        with self._lock:
+            self._entradas[conversacion_id] = {
+                'ultimo_id': ultimo_mensaje_id,
+                'mensajes': list(mensajes[:MAX_MENSAJES + 1]),
+                'creada': time.monotonic(),
+            }
+            self._entradas.move_to_end(conversacion_id)
+            while len(self._entradas) > self.max_conversaciones:
+                self._entradas.popitem(last=False)
+
+    def agregar(self, conversacion_id, ultimo_anterior, mensaje):
+        """Agrega `mensaje` solo si la entrada estaba al día (su último id era `ultimo_anterior`)."""
+        with self._lock:
+            entrada = self._entradas.get(conversacion_id)
+            if entrada is None:
+                return
+            if entrada['ultimo_id'] != ultimo_anterior:
+                del self._entradas[conversacion_id]
+                return
+            entrada['mensajes'] = ([mensaje] + entrada['mensajes'])[:MAX_MENSAJES + 1]
+            entrada['ultimo_id'] = mensaje[0]
+
+    def invalidar(self, conversacion_id):
+        with self._lock:
+            self._entradas.pop(conversacion_id, None)
+
+    def estadisticas(self):
+        with self._lock:
+            return {'conversaciones': len(self._entradas), 'hits': self.hits, 'misses': self.misses}
+
+
+cache_historial = CacheHistorial(CACHE_MAX_CONVERSACIONES, CACHE_TTL)
+
+
+def registrar_mensaje(conversacion, mensaje):
+    """
+    Llamar después de cada Mensaje.objects.create del chat: avanza
+    Conversacion.ultimo_mensaje_id y agrega el mensaje a la caché de este worker.
+    """
+    anterior = conversacion.ultimo_mensaje_id
+    nuevo = mensaje.id_mensaje
+    avanzado = Conversacion.objects.filter(
+        pk=conversacion.pk, ultimo_mensaje_id=anterior
+    ).update(ultimo_mensaje_id=nuevo)
+    if avanzado:
+        cache_historial.agregar(conversacion.pk, anterior, (nuevo, mensaje.rol, mensaje.contenido_texto))
+    else:
+        # Otro worker guardó un mensaje en medio: nuestra entrada ya no está completa
+        cache_historial.invalidar(conversacion.pk)
+        Conversacion.objects.filter(
+            pk=conversacion.pk, ultimo_mensaje_id__lt=nuevo
+        ).update(ultimo_mensaje_id=nuevo)
+    conversacion.ultimo_mensaje_id = nuevo
+
+
+def _mensajes_recientes(conversacion):
+    """Los MAX_MENSAJES + 1 mensajes más nuevos sin resumir (caché o base de datos)."""
+    mensajes = cache_historial.obtener(conversacion.pk, conversacion.ultimo_mensaje_id)
+    if mensajes is None:
+        mensajes = list(
+            Mensaje.objects.filter(conversacion=conversacion, id_mensaje__gt=conversacion.resumen_hasta_id)
+            .order_by('-id_mensaje').values_list('id_mensaje', 'rol', 'contenido_texto')[:MAX_MENSAJES + 1]
+        )
+        cache_historial.guardar(conversacion.pk, conversacion.ultimo_mensaje_id, mensajes)
+    # La entrada puede ser anterior al último avance del resumen
+    return [m for m in mensajes if m[0] > conversacion.resumen_hasta_id]
+
+
+def estimar_tokens(texto):
+    """Estimación barata (~4 caracteres por token), suficiente para repartir el presupuesto."""
+    return len(texto) // 4 + 1
+
+
+def construir_historial(conversacion, excluir_id=None, presupuesto=PRESUPUESTO_TOKENS):
+    """
+    Devuelve (historial_gemini, resumen) para el próximo turno de `conversacion`.
+    `excluir_id` es el mensaje actual del usuario (va aparte, no en el historial).
+    """
+    # +1 para saber si quedaron mensajes sin resumir más allá del tope
+    recientes = [m for m in _mensajes_recientes(conversacion) if m[0] != excluir_id]
+    hay_mas = len(recientes) > MAX_MENSAJES
+    recientes = recientes[:MAX_MENSAJES]
+
+    # Del más nuevo al más viejo, mientras quepan
+    usados = 0
+    textuales = 0
+    for _, _, texto in recientes:
+        costo = estimar_tokens(texto)
+        if textuales and usados + costo > presupuesto:
+            break
+        usados += costo
+        textuales += 1
+
+    fuera_de_presupuesto = len(recientes) - textuales
+    if hay_mas or fuera_de_presupuesto >= RESUMIR_CADA:
+        # El resumen absorberá todo lo anterior al mensaje textual más viejo que sí cabe
+        programar_resumen(conversacion.pk, hasta_id=recientes[textuales - 1][0] - 1)
+
+    historial_gemini = [
+        {'role': 'user' if rol == 'usuario' else 'model', 'parts': [texto]}
+        for _, rol, texto in reversed(recientes[:textuales])
+    ]
+    logger.debug(f"[Historial] Conversación {conversacion.pk}: {textuales} mensajes textuales (~{usados} tokens), "
+                 f"{fuera_de_presupuesto} fuera del presupuesto, resumen {'sí' if conversacion.resumen_historial else 'no'}")
+    return historial_gemini, conversacion.resumen_historial
+
+
+def programar_resumen(conversacion_id, hasta_id):
+    """Encola la actualización del resumen (si no hay otra en curso para esa conversación)."""
+    with _resumiendo_lock:
+        if conversacion_id in _resumiendo:
+            return
+        _resumiendo.add(conversacion_id)
+    _executor_resumen.submit(_actualizar_resumen, conversacion_id, hasta_id)
+
+
+def _actualizar_resumen(conversacion_id, hasta_id):
+    try:
+        conversacion = Conversacion.objects.filter(pk=conversacion_id).only(
+            'resumen_historial', 'resumen_hasta_id').first()
+        if conversacion is None or hasta_id <= conversacion.resumen_hasta_id:
+            return
+        nuevos = list(
+            Mensaje.objects.filter(
+                conversacion_id=conversacion_id,
+                id_mensaje__gt=conversacion.resumen_hasta_id,
+                id_mensaje__lte=hasta_id,
+            ).order_by('id_mensaje').values_list('rol', 'contenido_texto')
+        )
+        if not nuevos:
+            return
+
+        resumen = resumir_historial_gemini(conversacion.resumen_historial, nuevos)
+        if not resumen:
+            return
+
+        # Update condicional: si otro worker ya avanzó el resumen, no lo pisamos
+        actualizadas = Conversacion.objects.filter(
+            pk=conversacion_id, resumen_hasta_id=conversacion.resumen_hasta_id
+        ).update(resumen_historial=resumen, resumen_hasta_id=hasta_id)
+        if actualizadas:
+            logger.info(f"[Historial] Resumen de conversación {conversacion_id} actualizado "
+                        f"({len(nuevos)} mensajes nuevos, hasta id {hasta_id})")
+    except Exception as e:
+        logger.error(f"[Historial] Error actualizando resumen de {conversacion_id}: {e}", exc_info=True)
+    finally:
+        with _resumiendo_lock:
+            _resumiendo.discard(conversacion_id)
+        close_old_connections()
@@ -0,0 +1,110 @@
+# core/leaderboard.py
+"""
+Ranking global de XP: el top en la caché compartida (alias 'compartida' de CACHES), la
+posición de cada usuario desde la BD.
+
+En la caché viven dos claves:
+- CLAVE: los TOP_N primeros (lo que muestran el chat y el dashboard) junto con la
+  generación con la que se construyeron.
+- CLAVE_GENERACION: un token aleatorio que se reemplaza en cada invalidación.
+
+La caché compartida es un FileBasedCache: no tiene add() ni incr() atómicos, así que no
+hay lock ni modificación en sitio. Quien reconstruye el top lee la generación ANTES de
+consultar la BD y la guarda con el resultado; un top cuya generación ya no es la actual
+se descarta. Así una reconstrucción que empezó antes de un cambio (XP, visibilidad) no
+puede pisar la invalidación que ese cambio hizo después de guardarse.
+
+Los cambios de XP sólo invalidan si pueden alterar el top (el usuario ya está en él o
+su XP nueva le alcanza para entrar); el resto de los mensajes del chat no escribe nada.
+Los cambios de nombre sólo se hacen desde el admin: los recoge el TTL.
+"""
+import uuid
+
+from django.core.cache import caches
+
+from .models import ProgresoUsuario
+
+TOP_N = 10
+CLAVE = 'leaderboard:v2'
+CLAVE_GENERACION = 'leaderboard:v2:generacion'
+TTL = 10 * 60  # Red de seguridad: reconstrucción completa cada 10 minutos como máximo
+
+
+def _cache():
+    return caches['compartida']
+
+
+def _construir(generacion):
+    """Top desde la BD (1 consulta sobre el índice parcial), guardado con `generacion`."""
+    filas = (
+        ProgresoUsuario.objects.filter(publico_en_leaderboard=True)
+        .order_by('-experiencia', 'usuario_id')
+        .values_list('usuario_id', 'usuario__username', 'usuario__first_name', 'experiencia', 'nivel')
+    )[:TOP_N]
+    ranking = {'generacion': generacion, 'top': [_entrada(*fila) for fila in filas]}
+    _cache().set(CLAVE, ranking, TTL)
+    return ranking
+
+
+def _entrada(usuario_id, username, first_name, experiencia, nivel):
+    return {
+        'usuario_id': usuario_id,
+        'username': username,
+        'nombre': first_name or username,
+        'experiencia': experiencia,
+        'nivel': nivel,
+    }
+
+
+def _orden(entrada):
+    # Mismo orden que _construir: más XP primero, a igual XP el usuario más antiguo
+    return (-entrada['experiencia'], entrada['usuario_id'])
+
+
+def _ranking():
+    valores = _cache().get_many([CLAVE, CLAVE_GENERACION])
+    generacion = valores.get(CLAVE_GENERACION)
+    if generacion is None:
+        generacion = invalidar()
+    ranking = valores.get(CLAVE)
+    if ranking is None or ranking['generacion'] != generacion:
+        ranking = _construir(generacion)
+    return ranking
+
+
+def top(n=TOP_N):
+    """Los n primeros (n <= TOP_N) como diccionarios."""
+    return _ranking()['top'][:n]
+
+
+def posicion(usuario_id):
+    """Posición 1-based del usuario (empates comparten posición), o None si no es público."""
+    publicos = ProgresoUsuario.objects.filter(publico_en_leaderboard=True)
+    xp = publicos.filter(usuario_id=usuario_id).values_list('experiencia', flat=True).first()
+    if xp is None:
+        return None
+    # Cantidad de usuarios con más XP que él, + 1 (cuenta sobre el índice parcial)
+    return publicos.filter(experiencia__gt=xp).count() + 1
+
+
+def actualizar_xp(usuario, experiencia, nivel, publico=True):
+    """Invalida el top si la XP nueva de `usuario` lo cambia (llamar tras guardarla)."""
+    if not publico:
+        return
+    ranking = _cache().get(CLAVE)
+    if ranking is None:
+        # Un lector puede estar reconstruyéndolo con la XP anterior
+        invalidar()
+        return
+    en_top = ranking['top']
+    if (len(en_top) < TOP_N
+            or any(e['usuario_id'] == usuario.pk for e in en_top)
+            or (-experiencia, usuario.pk) < _orden(en_top[-1])):
+        invalidar()
+
+
+def invalidar():
+    """Descarta el top cacheado (p. ej. al cambiar publico_en_leaderboard). Devuelve la generación nueva."""
+    generacion = uuid.uuid4().hex
+    _cache().set(CLAVE_GENERACION, generacion, None)
+    return generacion
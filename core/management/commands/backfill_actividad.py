@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from core.models import ActividadDiaria, Conversacion, IntentoQuiz, Mensaje
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye ActividadDiaria a partir de las tablas crudas (conversaciones, mensajes "
+        "e intentos de quiz). Es idempotente. Los repasos de flashcards no tienen historial, "
+        "así que se conservan los contadores ya registrados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help="Username: reconstruir solo ese usuario")
+        parser.add_argument('--si-vacia', action='store_true',
+                            help="No hacer nada si ActividadDiaria ya tiene filas (para el arranque)")
+
+    def handle(self, *args, **options):
+        if options['si_vacia'] and ActividadDiaria.objects.exists():
+            self.stdout.write("ActividadDiaria ya tiene datos; nada que hacer")
+            return
+
+        usuarios = User.objects.all()
+        if options['usuario']:
+            usuarios = usuarios.filter(username=options['usuario'])
+
+        total_filas = 0
+        for usuario_id in usuarios.values_list('id', flat=True).iterator():
+            total_filas += self._reconstruir(usuario_id)
+
+        self.stdout.write(self.style.SUCCESS(f"ActividadDiaria reconstruida: {total_filas} filas"))
+
+    def _reconstruir(self, usuario_id):
+        dias = defaultdict(dict)
+
+        for fila in (Conversacion.objects.filter(usuario_id=usuario_id)
+                     .values('fecha_inicio__date').annotate(n=Count('id_conversacion'))):
+            dias[fila['fecha_inicio__date']]['conversaciones'] = fila['n']
+
+        for fila in (Mensaje.objects.filter(conversacion__usuario_id=usuario_id, rol='usuario')
+                     .values('timestamp__date').annotate(n=Count('id_mensaje'))):
+            dias[fila['timestamp__date']]['mensajes'] = fila['n']
+
+        for fila in (IntentoQuiz.objects.filter(usuario_id=usuario_id, completado=True)
+                     .values('fecha__date')
+                     .annotate(n=Count('id'), suma=Sum('puntaje'), perfectos=Count('id', filter=Q(puntaje=100)))):
+            dias[fila['fecha__date']].update(
+                quizzes_completados=fila['n'], suma_puntajes=fila['suma'] or 0, quizzes_perfectos=fila['perfectos']
+            )
+
+        with transaction.atomic():
+            existentes = ActividadDiaria.objects.filter(usuario_id=usuario_id)
+            flashcards = dict(existentes.filter(flashcards_repasadas__gt=0).values_list('fecha', 'flashcards_repasadas'))
+            existentes.delete()
+            for fecha, repasadas in flashcards.items():
+                dias[fecha]['flashcards_repasadas'] = repasadas
+            ActividadDiaria.objects.bulk_create(
+                [ActividadDiaria(usuario_id=usuario_id, fecha=fecha, **contadores) for fecha, contadores in dias.items()],
+                batch_size=500
+            )
+        return len(dias)
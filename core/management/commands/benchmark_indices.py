@@ -0,0 +1,160 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import (
+    Conversacion, ErrorPronunciacion, IntentoQuiz, Mensaje, ProgresoUsuario, Quiz, RegistroError, Vocabulario,
+)
+
+LOTE = 5000
+MODELOS_CON_INDICES = [Conversacion, Mensaje, RegistroError, ErrorPronunciacion, ProgresoUsuario, Vocabulario, IntentoQuiz]
+
+
+class Command(BaseCommand):
+    help = (
+        "Siembra un dataset sintético (por defecto 1.000.000 de mensajes), muestra el plan "
+        "de ejecución y el tiempo de las consultas frecuentes sin y con los índices de "
+        "Meta.indexes, y deshace todo al terminar. Requiere DDL transaccional (PostgreSQL o SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensajes', type=int, default=1_000_000)
+        parser.add_argument('--usuarios', type=int, default=2000)
+        parser.add_argument('--mensajes-por-conversacion', type=int, default=50)
+        parser.add_argument('--repeticiones', type=int, default=5, help="Ejecuciones por consulta para la mediana")
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            raise CommandError(f"{connection.vendor} no puede deshacer DDL: el benchmark no se puede revertir")
+
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            usuario_id, conversacion_id = self._sembrar(options)
+            self.stdout.write(f"Datos sembrados en {time.perf_counter() - inicio:.1f} s")
+
+            consultas = self._consultas(usuario_id, conversacion_id)
+            despues = self._medir(consultas, options['repeticiones'])
+            self._borrar_indices()
+            antes = self._medir(consultas, options['repeticiones'])
+
+            for nombre in consultas:
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {nombre}"))
+                for etiqueta, resultados in (('SIN índices', antes), ('CON índices', despues)):
+                    plan, ms = resultados[nombre]
+                    self.stdout.write(f"-- {etiqueta}: {ms:.2f} ms (mediana)")
+                    self.stdout.write(plan)
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS("\nBenchmark terminado; datos e índices restaurados"))
+
+    def _sembrar(self, options):
+        num_usuarios = options['usuarios']
+        por_conversacion = options['mensajes_por_conversacion']
+        num_conversaciones = max(1, options['mensajes'] // por_conversacion)
+        rnd = random.Random(42)
+        ahora = timezone.now()
+
+        User.objects.bulk_create(
+            [User(username=f'bench_{n}', password='!') for n in range(num_usuarios)], batch_size=LOTE
+        )
+        usuarios = list(User.objects.filter(username__startswith='bench_').values_list('id', flat=True))
+        ProgresoUsuario.objects.bulk_create([
+            ProgresoUsuario(usuario_id=u, experiencia=rnd.randint(0, 50_000), publico_en_leaderboard=rnd.random() < 0.7)
+            for u in usuarios
+        ], batch_size=LOTE)
+        Vocabulario.objects.bulk_create([
+            Vocabulario(usuario_id=u, palabra=f'w{u}_{n}', traduccion='t',
+                        proximo_repaso=ahora + timedelta(days=rnd.randint(-30, 30)))
+            for u in usuarios for n in range(20)
+        ], batch_size=LOTE)
+        quizzes = Quiz.objects.bulk_create(
+            [Quiz(usuario_id=u, titulo='bench', idioma_tag='Inglés') for u in usuarios], batch_size=LOTE
+        )
+        IntentoQuiz.objects.bulk_create([
+            IntentoQuiz(quiz_id=q.pk, usuario_id=q.usuario_id, puntaje=rnd.randint(0, 100), completado=rnd.random() < 0.8)
+            for q in quizzes for _ in range(10)
+        ], batch_size=LOTE)
+
+        Conversacion.objects.bulk_create([
+            Conversacion(usuario_id=usuarios[n % len(usuarios)], titulo='bench', idioma_actual='es-en')
+            for n in range(num_conversaciones)
+        ], batch_size=LOTE)
+        conversaciones = list(
+            Conversacion.objects.filter(titulo='bench').values_list('id_conversacion', 'usuario_id')
+        )
+
+        lote = []
+        for conversacion, _ in conversaciones:
+            for n in range(por_conversacion):
+                lote.append(Mensaje(conversacion_id=conversacion, rol='usuario' if n % 2 == 0 else 'bot',
+                                    contenido_texto='bench'))
+                if len(lote) >= LOTE:
+                    Mensaje.objects.bulk_create(lote)
+                    lote = []
+        if lote:
+            Mensaje.objects.bulk_create(lote)
+
+        mensajes_usuario = Mensaje.objects.filter(conversacion__titulo='bench', rol='usuario')
+        errores, pronunciacion = [], []
+        filas = mensajes_usuario.values_list('id_mensaje', 'conversacion_id', 'conversacion__usuario_id')
+        for n, (mensaje_id, conversacion_id, usuario) in enumerate(filas.iterator(chunk_size=LOTE)):
+            if n % 10:
+                continue  # Un error cada 10 mensajes del usuario
+            errores.append(RegistroError(usuario_id=usuario, mensaje_id=mensaje_id, texto_original='a', texto_corregido='b'))
+            pronunciacion.append(ErrorPronunciacion(usuario_id=usuario, conversacion_id=conversacion_id,
+                                                    texto_original='a', tip_fonetico='t', confidence=0.5))
+        RegistroError.objects.bulk_create(errores, batch_size=LOTE)
+        ErrorPronunciacion.objects.bulk_create(pronunciacion, batch_size=LOTE)
+
+        self.stdout.write(
+            f"{len(usuarios)} usuarios, {len(conversaciones)} conversaciones, "
+            f"{len(conversaciones) * por_conversacion} mensajes, {len(errores)} errores"
+        )
+        self._analizar()
+        conversacion_id, usuario_id = rnd.choice(conversaciones)
+        return usuario_id, conversacion_id
+
+    def _consultas(self, usuario_id, conversacion_id):
+        """Las consultas frecuentes de las vistas, tal como las arma el ORM."""
+        ahora = timezone.now()
+        return {
+            'Mensajes de una conversación': Mensaje.objects.filter(conversacion_id=conversacion_id).order_by('timestamp'),
+            'Errores recientes del usuario': RegistroError.objects.filter(usuario_id=usuario_id).order_by('-timestamp')[:50],
+            'Errores de pronunciación recientes': (
+                ErrorPronunciacion.objects.filter(usuario_id=usuario_id).order_by('-timestamp')[:50]
+            ),
+            'Flashcards pendientes': Vocabulario.objects.filter(usuario_id=usuario_id, proximo_repaso__lte=ahora),
+            'Intentos completados': IntentoQuiz.objects.filter(usuario_id=usuario_id, completado=True).order_by('-fecha'),
+            'Top del ranking': ProgresoUsuario.objects.filter(publico_en_leaderboard=True).order_by('-experiencia', 'usuario_id')[:10],
+            'Conversaciones del usuario': Conversacion.objects.filter(usuario_id=usuario_id).order_by('-fecha_inicio'),
+        }
+
+    def _medir(self, consultas, repeticiones):
+        resultados = {}
+        for nombre, qs in consultas.items():
+            plan = qs.explain()
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                list(qs.all())  # .all() para no reutilizar la caché del queryset
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            resultados[nombre] = (plan, statistics.median(tiempos))
+        return resultados
+
+    def _borrar_indices(self):
+        with connection.cursor() as cursor:
+            for modelo in MODELOS_CON_INDICES:
+                for indice in modelo._meta.indexes:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(indice.name)}")
+        self._analizar()
+
+    def _analizar(self):
+        # Estadísticas frescas para que el planificador vea los datos sembrados
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
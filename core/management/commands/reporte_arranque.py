@@ -0,0 +1,65 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sdks import PESADOS
+
+# Lo que carga un worker de gunicorn (y `manage.py migrate` al chequear las urls)
+MODULOS_POR_DEFECTO = ['naza.wsgi', 'naza.asgi', 'naza.urls', 'core.views']
+
+# "import time: <self us> | <acumulado us> | <espacios de anidamiento><módulo>"
+_LINEA = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa los módulos de arranque en un proceso nuevo con `python -X importtime` y "
+        "muestra el tiempo total y los imports más pesados. Falla si se cuela un SDK pesado "
+        "(ver core/sdks.py) o si se supera --max-ms."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('modulos', nargs='*', default=MODULOS_POR_DEFECTO)
+        parser.add_argument('--top', type=int, default=15, help="Imports más pesados a listar")
+        parser.add_argument('--max-ms', type=float, default=None,
+                            help="Tiempo máximo de import aceptado (para CI)")
+
+    def handle(self, *args, **options):
+        filas = self._medir(options['modulos'])
+        # Los de primer nivel (sin anidar) suman el tiempo total del proceso
+        total_ms = sum(acumulado for acumulado, nivel, _ in filas if nivel == 0) / 1000
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Import de {', '.join(options['modulos'])}"))
+        self.stdout.write(f"Total: {total_ms:.0f} ms ({len(filas)} módulos)\n")
+        self.stdout.write(f"{'acumulado':>12}  módulo")
+        for acumulado, _, modulo in sorted(filas, reverse=True)[:options['top']]:
+            self.stdout.write(f"{acumulado / 1000:>9.1f} ms  {modulo}")
+
+        colados = sorted({m for _, _, m in filas if m in PESADOS})
+        if colados:
+            raise CommandError(f"SDK pesados importados al arrancar: {', '.join(colados)} (usar core.sdks)")
+        if options['max_ms'] is not None and total_ms > options['max_ms']:
+            raise CommandError(f"El arranque tarda {total_ms:.0f} ms (máximo {options['max_ms']:.0f} ms)")
+        self.stdout.write(self.style.SUCCESS("\nNingún SDK pesado se importa al arrancar"))
+
+    def _medir(self, modulos):
+        codigo = 'import django; django.setup()\n' + ''.join(f'import {m}\n' for m in modulos)
+        entorno = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'naza.settings')}
+        proceso = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', codigo],
+            cwd=settings.BASE_DIR, env=entorno, capture_output=True, text=True,
+        )
+        if proceso.returncode != 0:
+            raise CommandError(f"El import falló:\n{proceso.stderr[-2000:]}")
+
+        filas = []
+        for linea in proceso.stderr.splitlines():
+            coincidencia = _LINEA.match(linea)
+            if coincidencia:
+                _, acumulado, sangria, modulo = coincidencia.groups()
+                filas.append((int(acumulado), len(sangria) // 2, modulo))
+        return filas
@@ -0,0 +1,55 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.hechos import purgar_indices_huerfanos
+from core.reportes import procesar_siguiente, purgar_antiguos, reencolar_abandonados
+
+SEGUNDOS_ENTRE_MANTENIMIENTOS = 60 * 60
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de reportes PDF (TrabajoReporte). Pensado para correr junto a gunicorn."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help="Segundos de espera cuando la cola está vacía")
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Procesar lo pendiente y salir (útil en cron o pruebas)")
+
+    def handle(self, *args, **options):
+        self._seguir = True
+        anteriores = {sig: signal.signal(sig, self._detener) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self._bucle(options)
+        finally:
+            for sig, manejador in anteriores.items():
+                signal.signal(sig, manejador)
+
+    def _bucle(self, options):
+        self.stdout.write("Worker de reportes iniciado")
+        ultimo_mantenimiento = None  # El primero corre al arrancar
+        while self._seguir:
+            close_old_connections()
+            if ultimo_mantenimiento is None or time.monotonic() - ultimo_mantenimiento > SEGUNDOS_ENTRE_MANTENIMIENTOS:
+                reencolados, purgados = reencolar_abandonados(), purgar_antiguos()
+                if reencolados or purgados:
+                    self.stdout.write(f"{reencolados} trabajos reencolados, {purgados} purgados")
+                # Único proceso periódico: también limpia los índices de hechos de usuarios borrados
+                huerfanos = purgar_indices_huerfanos()
+                if huerfanos:
+                    self.stdout.write(f"{huerfanos} índices de hechos huérfanos borrados")
+                ultimo_mantenimiento = time.monotonic()
+
+            if procesar_siguiente():
+                continue
+            if options['una_vez']:
+                break
+            time.sleep(options['intervalo'])
+        self.stdout.write("Worker de reportes detenido")
+
+    def _detener(self, *_):
+        # Termina el trabajo en curso y sale en la próxima vuelta
+        self._seguir = False
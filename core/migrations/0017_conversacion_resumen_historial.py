@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_configuracionvoz_voice_code_native_tts_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversacion',
+            name='resumen_hasta_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversacion',
+            name='resumen_historial',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
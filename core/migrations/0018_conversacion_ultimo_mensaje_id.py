@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_conversacion_resumen_historial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversacion',
+            name='ultimo_mensaje_id',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:28
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def eliminar_duplicados(apps, schema_editor):
+    """Deja una sola fila por (usuario, dato) y por (usuario, palabra sin mayúsculas): la más antigua."""
+    UserFact = apps.get_model('core', 'UserFact')
+    Vocabulario = apps.get_model('core', 'Vocabulario')
+
+    vistos = set()
+    duplicados = []
+    for pk, usuario_id, dato in UserFact.objects.order_by('id').values_list('id', 'usuario_id', 'dato').iterator():
+        clave = (usuario_id, dato)
+        if clave in vistos:
+            duplicados.append(pk)
+        else:
+            vistos.add(clave)
+    UserFact.objects.filter(id__in=duplicados).delete()
+
+    vistos = set()
+    duplicados = []
+    for pk, usuario_id, palabra in Vocabulario.objects.order_by('id').values_list('id', 'usuario_id', 'palabra').iterator():
+        clave = (usuario_id, palabra.lower())
+        if clave in vistos:
+            duplicados.append(pk)
+        else:
+            vistos.add(clave)
+    Vocabulario.objects.filter(id__in=duplicados).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_conversacion_ultimo_mensaje_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(eliminar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userfact',
+            constraint=models.UniqueConstraint(fields=('usuario', 'dato'), name='unique_userfact_usuario_dato'),
+        ),
+        migrations.AddConstraint(
+            model_name='vocabulario',
+            constraint=models.UniqueConstraint(models.F('usuario'), django.db.models.functions.text.Lower('palabra'), name='unique_vocabulario_usuario_palabra'),
+        ),
+    ]
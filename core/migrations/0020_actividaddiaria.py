@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_unique_userfact_vocabulario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActividadDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('conversaciones', models.IntegerField(default=0)),
+                ('mensajes', models.IntegerField(default=0)),
+                ('quizzes_completados', models.IntegerField(default=0)),
+                ('suma_puntajes', models.FloatField(default=0)),
+                ('quizzes_perfectos', models.IntegerField(default=0)),
+                ('flashcards_repasadas', models.IntegerField(default=0)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actividad_diaria', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'fecha'), name='unique_actividad_usuario_fecha')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_actividaddiaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversacion',
+            index=models.Index(fields=['usuario', '-fecha_inicio'], name='conversacion_usuario_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='errorpronunciacion',
+            index=models.Index(fields=['usuario', '-timestamp'], name='errorpronun_usuario_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='intentoquiz',
+            index=models.Index(fields=['usuario', 'completado', 'fecha'], name='intentoquiz_usuario_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['conversacion', 'timestamp'], name='mensaje_conversacion_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='progresousuario',
+            index=models.Index(condition=models.Q(('publico_en_leaderboard', True)), fields=['-experiencia', 'usuario'], name='progreso_ranking_publico'),
+        ),
+        migrations.AddIndex(
+            model_name='registroerror',
+            index=models.Index(fields=['usuario', '-timestamp'], name='registroerror_usuario_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='vocabulario',
+            index=models.Index(fields=['usuario', 'proximo_repaso'], name='vocabulario_usuario_repaso'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_trabajoreporte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfact',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
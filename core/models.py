@@ -2,6 +2,8 @@ from django.db import models
 from django.utils import timezone
 from datetime import timedelta
 from django.db import models
+from django.db.models import F, Q
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User # Usaremos el User de Django
 
 class ConfiguracionVoz(models.Model):
@@ -26,6 +28,17 @@ class Conversacion(models.Model):
     idioma_actual = models.CharField(max_length=10)
     fecha_inicio = models.DateTimeField(auto_now_add=True)
 
+    # Resumen acumulado de los mensajes antiguos (los que ya no van textuales a Gemini)
+    resumen_historial = models.TextField(blank=True, default='')
+    resumen_hasta_id = models.IntegerField(default=0)  # id_mensaje del último mensaje resumido
+    # id_mensaje del último mensaje guardado: valida la caché de historial de cada worker
+    ultimo_mensaje_id = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', '-fecha_inicio'], name='conversacion_usuario_fecha'),
+        ]
+
     def __str__(self):
         return self.titulo
 
@@ -46,6 +59,11 @@ class Mensaje(models.Model):
     categoria_seguridad = models.CharField(max_length=50, blank=True, null=True)
     confianza_seguridad = models.FloatField(default=0.0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversacion', 'timestamp'], name='mensaje_conversacion_ts'),
+        ]
+
     def __str__(self):
         return f"{self.rol} en {self.conversacion.titulo}"
 
@@ -58,6 +76,11 @@ class RegistroError(models.Model):
     explicacion_regla = models.TextField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', '-timestamp'], name='registroerror_usuario_ts'),
+        ]
+
     def __str__(self):
         return f"Error de {self.usuario.username} en {self.mensaje.id_mensaje}"
 
@@ -70,6 +93,11 @@ class ErrorPronunciacion(models.Model):
     confidence = models.FloatField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', '-timestamp'], name='errorpronun_usuario_ts'),
+        ]
+
     def __str__(self):
         return f"Pronunciación de {self.usuario.username}: {self.texto_original[:20]}"
 
@@ -96,6 +124,13 @@ class ProgresoUsuario(models.Model):
     codigo_verificacion = models.CharField(max_length=6, blank=True, null=True)
     cuenta_verificada = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Índice parcial: solo las filas que entran al ranking (en MySQL, sin soporte, no se crea)
+            models.Index(fields=['-experiencia', 'usuario'], condition=Q(publico_en_leaderboard=True),
+                         name='progreso_ranking_publico'),
+        ]
+
     def __str__(self):
         return f"{self.usuario.username} - Nvl {self.nivel}"
 
@@ -103,6 +138,13 @@ class UserFact(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='hechos')
     dato = models.CharField(max_length=255) # Ej: "Es arquitecto", "Tiene un gato llamado Mishi"
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Entra en la versión del índice de hechos (core/hechos.py): editar un hecho lo invalida
+    fecha_modificacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'dato'], name='unique_userfact_usuario_dato'),
+        ]
 
     def __str__(self):
         return f"{self.usuario.username}: {self.dato}"
@@ -119,6 +161,15 @@ class Vocabulario(models.Model):
     ultimo_repaso = models.DateTimeField(auto_now_add=True)
     idioma_palabra = models.CharField(max_length=10, default='en-US') # fr-FR, en-US, etc.
     
+    class Meta:
+        constraints = [
+            # Una palabra por usuario, sin distinguir mayúsculas
+            models.UniqueConstraint(F('usuario'), Lower('palabra'), name='unique_vocabulario_usuario_palabra'),
+        ]
+        indexes = [
+            models.Index(fields=['usuario', 'proximo_repaso'], name='vocabulario_usuario_repaso'),
+        ]
+
     def __str__(self):
         return f"{self.palabra} ({self.usuario.username})"
 
@@ -126,6 +177,20 @@ class Vocabulario(models.Model):
 # SISTEMA DE QUIZZES
 # =============================================
 
+def estado_reintento(fecha_ultimo_intento, dias_cooldown, ahora=None):
+    """
+    (puede_reintentar, dias_restantes) a partir de la fecha del último intento completado.
+    Lógica dinámica: usa la config de cooldown del usuario en tiempo real.
+    """
+    if fecha_ultimo_intento is None:
+        return True, 0
+    ahora = ahora or timezone.now()
+    fecha_desbloqueo = fecha_ultimo_intento + timedelta(days=dias_cooldown)
+    if ahora >= fecha_desbloqueo:
+        return True, 0
+    return False, max(0, (fecha_desbloqueo - ahora).days + 1)
+
+
 class Quiz(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quizzes')
     titulo = models.CharField(max_length=200)
@@ -151,32 +216,18 @@ class Quiz(models.Model):
             return self.usuario.configuracionvoz.dias_cooldown
         return 3
 
+    def estado_reintento(self):
+        """(puede_reintentar, dias_restantes) con una sola consulta del último intento."""
+        ultimo = self.ultimo_intento()
+        return estado_reintento(ultimo.fecha if ultimo else None, self.get_dias_cooldown())
+
     def puede_reintentar(self):
         """True si han pasado los días configurados desde el último intento"""
-        ultimo = self.ultimo_intento()
-        if not ultimo:
-            return True
-        
-        # Lógica Dinámica: Usar la confi del usuario en tiempo real
-        dias_esp = self.get_dias_cooldown()
-        fecha_desbloqueo = ultimo.fecha + timedelta(days=dias_esp)
-        
-        return timezone.now() >= fecha_desbloqueo
+        return self.estado_reintento()[0]
 
     def dias_para_reintentar(self):
         """Días restantes para poder reintentar (cálculo dinámico)"""
-        ultimo = self.ultimo_intento()
-        if not ultimo:
-            return 0
-            
-        dias_esp = self.get_dias_cooldown()
-        fecha_desbloqueo = ultimo.fecha + timedelta(days=dias_esp)
-        
-        if timezone.now() >= fecha_desbloqueo:
-            return 0
-            
-        delta = fecha_desbloqueo - timezone.now()
-        return max(0, delta.days + 1)
+        return self.estado_reintento()[1]
 
 
 class QuizPregunta(models.Model):
@@ -217,6 +268,11 @@ class IntentoQuiz(models.Model):
     completado = models.BooleanField(default=False)
     disponible_desde = models.DateTimeField(null=True, blank=True)  # Cooldown: now + 3 días
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['usuario', 'completado', 'fecha'], name='intentoquiz_usuario_fecha'),
+        ]
+
     def __str__(self):
         return f"Intento de {self.usuario.username} en {self.quiz.titulo}: {self.puntaje}%"
 
@@ -237,4 +293,59 @@ class Nota(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Nota de {self.usuario.username}: {self.contenido[:20]}..."
\ No newline at end of file
+        return f"Nota de {self.usuario.username}: {self.contenido[:20]}..."
+
+
+class ActividadDiaria(models.Model):
+    """
+    Resumen materializado de la actividad de un usuario en un día. Se incrementa al escribir
+    (ver core/actividad.py) y el dashboard lo lee en vez de recorrer las tablas crudas.
+    """
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='actividad_diaria')
+    fecha = models.DateField()
+    conversaciones = models.IntegerField(default=0)
+    mensajes = models.IntegerField(default=0)  # Solo mensajes del usuario
+    quizzes_completados = models.IntegerField(default=0)
+    suma_puntajes = models.FloatField(default=0)
+    quizzes_perfectos = models.IntegerField(default=0)
+    flashcards_repasadas = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'fecha'], name='unique_actividad_usuario_fecha'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.username} {self.fecha}"
+
+
+class TrabajoReporte(models.Model):
+    """
+    Reporte PDF de errores generado en segundo plano por `manage.py worker_reportes`
+    (ver core/reportes.py). `clave` identifica el contenido (usuario, filtro de conversación
+    y último error): si ya hay un reporte listo con la misma clave, se reutiliza su PDF.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('listo', 'Listo'),
+        ('error', 'Error'),
+    ]
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reportes')
+    conversacion = models.ForeignKey(Conversacion, on_delete=models.CASCADE, null=True, blank=True)
+    clave = models.CharField(max_length=64)
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default='pendiente')
+    archivo = models.CharField(max_length=255, blank=True, default='')  # Ruta relativa a REPORTES_DIR
+    error = models.TextField(blank=True, default='')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion'], name='reporte_estado_fecha'),
+            models.Index(fields=['usuario', 'clave'], name='reporte_usuario_clave'),
+        ]
+
+    def __str__(self):
+        return f"Reporte {self.pk} de {self.usuario.username} ({self.estado})"
@@ -0,0 +1,71 @@
+# core/paginacion.py
+"""
+Paginación por cursor (keyset) para listas que crecen sin límite: conversaciones,
+mensajes y errores.
+
+En vez de OFFSET (que recorre y descarta todas las filas anteriores), cada página
+continúa desde la última fila de la anterior con un WHERE (fecha, id) < (f, i), que
+resuelven los índices compuestos (usuario/conversación, fecha). El id desempata filas
+con la misma fecha, así el orden es estable y ninguna fila se repite ni se salta.
+
+El cursor es opaco para el cliente: base64 de "fecha ISO|id" de la última fila servida.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(fecha, pk):
+    crudo = f"{fecha.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """(fecha, pk) a partir de un cursor de codificar_cursor; CursorInvalido si está mal formado."""
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        fecha, pk = crudo.rsplit('|', 1)
+        return datetime.fromisoformat(fecha), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise CursorInvalido(f"Cursor inválido: {cursor!r}") from e
+
+
+def limite_pedido(request, por_defecto, maximo):
+    """Tamaño de página de ?limit=, acotado a [1, maximo]."""
+    try:
+        limite = int(request.GET.get('limit', por_defecto))
+    except ValueError:
+        limite = por_defecto
+    return max(1, min(limite, maximo))
+
+
+def paginar(queryset, campo_fecha, cursor=None, limite=50, descendente=True):
+    """
+    Una página de `queryset` ordenada por (campo_fecha, pk), por defecto de la más
+    reciente a la más antigua. Devuelve (filas, next_cursor); next_cursor es None en la
+    última página. Lanza CursorInvalido si `cursor` no se puede decodificar.
+    """
+    campo_id = queryset.model._meta.pk.name
+    signo = '-' if descendente else ''
+    queryset = queryset.order_by(f'{signo}{campo_fecha}', f'{signo}{campo_id}')
+
+    if cursor:
+        fecha, pk = decodificar_cursor(cursor)
+        op = 'lt' if descendente else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{campo_fecha}__{op}': fecha}) | Q(**{campo_fecha: fecha, f'{campo_id}__{op}': pk})
+        )
+
+    # Una fila de más para saber si hay página siguiente sin hacer un COUNT
+    filas = list(queryset[:limite + 1])
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    ultima = filas[-1]
+    return filas, codificar_cursor(getattr(ultima, campo_fecha), ultima.pk)
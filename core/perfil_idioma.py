@@ -0,0 +1,107 @@
+# core/perfil_idioma.py
+"""
+Perfil de idioma de cada usuario, resuelto a partir de su ConfiguracionVoz.
+
+El chat (prompt y voz del TTS), el reconocimiento de voz (/api/stt/ y /ws/stt/) y el
+generador de quizzes necesitan lo mismo: los nombres de idioma, sus códigos ISO, los
+códigos de Google para STT y las voces y la velocidad del TTS. Antes cada vista leía
+ConfiguracionVoz y armaba sus propios mapas en cada request. Ahora el PerfilIdioma se
+calcula una vez y queda en la caché compartida (todos los workers); las vistas que
+guardan la configuración lo invalidan.
+"""
+from dataclasses import dataclass
+
+from django.core.cache import caches
+
+from .models import ConfiguracionVoz
+
+CLAVE = 'perfil_idioma:v1:{}'
+TTL = 60 * 60  # Red de seguridad por si la configuración cambia por otra vía (admin, shell)
+
+# Nombre del idioma (BD) -> código de Google (STT)
+LANG_MAP = {
+    'Español': 'es-ES', 'Inglés': 'en-US', 'Francés': 'fr-FR',
+    'Alemán': 'de-DE', 'Italiano': 'it-IT', 'Portugués': 'pt-BR',
+    'Japonés': 'ja-JP', 'Chino': 'zh-CN', 'Ruso': 'ru-RU'
+}
+
+# Nombre del idioma (BD) -> código ISO
+LANG_CODE_MAP = {
+    'Inglés': 'en', 'Español': 'es', 'Francés': 'fr', 'Alemán': 'de',
+    'Italiano': 'it', 'Portugués': 'pt', 'Japonés': 'ja',
+    'Chino': 'zh', 'Ruso': 'ru'
+}
+
+# Voz para respuestas en un idioma que no es ni el nativo ni el objetivo del usuario
+VOCES_POR_IDIOMA = {
+    'en': 'en-US-Studio-O', 'es': 'es-ES-Studio-C', 'fr': 'fr-FR-Studio-A',
+    'de': 'de-DE-Studio-C', 'it': 'it-IT-Neural2-A', 'pt': 'pt-BR-Neural2-A',
+    'ja': 'ja-JP-Neural2-B', 'zh': 'zh-CN-Wavenet-A', 'ru': 'ru-RU-Wavenet-A',
+}
+
+
+@dataclass(frozen=True)
+class PerfilIdioma:
+    """Valores por defecto = usuario sin ConfiguracionVoz."""
+    idioma_nativo: str = 'Español'
+    idioma_objetivo: str = 'Inglés'
+    iso_nativo: str = 'es'
+    iso_objetivo: str = 'en'
+    stt_principal: str = 'es-ES'
+    stt_alternativos: tuple = ('en-US',)
+    voz_objetivo: str = 'en-US-Studio-O'
+    voz_nativa: str = 'es-ES-Neural2-B'
+    velocidad: float = 1.0
+
+    @classmethod
+    def desde_config(cls, config):
+        if config is None:
+            return cls()
+        # STT: principal el idioma que quiere APRENDER; alternativos su idioma nativo, etc.
+        principal = LANG_MAP.get(config.idioma_objetivo, 'es-ES')
+        alternativos = {LANG_MAP.get(config.idioma_nativo, 'es-ES'), 'en-US', 'es-ES'}
+        alternativos.discard(principal)
+        return cls(
+            idioma_nativo=config.idioma_nativo,
+            idioma_objetivo=config.idioma_objetivo,
+            iso_nativo=LANG_CODE_MAP.get(config.idioma_nativo, 'es'),
+            iso_objetivo=LANG_CODE_MAP.get(config.idioma_objetivo, 'en'),
+            stt_principal=principal,
+            stt_alternativos=tuple(sorted(alternativos))[:3],  # Google permite máx 3
+            voz_objetivo=config.voice_code_tts,
+            voz_nativa=config.voice_code_native_tts,
+            velocidad=float(config.velocidad),
+        )
+
+    def voz_para(self, idioma_respuesta):
+        """Voz del TTS para una respuesta en `idioma_respuesta` (ej: 'es-ES', 'en-US')."""
+        lang = idioma_respuesta.split('-')[0].lower()
+        if lang == self.iso_nativo:
+            # Si Naza habla en tu idioma nativo -> Usa tu voz nativa de alta calidad
+            return self.voz_nativa
+        if lang == self.iso_objetivo:
+            # Si Naza habla en el idioma que aprendes -> Usa la voz del tutor
+            return self.voz_objetivo
+        # Terceros idiomas (ej: si aprendes Inglés pero pides una frase en Francés)
+        return VOCES_POR_IDIOMA.get(lang, self.voz_objetivo)
+
+
+def _cache():
+    return caches['compartida']
+
+
+def perfil_idioma(usuario):
+    """PerfilIdioma de `usuario` (el por defecto si es anónimo o no tiene configuración)."""
+    if usuario is None or not usuario.is_authenticated:
+        return PerfilIdioma()
+    clave = CLAVE.format(usuario.pk)
+    perfil = _cache().get(clave)
+    if perfil is None:
+        perfil = PerfilIdioma.desde_config(ConfiguracionVoz.objects.filter(usuario_id=usuario.pk).first())
+        _cache().set(clave, perfil, TTL)
+    return perfil
+
+
+def invalidar_perfil(usuario_id):
+    """Llamar después de guardar la ConfiguracionVoz del usuario."""
+    _cache().delete(CLAVE.format(usuario_id))
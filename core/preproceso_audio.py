@@ -0,0 +1,272 @@
+# core/preproceso_audio.py
+"""
+Preprocesado local del audio antes de mandarlo a Speech-to-Text (/api/stt/).
+
+1. Se detecta el contenedor por sus bytes mágicos (WAV, WebM, Ogg, MP3, FLAC, MP4) y la
+   frecuencia de muestreo declarada en su cabecera.
+2. Se decodifica a PCM de 16 bits mono a 16 kHz: los WAV con audioop (stdlib) y el resto
+   con ffmpeg.
+3. Un VAD por energía recorta el silencio del principio y del final (Google factura por
+   segundo de audio y tarda más cuanto más largo es). Si no encuentra voz no recorta nada.
+4. Se codifica en FLAC con ffmpeg (sin pérdida y ~la mitad que el PCM); sin ffmpeg se
+   manda LINEAR16.
+
+Si algo de esto no es posible (sin ffmpeg, formato raro o truncado, decodificación
+fallida) se manda el audio original declarando el encoding y la frecuencia que realmente
+tiene.
+"""
+import io
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import warnings
+import wave
+from array import array
+from collections import namedtuple
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop  # Eliminado en Python 3.13: sin él, todo se decodifica con ffmpeg
+except ImportError:
+    audioop = None
+
+logger = logging.getLogger('core')
+
+FFMPEG = shutil.which('ffmpeg')
+SEGUNDOS_TIMEOUT_FFMPEG = 15
+
+FRECUENCIA_DESTINO = 16000
+MS_POR_TRAMA = 20
+MUESTRAS_POR_TRAMA = FRECUENCIA_DESTINO * MS_POR_TRAMA // 1000
+MS_MARGEN = 250               # Audio que se conserva antes y después de la voz
+RMS_MINIMO_VOZ = 300          # Sobre 32767: por debajo es silencio aunque no haya ruido
+FACTOR_SOBRE_RUIDO = 3.0      # La voz debe superar el piso de ruido por este factor
+
+# Frecuencias que Google acepta para Opus
+FRECUENCIAS_OPUS = (8000, 12000, 16000, 24000, 48000)
+
+# contenedor: 'wav' | 'webm' | 'ogg' | 'mp3' | 'flac' | 'mp4' | None
+# encoding: nombre de speech.RecognitionConfig.AudioEncoding con el que Google lo lee tal cual
+FormatoAudio = namedtuple('FormatoAudio', 'contenedor encoding sample_rate canales')
+# contenido vacío = el audio no tiene muestras (no hace falta llamar a Google)
+AudioNormalizado = namedtuple('AudioNormalizado', 'contenido encoding sample_rate formato segundos_recortados')
+
+
+# --- Detección de formato ---
+
+def _formato_wav(datos):
+    pos = 12
+    while pos + 8 <= len(datos):
+        id_chunk, tamano = datos[pos:pos + 4], struct.unpack_from('<I', datos, pos + 4)[0]
+        if id_chunk == b'fmt ' and tamano >= 16:
+            codec, canales, frecuencia = struct.unpack_from('<HHI', datos, pos + 8)
+            bits = struct.unpack_from('<H', datos, pos + 22)[0]
+            # Google solo lee WAV con PCM de 16 bits
+            encoding = 'LINEAR16' if codec == 1 and bits == 16 else None
+            return FormatoAudio('wav', encoding, frecuencia, canales)
+        pos += 8 + tamano + (tamano & 1)
+    return FormatoAudio('wav', None, None, None)
+
+
+def _formato_webm(datos):
+    # Elementos EBML SamplingFrequency (0xB5, float) y Channels (0x9F) del primer track de audio
+    frecuencia, canales = 48000, None
+    pos = datos.find(b'\xb5\x88', 0, 4096)
+    if pos != -1 and pos + 10 <= len(datos):
+        frecuencia = int(struct.unpack_from('>d', datos, pos + 2)[0])
+    else:
+        pos = datos.find(b'\xb5\x84', 0, 4096)
+        if pos != -1 and pos + 6 <= len(datos):
+            frecuencia = int(struct.unpack_from('>f', datos, pos + 2)[0])
+    pos = datos.find(b'\x9f\x81', 0, 4096)
+    if pos != -1 and pos + 3 <= len(datos):
+        canales = datos[pos + 2]
+    return FormatoAudio('webm', 'WEBM_OPUS', frecuencia if frecuencia in FRECUENCIAS_OPUS else 48000, canales)
+
+
+def _formato_ogg(datos):
+    pos = datos.find(b'OpusHead', 0, 256)
+    if pos == -1 or pos + 16 > len(datos):
+        return FormatoAudio('ogg', None, None, None)  # Ogg Vorbis: Google no lo lee
+    canales = datos[pos + 9]
+    frecuencia = struct.unpack_from('<I', datos, pos + 12)[0]
+    return FormatoAudio('ogg', 'OGG_OPUS', frecuencia if frecuencia in FRECUENCIAS_OPUS else 48000, canales)
+
+
+_FRECUENCIAS_MP3 = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _formato_mp3(datos):
+    pos = 0
+    if datos[:3] == b'ID3' and len(datos) >= 10:
+        # Tamaño del tag ID3v2: 4 bytes "synchsafe" (7 bits útiles cada uno)
+        pos = 10 + ((datos[6] << 21) | (datos[7] << 14) | (datos[8] << 7) | datos[9])
+    fin = min(len(datos) - 4, pos + 4096)
+    while pos <= fin:
+        if datos[pos] == 0xFF and datos[pos + 1] & 0xE0 == 0xE0:
+            version, indice = (datos[pos + 1] >> 3) & 0x03, (datos[pos + 2] >> 2) & 0x03
+            if version in _FRECUENCIAS_MP3 and indice < 3:
+                canales = 1 if datos[pos + 3] >> 6 == 3 else 2
+                return FormatoAudio('mp3', 'MP3', _FRECUENCIAS_MP3[version][indice], canales)
+        pos += 1
+    return FormatoAudio('mp3', 'MP3', None, None)
+
+
+def _formato_flac(datos):
+    # STREAMINFO: 20 bits de frecuencia y 3 de canales tras los tamaños de bloque y trama
+    if len(datos) < 22:
+        return FormatoAudio('flac', 'FLAC', None, None)
+    empaquetado = int.from_bytes(datos[18:21], 'big')
+    return FormatoAudio('flac', 'FLAC', empaquetado >> 4, ((empaquetado >> 1) & 0x07) + 1)
+
+
+def detectar_formato(datos):
+    """FormatoAudio del audio según sus bytes mágicos (contenedor None si no se reconoce)."""
+    if datos[:4] == b'RIFF' and datos[8:12] == b'WAVE':
+        return _formato_wav(datos)
+    if datos[:4] == b'\x1a\x45\xdf\xa3':
+        return _formato_webm(datos)
+    if datos[:4] == b'OggS':
+        return _formato_ogg(datos)
+    if datos[:4] == b'fLaC':
+        return _formato_flac(datos)
+    if datos[4:8] == b'ftyp':
+        return FormatoAudio('mp4', None, None, None)  # AAC (Safari): Google no lo lee
+    if datos[:3] == b'ID3' or (len(datos) > 1 and datos[0] == 0xFF and datos[1] & 0xE0 == 0xE0):
+        return _formato_mp3(datos)
+    return FormatoAudio(None, None, None, None)
+
+
+# --- Decodificación a PCM 16 bits mono 16 kHz ---
+
+def _ffmpeg(argumentos, entrada=None):
+    proceso = subprocess.run(
+        [FFMPEG, '-nostdin', '-hide_banner', '-loglevel', 'error', *argumentos],
+        input=entrada, capture_output=True, timeout=SEGUNDOS_TIMEOUT_FFMPEG,
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(f"ffmpeg: {proceso.stderr.decode(errors='replace').strip()[:200]}")
+    return proceso.stdout
+
+
+def _pcm_con_ffmpeg(datos):
+    # Por archivo y no por pipe: MP4 (y algunos WebM) necesitan poder hacer seek
+    fd, ruta = tempfile.mkstemp(prefix='stt-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(datos)
+        return _ffmpeg(['-i', ruta, '-ac', '1', '-ar', str(FRECUENCIA_DESTINO), '-f', 's16le', 'pipe:1'])
+    finally:
+        os.unlink(ruta)
+
+
+def _pcm_de_wav(datos):
+    """PCM destino de un WAV PCM mono/estéreo, o None si hace falta ffmpeg."""
+    try:
+        with wave.open(io.BytesIO(datos)) as wav:
+            ancho, canales, frecuencia = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+            pcm = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if canales > 2:
+        return None
+    if ancho == 1:
+        pcm = audioop.bias(pcm, 1, -128)  # WAV de 8 bits es sin signo
+    if ancho != 2:
+        pcm = audioop.lin2lin(pcm, ancho, 2)
+    if canales == 2:
+        pcm = audioop.tomono(pcm, 2, 0.5, 0.5)
+    if frecuencia != FRECUENCIA_DESTINO:
+        pcm, _ = audioop.ratecv(pcm, 2, 1, frecuencia, FRECUENCIA_DESTINO, None)
+    return pcm
+
+
+def _decodificar(datos, formato):
+    if formato.contenedor == 'wav' and audioop is not None:
+        pcm = _pcm_de_wav(datos)
+        if pcm is not None:
+            return pcm
+    if FFMPEG and formato.contenedor is not None:
+        return _pcm_con_ffmpeg(datos)
+    return None
+
+
+# --- VAD por energía ---
+
+def _rms(trama):
+    if audioop is not None:
+        return audioop.rms(trama, 2)
+    muestras = array('h', trama)
+    return (sum(m * m for m in muestras) / len(muestras)) ** 0.5 if muestras else 0
+
+
+def limites_de_voz(pcm):
+    """
+    (inicio, fin) en bytes del tramo con voz del PCM (16 bits mono 16 kHz), con MS_MARGEN
+    de margen, o None si todo es silencio. Una trama es voz si su RMS supera el mínimo y
+    FACTOR_SOBRE_RUIDO veces el piso de ruido (percentil 10 de las tramas).
+    """
+    bytes_trama = MUESTRAS_POR_TRAMA * 2
+    energias = [_rms(pcm[i:i + bytes_trama]) for i in range(0, len(pcm) - bytes_trama + 1, bytes_trama)]
+    if not energias:
+        return None
+    piso_ruido = sorted(energias)[len(energias) // 10]
+    umbral = max(RMS_MINIMO_VOZ, piso_ruido * FACTOR_SOBRE_RUIDO)
+    con_voz = [i for i, energia in enumerate(energias) if energia > umbral]
+    if not con_voz:
+        return None
+    margen = MS_MARGEN // MS_POR_TRAMA
+    inicio = max(con_voz[0] - margen, 0) * bytes_trama
+    fin = min((con_voz[-1] + 1 + margen) * bytes_trama, len(pcm))
+    return inicio, fin
+
+
+# --- Entrada principal ---
+
+def _sin_procesar(datos, formato):
+    return AudioNormalizado(datos, formato.encoding or 'ENCODING_UNSPECIFIED', formato.sample_rate, formato, 0.0)
+
+
+def normalizar_audio(datos):
+    """
+    AudioNormalizado listo para RecognitionConfig: recortado, mono, 16 kHz y en FLAC (o
+    LINEAR16) cuando se puede; si no, el original con su encoding y frecuencia reales.
+    """
+    try:
+        formato = detectar_formato(datos)
+    except struct.error as e:
+        # Cabecera truncada (p. ej. un chunk fmt cortado): Google decidirá qué hacer con él
+        logger.warning(f"[STT] Cabecera de audio ilegible: {e}")
+        return _sin_procesar(datos, FormatoAudio(None, None, None, None))
+    try:
+        pcm = _decodificar(datos, formato)
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"[STT] No se pudo decodificar el audio ({formato.contenedor}): {e}")
+        pcm = None
+    if pcm is None:
+        return _sin_procesar(datos, formato)
+    if not pcm:
+        # Decodificó a 0 muestras: no hay nada que reconocer (ni un FLAC de solo cabecera)
+        return AudioNormalizado(b'', 'LINEAR16', FRECUENCIA_DESTINO, formato, 0.0)
+
+    total = len(pcm)
+    limites = limites_de_voz(pcm)
+    if limites is None:
+        # El VAD no encontró voz (o habla muy baja bajo RMS_MINIMO_VOZ): se manda entero
+        # en vez de descartar lo que quizás sí se dijo
+        limites = (0, total)
+    pcm = pcm[limites[0]:limites[1]]
+    recortados = (total - len(pcm)) / 2 / FRECUENCIA_DESTINO
+
+    if FFMPEG:
+        try:
+            flac = _ffmpeg(['-f', 's16le', '-ar', str(FRECUENCIA_DESTINO), '-ac', '1', '-i', 'pipe:0',
+                            '-f', 'flac', 'pipe:1'], entrada=pcm)
+            return AudioNormalizado(flac, 'FLAC', FRECUENCIA_DESTINO, formato, recortados)
+        except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"[STT] No se pudo codificar en FLAC, se manda PCM: {e}")
+    return AudioNormalizado(pcm, 'LINEAR16', FRECUENCIA_DESTINO, formato, recortados)
@@ -0,0 +1,154 @@
+# core/reportes.py
+"""
+Reportes PDF de errores generados fuera del request.
+
+Renderizar pdf_template.html con xhtml2pdf es CPU intensivo y con historiales largos
+superaba el timeout de gunicorn. Ahora la vista solo encola un TrabajoReporte y el
+proceso `manage.py worker_reportes` lo renderiza; el navegador consulta el estado y
+descarga el PDF cuando está listo.
+
+La cola es la propia tabla: el worker toma el trabajo pendiente más antiguo con un UPDATE
+condicional (estado='pendiente' -> 'procesando'), así varios workers no toman el mismo.
+Los PDF se guardan en REPORTES_DIR con nombre <clave>.pdf; la clave depende de (usuario,
+filtro de conversación, último error), así que mientras no aparezcan errores nuevos se
+reutiliza el PDF ya generado sin volver a renderizarlo.
+"""
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import RegistroError, TrabajoReporte
+from .archivos import escribir_atomico
+from .utils import pdf_desde_template
+
+logger = logging.getLogger('core')
+
+REPORTES_DIR = getattr(settings, 'REPORTES_DIR', os.path.join(settings.BASE_DIR, 'reportes_pdf'))
+DIAS_RETENCION = getattr(settings, 'REPORTES_DIAS_RETENCION', 7)
+MINUTOS_ABANDONO = 15  # Un trabajo 'procesando' por más tiempo se da por abandonado (worker caído)
+
+
+def _errores(usuario_id, conversacion_id):
+    errores = RegistroError.objects.filter(usuario_id=usuario_id).select_related('mensaje__conversacion')
+    if conversacion_id:
+        errores = errores.filter(mensaje__conversacion_id=conversacion_id)
+    return errores.order_by('-timestamp', '-id_error')
+
+
+def clave_reporte(usuario_id, conversacion_id, ultimo_error_id):
+    crudo = json.dumps(['errores', usuario_id, conversacion_id, ultimo_error_id])
+    return hashlib.sha256(crudo.encode('utf-8')).hexdigest()
+
+
+def ruta_archivo(trabajo):
+    return os.path.join(REPORTES_DIR, trabajo.archivo)
+
+
+def _listo_con_archivo(usuario_id, clave):
+    """Un trabajo ya terminado con esta clave cuyo PDF sigue en disco, o None."""
+    for trabajo in TrabajoReporte.objects.filter(usuario_id=usuario_id, clave=clave, estado='listo').order_by('-id'):
+        if os.path.exists(ruta_archivo(trabajo)):
+            return trabajo
+    return None
+
+
+def encolar_reporte_errores(usuario, conversacion=None):
+    """
+    Devuelve el TrabajoReporte para el historial de errores de `usuario` (filtrado por
+    `conversacion` si se indica): uno ya listo o en curso con el mismo contenido, o uno nuevo.
+    """
+    conversacion_id = conversacion.pk if conversacion else None
+    ultimo = _errores(usuario.pk, conversacion_id).aggregate(ultimo=Max('id_error'))['ultimo'] or 0
+    clave = clave_reporte(usuario.pk, conversacion_id, ultimo)
+
+    listo = _listo_con_archivo(usuario.pk, clave)
+    if listo is not None:
+        return listo
+    en_curso = TrabajoReporte.objects.filter(
+        usuario=usuario, clave=clave, estado__in=('pendiente', 'procesando')
+    ).order_by('-id').first()
+    if en_curso is not None:
+        return en_curso
+    return TrabajoReporte.objects.create(usuario=usuario, conversacion=conversacion, clave=clave)
+
+
+def _tomar_siguiente():
+    """Marca como 'procesando' el trabajo pendiente más antiguo y lo devuelve (None si no hay)."""
+    while True:
+        trabajo = TrabajoReporte.objects.filter(estado='pendiente').order_by('fecha_creacion', 'id').first()
+        if trabajo is None:
+            return None
+        ahora = timezone.now()
+        if TrabajoReporte.objects.filter(pk=trabajo.pk, estado='pendiente').update(estado='procesando', fecha_inicio=ahora):
+            trabajo.estado, trabajo.fecha_inicio = 'procesando', ahora
+            return trabajo
+        # Otro worker lo tomó en medio: probar con el siguiente
+
+
+def _renderizar(trabajo):
+    if trabajo.conversacion_id:
+        titulo = f"Reporte: {trabajo.conversacion.titulo}"
+    else:
+        titulo = "Resumen General"
+    contenido = pdf_desde_template('core/pdf_template.html', {
+        'usuario': trabajo.usuario,
+        'errores': _errores(trabajo.usuario_id, trabajo.conversacion_id),
+        'fecha_generacion': timezone.now(),
+        'report_title': titulo,
+    })
+    if contenido is None:
+        raise RuntimeError("xhtml2pdf no pudo generar el PDF")
+    return contenido
+
+
+def procesar_siguiente():
+    """Procesa un trabajo de la cola. Devuelve False si no había ninguno pendiente."""
+    trabajo = _tomar_siguiente()
+    if trabajo is None:
+        return False
+
+    inicio = timezone.now()
+    try:
+        # Otro trabajo con la misma clave pudo terminar mientras este esperaba en la cola
+        previo = _listo_con_archivo(trabajo.usuario_id, trabajo.clave)
+        if previo is not None:
+            archivo = previo.archivo
+        else:
+            archivo = f"{trabajo.clave}.pdf"
+            escribir_atomico(os.path.join(REPORTES_DIR, archivo), _renderizar(trabajo))
+        TrabajoReporte.objects.filter(pk=trabajo.pk).update(estado='listo', archivo=archivo, fecha_fin=timezone.now())
+        logger.info(f"[Reportes] Trabajo {trabajo.pk} listo en {(timezone.now() - inicio).total_seconds():.1f} s"
+                    f"{' (PDF reutilizado)' if previo else ''}")
+    except Exception as e:
+        logger.error(f"[Reportes] Falló el trabajo {trabajo.pk}: {e}")
+        TrabajoReporte.objects.filter(pk=trabajo.pk).update(estado='error', error=str(e), fecha_fin=timezone.now())
+    return True
+
+
+def reencolar_abandonados():
+    """Vuelve a 'pendiente' los trabajos que quedaron 'procesando' por un worker que murió."""
+    limite = timezone.now() - timedelta(minutes=MINUTOS_ABANDONO)
+    return TrabajoReporte.objects.filter(estado='procesando', fecha_inicio__lt=limite).update(estado='pendiente')
+
+
+def purgar_antiguos():
+    """Borra los trabajos terminados hace más de DIAS_RETENCION días y los PDF que nadie más usa."""
+    limite = timezone.now() - timedelta(days=DIAS_RETENCION)
+    viejos = TrabajoReporte.objects.filter(estado__in=('listo', 'error'), fecha_fin__lt=limite)
+    archivos = set(viejos.exclude(archivo='').values_list('archivo', flat=True))
+    borrados, _ = viejos.delete()
+    en_uso = set(TrabajoReporte.objects.filter(archivo__in=archivos).values_list('archivo', flat=True))
+    for archivo in archivos - en_uso:
+        try:
+            os.unlink(os.path.join(REPORTES_DIR, archivo))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"[Reportes] No se pudo borrar {archivo}: {e}")
+    return borrados
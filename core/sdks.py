@@ -0,0 +1,37 @@
+# core/sdks.py
+"""
+Acceso perezoso a los SDK pesados.
+
+google.generativeai, google.cloud.texttospeech, google.cloud.speech y xhtml2pdf tardan
+entre medio y un segundo cada uno en importarse. Importados a nivel de módulo en
+core.views/core.utils, los pagaba cada `manage.py` (migrate, shell, createsuperuser: el
+chequeo del sistema carga las urls y con ellas las vistas) y cada arranque de worker.
+
+Los módulos de la app no los importan directamente: llaman a estas funciones en el
+momento de usarlos. La primera llamada importa el SDK; las siguientes lo sacan de
+sys.modules. `manage.py reporte_arranque` mide el resultado.
+"""
+
+
+def genai():
+    import google.generativeai as genai
+    return genai
+
+
+def texttospeech():
+    from google.cloud import texttospeech
+    return texttospeech
+
+
+def speech():
+    from google.cloud import speech
+    return speech
+
+
+def pisa():
+    from xhtml2pdf import pisa
+    return pisa
+
+
+# Módulos que ningún import de arranque debe traer (lo verifica reporte_arranque)
+PESADOS = ('google.generativeai', 'google.cloud.texttospeech', 'google.cloud.speech', 'xhtml2pdf')
@@ -101,8 +101,8 @@ async function enviarAlChat(texto) {
         statusText.innerText = "Listo.";
 
         // PASO C: Reproducir Audio
-        if (data.audio_base64) {
-            const audio = new Audio("data:audio/mp3;base64," + data.audio_base64);
+        if (data.audio_url) {
+            const audio = new Audio(data.audio_url);
             audio.play();
         }
     }
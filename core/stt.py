@@ -0,0 +1,96 @@
+# core/stt.py
+"""
+Reconocimiento de voz (Google Cloud Speech-to-Text).
+
+- `idiomas_reconocimiento`: idioma principal y alternativos según el perfil de idioma del
+  usuario (lo usan la API de una sola llamada y la de streaming).
+- `reconocer_en_streaming`: puente bloqueante hacia `streaming_recognize`. Consume los
+  fragmentos de audio de una cola a medida que llegan y emite transcripciones parciales;
+  el resultado final queda listo apenas termina el habla, en vez de empezar a reconocer
+  recién cuando se sube la grabación completa.
+"""
+import logging
+
+from . import sdks
+from .clientes_google import ERRORES_DE_CANAL, cliente_stt
+from .perfil_idioma import PerfilIdioma, perfil_idioma
+
+logger = logging.getLogger('core')
+
+FIN_DE_AUDIO = None  # Centinela en la cola de fragmentos
+
+
+def idiomas_reconocimiento(usuario):
+    """(idioma principal, [alternativos]) para el reconocimiento de `usuario`."""
+    try:
+        perfil = perfil_idioma(usuario)
+    except Exception as e:
+        logger.warning(f"[STT] Error cargando config de voz del usuario: {e}")
+        perfil = PerfilIdioma()
+    return perfil.stt_principal, list(perfil.stt_alternativos)
+
+
+def config_streaming(primary_lang, alternative_langs):
+    """Config para audio del MediaRecorder del navegador (WebM/Opus a 48 kHz) con resultados parciales."""
+    speech = sdks.speech()
+    return speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
+            sample_rate_hertz=48000,
+            language_code=primary_lang,
+            alternative_language_codes=alternative_langs,
+            enable_automatic_punctuation=True,
+        ),
+        interim_results=True,
+    )
+
+
+def _peticiones(fragmentos):
+    speech = sdks.speech()
+    while True:
+        fragmento = fragmentos.get()
+        if fragmento is FIN_DE_AUDIO:
+            return
+        yield speech.StreamingRecognizeRequest(audio_content=fragmento)
+
+
+def reconocer_en_streaming(primary_lang, alternative_langs, fragmentos, emitir):
+    """
+    Bloqueante (correr en un hilo). Lee bytes de audio de la cola `fragmentos` hasta
+    FIN_DE_AUDIO y llama a emitir(dict) con:
+      {'tipo': 'parcial', 'transcript'} mientras se habla, y al terminar
+      {'tipo': 'final', 'transcript', 'detected_lang', 'confidence'}.
+    """
+    finales, confianzas = [], []
+    detected_lang = primary_lang
+    cliente = cliente_stt.obtener()
+    try:
+        respuestas = cliente.streaming_recognize(
+            config=config_streaming(primary_lang, alternative_langs), requests=_peticiones(fragmentos)
+        )
+        for respuesta in respuestas:
+            for resultado in respuesta.results:
+                if not resultado.alternatives:
+                    continue
+                alternativa = resultado.alternatives[0]
+                if resultado.language_code:
+                    # Google nos dice qué idioma detectó realmente
+                    detected_lang = resultado.language_code
+                if resultado.is_final:
+                    finales.append(alternativa.transcript.strip())
+                    confianzas.append(alternativa.confidence)
+                else:
+                    emitir({'tipo': 'parcial', 'transcript': ' '.join(finales + [alternativa.transcript.strip()])})
+    except ERRORES_DE_CANAL:
+        # El audio ya consumido no se puede repetir: no se reintenta, pero el próximo
+        # reconocimiento usará un cliente nuevo
+        cliente_stt.invalidar(cliente)
+        raise
+
+    emitir({
+        'tipo': 'final',
+        'transcript': ' '.join(finales),
+        'detected_lang': detected_lang,
+        'confidence': sum(confianzas) / len(confianzas) if confianzas else 0.0,
+    })
+
@@ -1,3 +1,779 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import time
+import wave
+from array import array
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import clientes_google, hechos, historial, leaderboard, preproceso_audio, reportes, utils
+from .gemini_pool import ABIERTO, SEMIABIERTO, PoolGemini
+from .tts_cache import CacheAudioTTS, hash_audio
+from .perfil_idioma import PerfilIdioma, perfil_idioma
+from .actividad import registrar_actividad
+from .models import (
+    ActividadDiaria, ConfiguracionVoz, Conversacion, ErrorPronunciacion, IntentoQuiz, Mensaje, ProgresoUsuario, Quiz,
+    QuizPregunta, RegistroError, RespuestaIntento, TrabajoReporte, UserFact, Vocabulario,
+)
+
+
+CACHES_PRUEBAS = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'compartida': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas'},
+}
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}, CACHES=CACHES_PRUEBAS)
+class QuizDashboardConsultasTests(TestCase):
+    """quiz_dashboard debe resolverse con un número fijo de consultas, sin importar los datos."""
+
+    # Sesión + usuario (2), progreso (1), quizzes anotados + cooldown (2), totales (1),
+    # vocabulario (1), actividad de 30 días (1), categorías (1). El top 5 sale de la caché.
+    CONSULTAS_DASHBOARD = 9
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='clave-segura-123')
+        ConfiguracionVoz.objects.create(usuario=self.user, dias_cooldown=3)
+        ProgresoUsuario.objects.create(usuario=self.user)
+        self.client.force_login(self.user)
+        caches['compartida'].clear()
+        leaderboard.top()
+
+    def _crear_datos(self, num_quizzes, desde=0):
+        for n in range(desde, desde + num_quizzes):
+            quiz = Quiz.objects.create(usuario=self.user, titulo=f'Quiz {n}', idioma_tag='Inglés')
+            pregunta = QuizPregunta.objects.create(
+                quiz=quiz, numero=1, pregunta='¿?', opcion_a='a', opcion_b='b', opcion_c='c',
+                opcion_d='d', respuesta_correcta=0, categoria='gramatica'
+            )
+            for puntaje in (50, 100):
+                intento = IntentoQuiz.objects.create(quiz=quiz, usuario=self.user, puntaje=puntaje, completado=True)
+                RespuestaIntento.objects.create(intento=intento, pregunta=pregunta, respuesta_usuario=0, es_correcta=puntaje == 100)
+            conversacion = Conversacion.objects.create(usuario=self.user, titulo=f'C{n}', idioma_actual='es-en')
+            Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto='hola')
+            Vocabulario.objects.create(usuario=self.user, palabra=f'word{n}', traduccion='palabra')
+        call_command('backfill_actividad', stdout=StringIO())
+
+    def test_cantidad_de_consultas_no_crece_con_los_quizzes(self):
+        for num_quizzes, desde in ((1, 0), (5, 1)):
+            self._crear_datos(num_quizzes, desde)
+            with self.assertNumQueries(self.CONSULTAS_DASHBOARD):
+                response = self.client.get(reverse('quiz_dashboard'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_estado_de_cada_quiz(self):
+        self._crear_datos(2)
+        response = self.client.get(reverse('quiz_dashboard'))
+        ctx = response.context
+        self.assertEqual(ctx['total_quizzes'], 2)
+        self.assertEqual(ctx['total_intentos'], 4)
+        self.assertEqual(ctx['score_acumulativo'], 75.0)
+        for item in ctx['quizzes_data']:
+            self.assertEqual(item['mejor_puntaje'], 100)
+            self.assertEqual(item['num_intentos'], 2)
+            # Mismo resultado que los métodos del modelo
+            self.assertEqual(item['puede_reintentar'], item['quiz'].puede_reintentar())
+            self.assertEqual(item['dias_restantes'], item['quiz'].dias_para_reintentar())
+        gramatica = next(s for s in ctx['skill_progress'] if s['name'] == 'Gramática')
+        self.assertEqual((gramatica['total'], gramatica['correct'], gramatica['accuracy']), (4, 2, 50))
+
+    def test_quiz_sin_intentos_recientes_se_puede_reintentar(self):
+        self._crear_datos(1)
+        IntentoQuiz.objects.update(fecha=timezone.now() - timedelta(days=10))
+        item = self.client.get(reverse('quiz_dashboard')).context['quizzes_data'][0]
+        self.assertTrue(item['puede_reintentar'])
+        self.assertEqual(item['dias_restantes'], 0)
+
+
+class ActividadDiariaTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='leo', password='clave-segura-123')
+
+    def test_registrar_actividad_acumula_en_la_fila_del_dia(self):
+        registrar_actividad(self.user, mensajes=1)
+        registrar_actividad(self.user, mensajes=1, conversaciones=1)
+        fila = ActividadDiaria.objects.get(usuario=self.user)
+        self.assertEqual((fila.mensajes, fila.conversaciones), (2, 1))
+
+    def test_borrar_una_conversacion_la_descuenta(self):
+        conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto='hola')
+        Mensaje.objects.create(conversacion=conversacion, rol='bot', contenido_texto='hi')
+        registrar_actividad(self.user, conversaciones=2, mensajes=3)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('delete_chat', args=[conversacion.pk]))
+        fila = ActividadDiaria.objects.get(usuario=self.user)
+        self.assertEqual((fila.conversaciones, fila.mensajes), (1, 2))
+
+    def test_fallo_al_descontar_no_impide_borrar(self):
+        from django.db import DatabaseError
+        conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        self.client.force_login(self.user)
+        with mock.patch('core.actividad._descontar', side_effect=DatabaseError('fallo')):
+            self.client.post(reverse('delete_chat', args=[conversacion.pk]))
+        self.assertFalse(Conversacion.objects.filter(pk=conversacion.pk).exists())
+
+    def test_backfill_conserva_los_repasos_de_flashcards(self):
+        conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto='hola')
+        Mensaje.objects.create(conversacion=conversacion, rol='bot', contenido_texto='hi')
+        registrar_actividad(self.user, flashcards_repasadas=3)
+
+        call_command('backfill_actividad', stdout=StringIO())
+        call_command('backfill_actividad', stdout=StringIO())
+
+        fila = ActividadDiaria.objects.get(usuario=self.user)
+        self.assertEqual((fila.conversaciones, fila.mensajes, fila.flashcards_repasadas), (1, 1, 3))
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class LeaderboardTests(TestCase):
+
+    def setUp(self):
+        caches['compartida'].clear()
+        self.usuarios = []
+        for n, xp in enumerate((300, 200, 200, 50)):
+            usuario = User.objects.create_user(username=f'u{n}', password='clave-segura-123')
+            ProgresoUsuario.objects.create(usuario=usuario, experiencia=xp)
+            self.usuarios.append(usuario)
+
+    def test_posicion_con_empates(self):
+        self.assertEqual([leaderboard.posicion(u.id) for u in self.usuarios], [1, 2, 2, 4])
+
+    def test_actualizar_xp_sin_tocar_la_bd(self):
+        leaderboard.top()
+        ultimo = self.usuarios[-1]
+        ProgresoUsuario.objects.filter(usuario=ultimo).update(experiencia=500)
+        with self.assertNumQueries(0):
+            leaderboard.actualizar_xp(ultimo, 500, 6)
+        self.assertEqual(leaderboard.top(1)[0]['usuario_id'], ultimo.id)
+        self.assertEqual(leaderboard.posicion(self.usuarios[0].id), 2)
+
+    @mock.patch.object(leaderboard, 'TOP_N', 2)
+    def test_xp_que_no_alcanza_el_top_no_lo_invalida(self):
+        leaderboard.top()
+        ultimo = self.usuarios[-1]
+        ProgresoUsuario.objects.filter(usuario=ultimo).update(experiencia=60)
+        leaderboard.actualizar_xp(ultimo, 60, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([e['usuario_id'] for e in leaderboard.top()],
+                             [u.id for u in self.usuarios[:2]])
+
+    def test_reconstruccion_vieja_no_pisa_una_invalidacion(self):
+        # Un lector leyó la generación, luego alguien se ocultó e invalidó, y recién
+        # entonces el lector guarda su top: ese top queda descartado.
+        generacion_leida = leaderboard.invalidar()
+        ProgresoUsuario.objects.filter(usuario=self.usuarios[0]).update(publico_en_leaderboard=False)
+        leaderboard.invalidar()
+        leaderboard._construir(generacion_leida)
+        with self.assertNumQueries(1):
+            self.assertNotIn(self.usuarios[0].id, [e['usuario_id'] for e in leaderboard.top()])
+
+    def test_ocultarse_del_ranking_invalida_la_cache(self):
+        self.client.force_login(self.usuarios[0])
+        self.client.get(reverse('api_leaderboard'))
+        self.client.post(reverse('api_game_settings'), {'mostrar': True, 'publico': False},
+                         content_type='application/json')
+        data = self.client.get(reverse('api_leaderboard')).json()
+        self.assertIsNone(data['mi_posicion'])
+        self.assertNotIn('u0', [e['username'] for e in data['leaderboard']])
+
+
+class PaginacionCursorTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='eva', password='clave-segura-123')
+        self.client.force_login(self.user)
+
+    def _recorrer(self, url, clave, limite):
+        vistos, cursor = [], None
+        while True:
+            params = {'limit': limite, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get(url, params).json()
+            vistos.append(data[clave])
+            cursor = data['next_cursor']
+            if not cursor:
+                return vistos
+
+    def test_conversaciones_con_la_misma_fecha_no_se_repiten_ni_se_saltan(self):
+        ids = [Conversacion.objects.create(usuario=self.user, titulo=f'C{n}', idioma_actual='es-en').pk
+               for n in range(5)]
+        Conversacion.objects.update(fecha_inicio=timezone.now())  # Empate total: desempata el id
+
+        paginas = self._recorrer(reverse('get_conversations'), 'conversaciones', 2)
+
+        self.assertEqual([len(p) for p in paginas], [2, 2, 1])
+        self.assertEqual([c['id'] for p in paginas for c in p], sorted(ids, reverse=True))
+
+    def test_mensajes_de_la_mas_reciente_hacia_atras_en_orden_cronologico(self):
+        conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        for n in range(5):
+            Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto=str(n))
+
+        url = reverse('get_conversation_detail', args=[conversacion.pk])
+        paginas = self._recorrer(url, 'mensajes', 3)
+
+        self.assertEqual([[m['contenido'] for m in p] for p in paginas], [['2', '3', '4'], ['0', '1']])
+
+    def test_cursor_invalido(self):
+        response = self.client.get(reverse('get_conversations'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportarConversacionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='iris', password='clave-segura-123')
+        self.client.force_login(self.user)
+        self.conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        for n in range(3):
+            mensaje = Mensaje.objects.create(conversacion=self.conversacion, rol='usuario', contenido_texto=f'ñ{n}')
+        RegistroError.objects.create(usuario=self.user, mensaje=mensaje, texto_original='a', texto_corregido='b')
+        ErrorPronunciacion.objects.create(usuario=self.user, conversacion=self.conversacion, texto_original='a',
+                                          tip_fonetico='t', confidence=0.4)
+        self.url = reverse('export_conversation', args=[self.conversacion.pk])
+
+    def test_json(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['conversacion']['titulo'], 'C')
+        self.assertEqual([m['contenido_texto'] for m in data['mensajes']], ['ñ0', 'ñ1', 'ñ2'])
+        self.assertEqual((len(data['errores']), len(data['errores_pronunciacion'])), (1, 1))
+
+    def test_ndjson(self):
+        response = self.client.get(self.url, {'formato': 'ndjson'})
+        lineas = [json.loads(linea) for linea in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([l['tipo'] for l in lineas],
+                         ['conversacion', 'mensaje', 'mensaje', 'mensaje', 'error', 'error_pronunciacion'])
+
+    def test_conversacion_ajena(self):
+        otro = User.objects.create_user(username='otro', password='clave-segura-123')
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ReportesPdfTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='noa', password='clave-segura-123')
+        self.client.force_login(self.user)
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        patcher = mock.patch.object(reportes, 'REPORTES_DIR', self.directorio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+
+    def _error(self):
+        mensaje = Mensaje.objects.create(conversacion=self.conversacion, rol='usuario', contenido_texto='x')
+        RegistroError.objects.create(usuario=self.user, mensaje=mensaje, texto_original='a', texto_corregido='b')
+
+    def test_se_encola_y_el_worker_lo_genera(self):
+        self._error()
+        response = self.client.get(reverse('export_pdf'))
+        self.assertTemplateUsed(response, 'core/reporte_pendiente.html')
+        trabajo = TrabajoReporte.objects.get()
+
+        with mock.patch.object(reportes, 'pdf_desde_template', return_value=b'%PDF-prueba') as renderizar:
+            call_command('worker_reportes', '--una-vez', stdout=StringIO())
+        self.assertEqual(renderizar.call_count, 1)
+
+        estado = self.client.get(reverse('estado_reporte', args=[trabajo.pk])).json()
+        self.assertEqual(estado['estado'], 'listo')
+        descarga = self.client.get(estado['url_descarga'])
+        self.assertEqual(b''.join(descarga.streaming_content), b'%PDF-prueba')
+
+        # Sin errores nuevos se sirve el mismo PDF directamente, sin otro trabajo
+        response = self.client.get(reverse('export_pdf'))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(TrabajoReporte.objects.count(), 1)
+
+    def test_un_error_nuevo_invalida_el_pdf(self):
+        self._error()
+        with mock.patch.object(reportes, 'pdf_desde_template', return_value=b'%PDF-1'):
+            self.client.post(reverse('encolar_reporte'))
+            call_command('worker_reportes', '--una-vez', stdout=StringIO())
+        self._error()
+        data = self.client.post(reverse('encolar_reporte')).json()
+        self.assertEqual(data['estado'], 'pendiente')
+        self.assertEqual(TrabajoReporte.objects.count(), 2)
+
+    def test_el_mantenimiento_corre_al_arrancar(self):
+        # Host recién encendido: el reloj monotónico todavía no pasó la hora
+        with mock.patch('core.management.commands.worker_reportes.time.monotonic', return_value=10.0), \
+                mock.patch('core.management.commands.worker_reportes.reencolar_abandonados',
+                           return_value=0) as reencolar:
+            call_command('worker_reportes', '--una-vez', stdout=StringIO())
+        reencolar.assert_called_once()
+
+
+def _reconocer_falso(primary_lang, alternative_langs, fragmentos, emitir):
+    """Sustituto de Google: "transcribe" cada fragmento como su texto."""
+    partes = []
+    while (fragmento := fragmentos.get()) is not None:
+        partes.append(fragmento.decode())
+        emitir({'tipo': 'parcial', 'transcript': ' '.join(partes)})
+    emitir({'tipo': 'final', 'transcript': ' '.join(partes), 'detected_lang': primary_lang, 'confidence': 0.9})
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class SttWebSocketTests(TransactionTestCase):
+
+    def setUp(self):
+        caches['compartida'].clear()
+        self.user = User.objects.create_user(username='ona', password='clave-segura-123')
+        ConfiguracionVoz.objects.create(usuario=self.user, idioma_objetivo='Francés', idioma_nativo='Español')
+        self.client.force_login(self.user)
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+    def _conectar(self, origen='http://testserver'):
+        from naza.asgi import application
+        cabeceras = [(b'host', b'testserver'), (b'origin', origen.encode()), (b'cookie', self.cookie.encode())]
+        return ApplicationCommunicator(application, {'type': 'websocket', 'path': '/ws/stt/', 'headers': cabeceras})
+
+    @mock.patch('core.ws_stt.reconocer_en_streaming', _reconocer_falso)
+    def test_parciales_y_resultado_final(self):
+        async def conversar():
+            ws = self._conectar()
+            await ws.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await ws.receive_output(5))['type'], 'websocket.accept')
+            await ws.send_input({'type': 'websocket.receive', 'bytes': b'bonjour'})
+            parcial = json.loads((await ws.receive_output(5))['text'])
+            await ws.send_input({'type': 'websocket.receive', 'text': 'fin'})
+            final = json.loads((await ws.receive_output(5))['text'])
+            cierre = await ws.receive_output(5)
+            return parcial, final, cierre
+
+        parcial, final, cierre = async_to_sync(conversar)()
+        self.assertEqual(parcial, {'tipo': 'parcial', 'transcript': 'bonjour'})
+        self.assertEqual((final['tipo'], final['transcript'], final['detected_lang']), ('final', 'bonjour', 'fr-FR'))
+        self.assertEqual(cierre, {'type': 'websocket.close', 'code': 1000})
+
+    def test_rechaza_otro_origen(self):
+        async def conectar():
+            ws = self._conectar(origen='https://evil.example')
+            await ws.send_input({'type': 'websocket.connect'})
+            return await ws.receive_output(5)
+
+        self.assertEqual(async_to_sync(conectar)(), {'type': 'websocket.close', 'code': 4403})
+
+    def test_proceso_websocket_no_atiende_http(self):
+        from naza.asgi import websocket_application
+
+        async def pedir():
+            http = ApplicationCommunicator(websocket_application, {'type': 'http', 'method': 'GET', 'path': '/'})
+            await http.send_input({'type': 'http.request', 'body': b''})
+            return await http.receive_output(5)
+
+        self.assertEqual(async_to_sync(pedir)()['status'], 404)
+
+
+class ClientesGoogleTests(TestCase):
+
+    def _gestionado(self, fabrica=None):
+        self.creados = []
+
+        def crear():
+            cliente = mock.Mock(transport=object())  # Sin grpc_channel: verificar() no toca la red
+            self.creados.append(cliente)
+            return cliente
+
+        return clientes_google.ClienteGestionado('Prueba', fabrica or crear)
+
+    def test_recrea_tras_error_de_canal(self):
+        from google.api_core import exceptions as google_exceptions
+        gestionado = self._gestionado()
+        llamadas = []
+
+        def reconocer(cliente):
+            llamadas.append(cliente)
+            if len(llamadas) == 1:
+                raise google_exceptions.ServiceUnavailable('canal caído')
+            return 'ok'
+
+        self.assertEqual(gestionado.llamar(reconocer), 'ok')
+        self.assertEqual(len(self.creados), 2)
+        self.assertIs(llamadas[1], self.creados[1])
+        self.assertEqual(gestionado.reconexiones, 1)
+
+    def test_reinicio_tras_fork_descarta_clientes_heredados(self):
+        gestionado = self._gestionado()
+        heredado = gestionado.obtener()
+        self.assertIn(gestionado, clientes_google.clientes_registrados())
+        clientes_google.reiniciar_tras_fork()
+        self.assertIsNot(gestionado.obtener(), heredado)
+        self.assertEqual(gestionado.creaciones, 2)
+
+    def test_precalentar_crea_y_no_propaga_fallos(self):
+        gestionado = self._gestionado()
+        roto = clientes_google.ClienteGestionado('Roto', mock.Mock(side_effect=RuntimeError('sin credenciales')))
+        self.assertEqual(clientes_google.precalentar([gestionado, roto]), {'Prueba': True, 'Roto': False})
+        self.assertEqual(gestionado.creaciones, 1)
+        gestionado.obtener()  # Ya estaba creado: el primer uso no paga la creación
+        self.assertEqual(gestionado.creaciones, 1)
+
+
+def _wav(segundos_silencio, segundos_tono, frecuencia=44100, canales=2):
+    """WAV PCM de 16 bits: silencio, un tono de 440 Hz y el mismo silencio al final."""
+    silencio = [0] * int(segundos_silencio * frecuencia)
+    tono = [int(8000 * math.sin(2 * math.pi * 440 * i / frecuencia)) for i in range(int(segundos_tono * frecuencia))]
+    muestras = array('h', [m for m in silencio + tono + silencio for _ in range(canales)])
+    salida = io.BytesIO()
+    with wave.open(salida, 'wb') as wav:
+        wav.setnchannels(canales)
+        wav.setsampwidth(2)
+        wav.setframerate(frecuencia)
+        wav.writeframes(muestras.tobytes())
+    return salida.getvalue()
+
+
+@mock.patch.object(preproceso_audio, 'FFMPEG', None)
+class PreprocesoAudioTests(TestCase):
+
+    def test_detecta_contenedor_y_frecuencia(self):
+        opus = b'OggS' + bytes(24) + b'OpusHead' + bytes([1, 1, 0x38, 0x01]) + (16000).to_bytes(4, 'little')
+        flac = b'fLaC' + bytes(14) + ((44100 << 4) | (1 << 1)).to_bytes(3, 'big') + bytes(10)
+        mp3 = b'\xff\xfb\x90\xc4' + bytes(100)
+        detectar = preproceso_audio.detectar_formato
+        self.assertEqual(detectar(_wav(0, 0.1)), ('wav', 'LINEAR16', 44100, 2))
+        self.assertEqual(detectar(b'\x1a\x45\xdf\xa3' + bytes(40))[:3], ('webm', 'WEBM_OPUS', 48000))
+        self.assertEqual(detectar(opus), ('ogg', 'OGG_OPUS', 16000, 1))
+        self.assertEqual(detectar(flac), ('flac', 'FLAC', 44100, 2))
+        self.assertEqual(detectar(mp3), ('mp3', 'MP3', 44100, 1))
+        self.assertIsNone(detectar(b'no es audio').contenedor)
+
+    def test_wav_recortado_mono_16k(self):
+        audio = preproceso_audio.normalizar_audio(_wav(1.0, 0.5))
+        self.assertEqual((audio.encoding, audio.sample_rate), ('LINEAR16', 16000))
+        segundos = len(audio.contenido) / 2 / 16000
+        # El tono más el margen de cada lado; el resto del silencio se recorta
+        self.assertAlmostEqual(segundos, 0.5 + 2 * preproceso_audio.MS_MARGEN / 1000, delta=0.05)
+        self.assertGreater(audio.segundos_recortados, 1.4)
+
+    def test_formato_no_decodificable_se_manda_tal_cual(self):
+        webm = b'\x1a\x45\xdf\xa3' + bytes(40)
+        audio = preproceso_audio.normalizar_audio(webm)
+        self.assertEqual((audio.contenido, audio.encoding, audio.sample_rate), (webm, 'WEBM_OPUS', 48000))
+
+    def test_wav_con_fmt_truncado_se_manda_tal_cual(self):
+        wav = b'RIFF' + struct.pack('<I', 24) + b'WAVE' + b'fmt ' + struct.pack('<I', 16) + bytes(4)
+        audio = preproceso_audio.normalizar_audio(wav)
+        self.assertEqual((audio.contenido, audio.encoding), (wav, 'ENCODING_UNSPECIFIED'))
+
+    @mock.patch.object(preproceso_audio, 'FFMPEG', 'ffmpeg')
+    def test_wav_sin_muestras_no_se_codifica_ni_se_manda(self):
+        with mock.patch.object(preproceso_audio, '_ffmpeg') as ffmpeg:
+            audio = preproceso_audio.normalizar_audio(_wav(0, 0))
+        self.assertEqual(audio.contenido, b'')
+        ffmpeg.assert_not_called()
+
+    def test_sin_voz_detectada_se_manda_entero(self):
+        audio = preproceso_audio.normalizar_audio(_wav(1.0, 0))
+        self.assertEqual((audio.encoding, audio.sample_rate, audio.segundos_recortados), ('LINEAR16', 16000, 0.0))
+        self.assertEqual(len(audio.contenido), 2 * 16000 * 2)
+
+    def test_silencio_llega_a_google_sin_recortar(self):
+        user = User.objects.create_user(username='pau', password='clave-segura-123')
+        self.client.force_login(user)
+        with mock.patch.object(clientes_google.cliente_stt, 'llamar', return_value=mock.Mock(results=[])) as llamar:
+            response = self.client.post(
+                reverse('api_stt'), json.dumps({'audio_base64': base64.b64encode(_wav(1.0, 0)).decode()}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.json()['transcript'], '')
+        llamar.assert_called_once()
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class PerfilIdiomaTests(TestCase):
+
+    def setUp(self):
+        caches['compartida'].clear()
+        self.user = User.objects.create_user(username='leo', password='clave-segura-123')
+        ConfiguracionVoz.objects.create(
+            usuario=self.user, idioma_nativo='Español', idioma_objetivo='Francés',
+            voice_code_tts='fr-FR-Neural2-A', voice_code_native_tts='es-ES-Neural2-B', velocidad=0.9,
+        )
+
+    def test_se_resuelve_una_vez_y_queda_en_cache(self):
+        with self.assertNumQueries(1):
+            perfil = perfil_idioma(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(perfil_idioma(self.user), perfil)
+        self.assertEqual((perfil.stt_principal, perfil.stt_alternativos), ('fr-FR', ('en-US', 'es-ES')))
+        self.assertEqual(perfil.voz_para('fr-FR'), 'fr-FR-Neural2-A')
+        self.assertEqual(perfil.voz_para('es-ES'), 'es-ES-Neural2-B')
+        self.assertEqual(perfil.voz_para('de-DE'), 'de-DE-Studio-C')
+
+    def test_guardar_la_configuracion_invalida_el_perfil(self):
+        self.assertEqual(perfil_idioma(self.user).velocidad, 0.9)
+        self.client.force_login(self.user)
+        self.client.post(reverse('api_voice_save'), json.dumps({'speed': 1.25}), content_type='application/json')
+        self.assertEqual(perfil_idioma(self.user).velocidad, 1.25)
+
+    def test_usuario_sin_configuracion(self):
+        otro = User.objects.create_user(username='sin-config', password='clave-segura-123')
+        self.assertEqual(perfil_idioma(otro), PerfilIdioma())
+
+
+class ReporteArranqueTests(TestCase):
+
+    def test_arranque_sin_sdks_pesados(self):
+        salida = StringIO()
+        call_command('reporte_arranque', top=3, stdout=salida)  # CommandError si se cuela alguno
+        self.assertIn('Ningún SDK pesado', salida.getvalue())
+
+
+class CacheAudioTTSTests(TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        self.cache = CacheAudioTTS(self.directorio, max_bytes_disco=2500)
+
+    def test_eviccion_borra_indices_y_respeta_conservados(self):
+        conservado = b'c' * 1000
+        hash_conservado = self.cache.guardar_blob(conservado, conservar=True)
+        for n in range(3):
+            self.cache.guardar(f'clave{n}', bytes([n]) * 1000)
+        self.cache._aplicar_tope_disco()
+
+        desalojados = [n for n in range(3) if not os.path.exists(self.cache.ruta_blob(hash_audio(bytes([n]) * 1000)))]
+        self.assertTrue(desalojados)
+        for n in desalojados:
+            self.assertFalse(os.path.exists(self.cache._ruta_indice(f'clave{n}')))
+        with open(self.cache.ruta_audio(hash_conservado), 'rb') as f:
+            self.assertEqual(f.read(), conservado)
+
+    def test_blob_desalojado_se_vuelve_a_escribir(self):
+        audio = b'a' * 100
+        ruta = self.cache.ruta_blob(self.cache.guardar_blob(audio))
+        os.remove(ruta)  # La evicción de otro proceso lo borró
+        self.cache.guardar_blob(audio)
+        with open(ruta, 'rb') as f:
+            self.assertEqual(f.read(), audio)
+
+    def test_solo_los_conservados_se_sirven_como_immutable(self):
+        hash_conservado = self.cache.guardar_blob(b'c' * 100, conservar=True)
+        hash_blob = self.cache.guardar_blob(b'b' * 100)
+        with mock.patch('core.views.cache_tts', self.cache):
+            conservado = self.client.get(reverse('audio_blob', args=[hash_conservado]))
+            blob = self.client.get(reverse('audio_blob', args=[hash_blob]))
+        self.assertIn('immutable', conservado['Cache-Control'])
+        self.assertEqual(blob['Cache-Control'], 'public, max-age=3600')
+
+
+class PoolGeminiTests(TestCase):
+
+    def _pool_con_key_semiabierta(self):
+        pool = PoolGemini(['key-a'])
+        salud = pool._salud[0]
+        salud.estado, salud.abierto_hasta = ABIERTO, 0.0  # Enfriamiento ya vencido
+        return pool, salud
+
+    def test_key_semiabierta_se_prueba_con_un_solo_request(self):
+        pool, salud = self._pool_con_key_semiabierta()
+        self.assertEqual(pool.orden_de_intento(), [0])
+        self.assertEqual(salud.estado, SEMIABIERTO)
+        self.assertEqual(pool.orden_de_intento(), [])  # Reservada para el primero
+
+    def test_reserva_sin_usar_vence(self):
+        pool, salud = self._pool_con_key_semiabierta()
+        pool.orden_de_intento()
+        salud.probando_hasta = 0.0  # Pasó el plazo sin que el request la arrendara
+        self.assertEqual(pool.orden_de_intento(), [0])
+
+    def test_fallos_tardios_no_alargan_el_enfriamiento(self):
+        from google.api_core import exceptions as google_exceptions
+        pool = PoolGemini(['key-a'])
+        salud = pool._salud[0]
+        for _ in range(3):  # Tres requests en curso cuando se agota la cuota
+            pool._registrar(0, google_exceptions.ResourceExhausted('cuota'))
+        self.assertEqual((salud.estado, salud.aperturas_seguidas), (ABIERTO, 1))
+        self.assertLessEqual(salud.abierto_hasta - time.monotonic(), salud.ESPERA_BASE)
+
+    def test_modelo_cacheado_no_cambia_de_cliente(self):
+        viejo, nuevo = object(), object()
+        clave_prompt = ('prueba', self.id())
+        modelo = utils._modelo_gemini(0, viejo, {}, clave_prompt, lambda: 'prompt')
+        self.assertIs(utils._modelo_gemini(0, viejo, {}, clave_prompt, lambda: 'prompt'), modelo)
+
+        reconectado = utils._modelo_gemini(0, nuevo, {}, clave_prompt, lambda: 'prompt')  # Tras reconectar
+        self.assertIsNot(reconectado, modelo)
+        self.assertIs(modelo._client, viejo)  # Un hilo que aún lo usa sigue con su cliente
+        self.assertIs(reconectado._client, nuevo)
+
+    def test_respuesta_bloqueada_cuenta_como_fallo_y_rota_de_key(self):
+        pool = PoolGemini(['key-a', 'key-b'])
+        pool._clientes = [mock.Mock(), mock.Mock()]
+        bloqueada = mock.Mock()
+        type(bloqueada).text = mock.PropertyMock(side_effect=ValueError('candidato bloqueado'))
+        respuestas = {0: bloqueada, 1: mock.Mock(text='{"respuesta_bot": "Hi!"}')}
+        usadas = []
+
+        def modelo(indice_key, *args):
+            usadas.append(indice_key)
+            return mock.Mock(**{'start_chat.return_value.send_message.return_value': respuestas[indice_key]})
+
+        with mock.patch.object(utils, 'pool_gemini', pool), \
+                mock.patch.object(pool, 'orden_de_intento', return_value=[0, 1]), \
+                mock.patch.object(utils, '_modelo_gemini', modelo):
+            respuesta = utils.obtener_respuesta_gemini([], 'hola')
+
+        self.assertEqual(respuesta['respuesta_bot'], 'Hi!')
+        self.assertEqual(usadas, [0, 1])
+        self.assertEqual((pool._salud[0].fallos, pool._salud[0].exitos), (1, 0))
+        self.assertEqual(pool._salud[1].exitos, 1)
+
+
+class HistorialTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='noa', password='clave-segura-123')
+        self.conversacion = Conversacion.objects.create(usuario=self.user, titulo='C', idioma_actual='es-en')
+        historial.cache_historial.invalidar(self.conversacion.pk)
+        self.addCleanup(historial._resumiendo.discard, self.conversacion.pk)
+
+    @mock.patch.object(historial, '_executor_resumen')
+    def test_presupuesto_se_respeta_aunque_el_resumen_falle(self, executor):
+        # El resumen se encola pero nunca llega (Gemini no responde)
+        for n in range(12):
+            Mensaje.objects.create(conversacion=self.conversacion, rol='usuario' if n % 2 else 'bot',
+                                   contenido_texto=f'{n} ' + 'palabra ' * 50)
+
+        mensajes, resumen = historial.construir_historial(self.conversacion, presupuesto=300)
+
+        tokens = sum(historial.estimar_tokens(m['parts'][0]) for m in mensajes)
+        self.assertLessEqual(tokens, 300)
+        self.assertEqual(len(mensajes), 2)
+        self.assertTrue(mensajes[-1]['parts'][0].startswith('11 '))  # Los más nuevos
+        self.assertEqual(resumen, '')
+        executor.submit.assert_called_once()
+
+
+class IndiceHechosTests(TestCase):
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        patcher = mock.patch.object(hechos, 'DIRECTORIO_INDICES', directorio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        hechos._indices.clear()
+        self.user = User.objects.create_user(username='eva', password='clave-segura-123')
+        self.hechos = [UserFact.objects.create(usuario=self.user, dato=f'Le gusta el deporte {n}') for n in range(3)]
+
+    def test_editar_un_hecho_reconstruye_el_indice(self):
+        self.assertNotIn('Tiene un gato llamado Mishi', hechos.hechos_relevantes(self.user, 'gato', k=1))
+        hecho = self.hechos[0]
+        hecho.dato = 'Tiene un gato llamado Mishi'
+        hecho.save()
+        self.assertEqual(hechos.hechos_relevantes(self.user, 'gato', k=1), ['Tiene un gato llamado Mishi'])
+
+    def test_indices_sin_uso_se_borran(self):
+        hechos.hechos_relevantes(self.user, 'deporte', k=1)
+        ruta = hechos._ruta_indice(self.user.pk)
+        self.assertTrue(os.path.exists(ruta))
+
+        UserFact.objects.filter(usuario=self.user).delete()
+        hechos.hechos_relevantes(self.user, 'deporte', k=1)
+        self.assertFalse(os.path.exists(ruta))
+
+        UserFact.objects.create(usuario=self.user, dato='Vive en Lima')
+        hechos.hechos_relevantes(self.user, 'Lima', k=0)
+        self.assertTrue(os.path.exists(ruta))
+        self.user.delete()
+        self.assertEqual(hechos.purgar_indices_huerfanos(), 1)
+        self.assertFalse(os.path.exists(ruta))
+
+
+@override_settings(CACHES=CACHES_PRUEBAS)
+class ActualizarProgresoTests(TestCase):
+
+    def setUp(self):
+        caches['compartida'].clear()
+        self.user = User.objects.create_user(username='iris', password='clave-segura-123')
+        self.hoy = timezone.now().date()
+
+    def _progreso(self, dias_desde_ultima, **campos):
+        return ProgresoUsuario.objects.create(
+            usuario=self.user, ultima_interaccion=self.hoy - timedelta(days=dias_desde_ultima), **campos
+        )
+
+    def _en_bd(self):
+        return ProgresoUsuario.objects.values_list(
+            'nivel', 'experiencia', 'racha_actual', 'ultima_interaccion').get(usuario=self.user)
+
+    def test_segundo_mensaje_del_dia_mantiene_la_racha(self):
+        self._progreso(0, experiencia=30, racha_actual=3)
+        eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['xp_actual'], eventos['racha_actual'], eventos['racha_aumentada']), (40, 3, False))
+        self.assertEqual(self._en_bd(), (1, 40, 3, self.hoy))
+
+    def test_racha_continua_desde_ayer(self):
+        self._progreso(1, experiencia=30, racha_actual=3)
+        eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['racha_actual'], eventos['racha_aumentada']), (4, True))
+        self.assertEqual(self._en_bd(), (1, 40, 4, self.hoy))
+
+    def test_racha_se_reinicia_tras_dias_sin_practicar(self):
+        self._progreso(3, experiencia=30, racha_actual=7)
+        eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['racha_actual'], eventos['racha_aumentada']), (1, False))
+        self.assertEqual(self._en_bd(), (1, 40, 1, self.hoy))
+
+    def test_subida_de_nivel(self):
+        self._progreso(0, experiencia=95, racha_actual=1)
+        eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['subio_nivel'], eventos['nivel_actual'], eventos['xp_actual']), (True, 2, 105))
+        self.assertFalse(utils.actualizar_progreso(self.user)['subio_nivel'])
+
+    def test_quiz_suma_50_xp(self):
+        self._progreso(0, experiencia=80, racha_actual=1)
+        eventos = utils.actualizar_progreso(self.user, xp=50)
+        self.assertEqual((eventos['xp_ganada'], eventos['xp_actual'], eventos['nivel_actual']), (50, 130, 2))
+        self.assertTrue(eventos['subio_nivel'])
+
+    def test_usuario_nuevo(self):
+        eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['xp_actual'], eventos['racha_actual'], eventos['nivel_actual']), (10, 1, 1))
+        self.assertEqual(self._en_bd(), (1, 10, 1, self.hoy))
+
+    def test_carrera_al_crear_la_fila_reintenta_con_update(self):
+        # Otro request creó la fila entre los UPDATE (que no encontraron nada) y el INSERT
+        self._progreso(0, experiencia=10, racha_actual=1)
+        update_real = utils._update_progreso
+        llamadas = []
+
+        def update_en_carrera(*args):
+            llamadas.append(args)
+            return None if len(llamadas) <= 3 else update_real(*args)
+
+        with mock.patch.object(utils, '_update_progreso', update_en_carrera):
+            eventos = utils.actualizar_progreso(self.user)
+        self.assertEqual((eventos['xp_actual'], eventos['racha_actual']), (20, 1))
+        self.assertEqual(ProgresoUsuario.objects.filter(usuario=self.user).count(), 1)
+        self.assertEqual(self._en_bd(), (1, 20, 1, self.hoy))
@@ -0,0 +1,256 @@
+# core/tts_cache.py
+"""
+Caché de audio TTS en dos niveles:
+- Memoria: LRU acotado (por cantidad y por bytes) dentro de cada proceso.
+- Disco: compartido por todos los workers de gunicorn, con tope de tamaño.
+
+El disco es direccionado por contenido: 'indice/<clave>' guarda el sha256 del audio y
+'blobs/<sha256>.mp3' guarda los bytes. Así dos textos que producen el mismo audio
+comparten archivo, y los blobs son los que sirve la vista audio_blob por URL.
+
+Los audios cuya URL queda guardada en un Mensaje (Mensaje.audio_url) se escriben además en
+'conservados/<sha256>.mp3', que NO entra en el tope de disco ni en la evicción: la URL se
+sirve como immutable y tiene que seguir funcionando en conversaciones viejas. La evicción
+solo borra blobs de 'blobs/' y, con ellos, las entradas de 'indice/' que los apuntaban.
+
+Las escrituras son atómicas (archivo temporal + os.replace), por lo que varios
+procesos pueden leer y escribir a la vez sin locks.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .archivos import escribir_atomico
+
+logger = logging.getLogger('core')
+
+
+def clave_tts(texto, voice_code, speaking_rate, encoding):
+    """Clave estable para (texto, voz, velocidad, encoding)."""
+    crudo = json.dumps([texto, voice_code, round(float(speaking_rate), 2), encoding], ensure_ascii=False)
+    return hashlib.sha256(crudo.encode('utf-8')).hexdigest()
+
+
+def hash_audio(audio_bytes):
+    """Hash de contenido de un audio (nombre del blob en disco)."""
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+
+class CacheAudioTTS:
+    """Caché LRU en memoria + caché en disco con tope de tamaño."""
+
+    # Cada cuántas escrituras a disco se revisa el tamaño total
+    REVISAR_DISCO_CADA = 50
+
+    def __init__(self, directorio, max_items_memoria=256, max_bytes_memoria=32 * 1024 * 1024,
+                 max_bytes_disco=512 * 1024 * 1024):
+        self.directorio = directorio
+        self.max_items_memoria = max_items_memoria
+        self.max_bytes_memoria = max_bytes_memoria
+        self.max_bytes_disco = max_bytes_disco
+
+        self._memoria = OrderedDict()
+        self._bytes_memoria = 0
+        self._escrituras_desde_revision = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits_memoria': 0,
+            'hits_disco': 0,
+            'misses': 0,
+            'escrituras_disco': 0,
+            'evicciones_disco': 0,
+            'errores_disco': 0,
+        }
+
+    # --- Rutas ---
+    def _ruta_indice(self, clave):
+        return os.path.join(self.directorio, 'indice', clave[:2], clave)
+
+    def ruta_blob(self, contenido_hash):
+        return os.path.join(self.directorio, 'blobs', contenido_hash[:2], f"{contenido_hash}.mp3")
+
+    def ruta_conservado(self, contenido_hash):
+        return os.path.join(self.directorio, 'conservados', contenido_hash[:2], f"{contenido_hash}.mp3")
+
+    def ruta_audio(self, contenido_hash):
+        """Archivo a servir para un hash: el conservado si existe, si no el blob de la caché."""
+        conservado = self.ruta_conservado(contenido_hash)
+        return conservado if os.path.exists(conservado) else self.ruta_blob(contenido_hash)
+
+    # --- API pública ---
+    def obtener(self, clave):
+        """Devuelve los bytes del audio o None si no está en ningún nivel."""
+        with self._lock:
+            audio = self._memoria.get(clave)
+            if audio is not None:
+                self._memoria.move_to_end(clave)
+                self._stats['hits_memoria'] += 1
+                return audio
+
+        audio = self._leer_disco(clave)
+        with self._lock:
+            if audio is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits_disco'] += 1
+        self._guardar_memoria(clave, audio)
+        return audio
+
+    def guardar(self, clave, audio):
+        """Guarda el audio en memoria y en disco. Un fallo de disco no rompe el TTS."""
+        self._guardar_memoria(clave, audio)
+        try:
+            self._escribir_disco(clave, audio)
+        except OSError as e:
+            with self._lock:
+                self._stats['errores_disco'] += 1
+            logger.warning(f"[TTS Cache] No se pudo escribir en disco: {e}")
+
+    def guardar_blob(self, audio, conservar=False):
+        """
+        Asegura que el audio exista como blob en disco y devuelve su hash de contenido.
+        Con conservar=True va a 'conservados/' (fuera de la evicción): usarlo para audios
+        cuya URL se guarda en la BD.
+        """
+        contenido_hash = hash_audio(audio)
+        ruta = self.ruta_conservado(contenido_hash) if conservar else self.ruta_blob(contenido_hash)
+        try:
+            os.utime(ruta)  # Ya existe: solo se renueva para la evicción
+        except FileNotFoundError:
+            # No existía, o la evicción lo borró justo ahora
+            escribir_atomico(ruta, audio)
+        return contenido_hash
+
+    def estadisticas(self):
+        """Contadores de este proceso (hits/misses por nivel) y ocupación de memoria."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['items_memoria'] = len(self._memoria)
+            stats['bytes_memoria'] = self._bytes_memoria
+        consultas = stats['hits_memoria'] + stats['hits_disco'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits_memoria'] + stats['hits_disco']) / consultas, 3) if consultas else None
+        stats['pid'] = os.getpid()
+        return stats
+
+    # --- Memoria ---
+    def _guardar_memoria(self, clave, audio):
+        if len(audio) > self.max_bytes_memoria:
+            return
+        with self._lock:
+            anterior = self._memoria.pop(clave, None)
+            if anterior is not None:
+                self._bytes_memoria -= len(anterior)
+            self._memoria[clave] = audio
+            self._bytes_memoria += len(audio)
+            while (len(self._memoria) > self.max_items_memoria
+                   or self._bytes_memoria > self.max_bytes_memoria):
+                _, viejo = self._memoria.popitem(last=False)
+                self._bytes_memoria -= len(viejo)
+
+    # --- Disco ---
+    def _leer_disco(self, clave):
+        ruta_indice = self._ruta_indice(clave)
+        try:
+            with open(ruta_indice, 'r') as f:
+                contenido_hash = f.read().strip()
+            ruta_blob = self.ruta_blob(contenido_hash)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"[TTS Cache] Error leyendo disco: {e}")
+            return None
+        try:
+            with open(ruta_blob, 'rb') as f:
+                audio = f.read()
+            # Marcamos el blob como "usado recientemente" para la evicción por antigüedad
+            os.utime(ruta_blob)
+            return audio
+        except FileNotFoundError:
+            # El blob fue desalojado entre la evicción y la limpieza de índices
+            self._borrar(ruta_indice)
+            return None
+        except OSError as e:
+            logger.warning(f"[TTS Cache] Error leyendo disco: {e}")
+            return None
+
+    def _escribir_disco(self, clave, audio):
+        contenido_hash = self.guardar_blob(audio)
+        escribir_atomico(self._ruta_indice(clave), contenido_hash.encode('ascii'))
+
+        with self._lock:
+            self._stats['escrituras_disco'] += 1
+            self._escrituras_desde_revision += 1
+            revisar = self._escrituras_desde_revision >= self.REVISAR_DISCO_CADA
+            if revisar:
+                self._escrituras_desde_revision = 0
+        if revisar:
+            self._aplicar_tope_disco()
+
+    def _aplicar_tope_disco(self):
+        """Borra los blobs menos usados hasta quedar bajo el 90% del tope."""
+        directorio_blobs = os.path.join(self.directorio, 'blobs')
+        blobs = []
+        total = 0
+        for raiz, _, archivos in os.walk(directorio_blobs):
+            for nombre in archivos:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    st = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                blobs.append((st.st_mtime, st.st_size, ruta))
+                total += st.st_size
+
+        if total <= self.max_bytes_disco:
+            return
+
+        objetivo = int(self.max_bytes_disco * 0.9)
+        borrados = set()
+        for _, tamano, ruta in sorted(blobs):
+            if total <= objetivo:
+                break
+            if self._borrar(ruta):
+                borrados.add(os.path.basename(ruta)[:-len('.mp3')])
+            total -= tamano
+        indices = self._borrar_indices_de(borrados)
+        with self._lock:
+            self._stats['evicciones_disco'] += len(borrados)
+        logger.info(f"[TTS Cache] Evicción de disco: {len(borrados)} blobs y {indices} índices borrados")
+
+    def _borrar_indices_de(self, hashes):
+        """Borra las entradas de 'indice/' que apuntan a alguno de `hashes`."""
+        if not hashes:
+            return 0
+        borrados = 0
+        for raiz, _, archivos in os.walk(os.path.join(self.directorio, 'indice')):
+            for nombre in archivos:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    with open(ruta, 'r') as f:
+                        apunta_a = f.read().strip()
+                except OSError:
+                    continue
+                if apunta_a in hashes and self._borrar(ruta):
+                    borrados += 1
+        return borrados
+
+    @staticmethod
+    def _borrar(ruta):
+        try:
+            os.unlink(ruta)
+            return True
+        except FileNotFoundError:
+            return False  # Otro worker lo borró primero
+
+
+cache_tts = CacheAudioTTS(
+    directorio=getattr(settings, 'TTS_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache_tts')),
+    max_items_memoria=getattr(settings, 'TTS_CACHE_MEMORIA_ITEMS', 256),
+    max_bytes_memoria=getattr(settings, 'TTS_CACHE_MEMORIA_MB', 32) * 1024 * 1024,
+    max_bytes_disco=getattr(settings, 'TTS_CACHE_DISCO_MB', 512) * 1024 * 1024,
+)
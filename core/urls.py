@@ -1,5 +1,5 @@
 # core/urls.py
-from django.urls import path
+from django.urls import path, re_path
 from django.contrib.auth import views as auth_views
 from . import views
 from django.contrib.auth import views as auth_views #
@@ -21,8 +21,10 @@ urlpatterns = [
     path('api/tts/', views.text_to_speech_api, name='api_tts'),
     path('api/tts_word/', views.tts_word_api, name='tts_word_api'),
     path('api/stt/', views.speech_to_text_api, name='api_stt'),
+    re_path(r'^api/audio/(?P<audio_hash>[0-9a-f]{64})\.mp3$', views.audio_blob, name='audio_blob'),
     path('chat_interaction/', views.chat_interaction, name='chat_interaction'),
     path('api/conversations/<int:conversation_id>/', views.get_conversation_detail, name='get_conversation_detail'),
+    path('api/conversations/<int:conversation_id>/export/', views.export_conversation, name='export_conversation'),
     path('api/conversations/', views.get_conversations, name='get_conversations'),
     path('perfil/', views.perfil, name='perfil'),
     path('api/settings/voice/', views.update_voice_settings_api, name='api_voice_save'),
@@ -37,8 +39,14 @@ urlpatterns = [
     path('dashboard/users/<int:user_id>/', views.admin_user_detail, name='admin_user_detail'),
     path('dashboard/audit/', views.admin_audit_logs, name='admin_audit'),
     path('dashboard/broadcast/', views.admin_broadcast, name='admin_broadcast'),
+    path('dashboard/tts-cache/', views.admin_tts_cache_stats, name='admin_tts_cache_stats'),
+    path('dashboard/gemini-keys/', views.admin_gemini_keys_stats, name='admin_gemini_keys_stats'),
+    path('dashboard/hechos/', views.admin_hechos_stats, name='admin_hechos_stats'),
     path('api/alert/', views.get_system_alert, name='api_get_alert'),
     path('export/pdf/', views.export_errors_pdf, name='export_pdf'),
+    path('api/reportes/errores/', views.encolar_reporte_api, name='encolar_reporte'),
+    path('api/reportes/<int:trabajo_id>/', views.estado_reporte_api, name='estado_reporte'),
+    path('reportes/<int:trabajo_id>/descargar/', views.descargar_reporte, name='descargar_reporte'),
     path('api/leaderboard/', views.get_leaderboard_api, name='api_leaderboard'),
     path('api/leaderboard/', views.get_leaderboard_api, name='api_leaderboard'),
     path('api/settings/game/', views.save_gamification_settings_api, name='api_game_settings'),
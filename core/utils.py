@@ -1,46 +1,81 @@
 # core/utils.py
-import google.generativeai as genai
 from django.conf import settings
-from google.cloud import texttospeech, speech
 import os
 from datetime import timedelta
 from django.utils import timezone
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Floor, Greatest
+from django.db.models.sql import UpdateQuery
 from .models import ProgresoUsuario
+from .tts_cache import cache_tts, clave_tts
+from . import sdks
+from .clientes_google import cliente_tts
+from .gemini_pool import pool_gemini
+from . import leaderboard
 from io import BytesIO
 from django.http import HttpResponse
+from django.urls import reverse
 from django.template.loader import get_template
-from xhtml2pdf import pisa
 import json
 import logging
+import re
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger('core')
 
-# --- SISTEMA DE ROTACIÓN DE API KEYS ---
-_api_keys = getattr(settings, 'GEMINI_API_KEYS', []) or [settings.GEMINI_API_KEY]
-_key_index = 0
-_key_lock = threading.Lock()
+# --- CACHÉ DE MODELOS GEMINI ---
+# Un GenerativeModel por (key, prompt de sistema, generation_config).
+# El prompt de sistema solo depende de datos estables (escenario, idiomas), así que el
+# trabajo por request queda reducido a la llamada al modelo.
+_MAX_MODELOS_CACHEADOS = getattr(settings, 'GEMINI_MAX_MODELOS_CACHEADOS', 64)
+_modelos_cache = OrderedDict()
+_modelos_lock = threading.Lock()
 
-def _get_next_api_key():
-    """Round-robin: devuelve la siguiente API key disponible."""
-    global _key_index
-    with _key_lock:
-        key = _api_keys[_key_index % len(_api_keys)]
-        _key_index += 1
-        logger.info(f"[API Key] Usando API Key #{(_key_index - 1) % len(_api_keys) + 1} de {len(_api_keys)}")
-        return key
+def _modelo_gemini(indice_key, cliente, generation_config, clave_prompt, construir_prompt):
+    """
+    Devuelve el GenerativeModel cacheado para esa key/prompt/config, creándolo si no existe.
+    `construir_prompt` solo se llama en un miss. El modelo usa `cliente` (el arrendado del
+    pool para esa key), nunca el cliente global de genai.
 
-def _configure_genai(api_key):
-    """Configura genai con una API key específica."""
-    genai.configure(api_key=api_key)
+    Un modelo cacheado no se modifica nunca (lo comparten los hilos): si el cliente de la
+    key cambió (fork o reconexión) se crea un modelo nuevo que reemplaza al anterior.
+    """
+    clave = (indice_key, clave_prompt, tuple(sorted(generation_config.items())))
+    with _modelos_lock:
+        model = _modelos_cache.get(clave)
+        if model is not None and model._client is cliente:
+            _modelos_cache.move_to_end(clave)
+            return model
+
+    model = sdks.genai().GenerativeModel(
+        model_name="gemini-2.5-flash",
+        generation_config=generation_config,
+        system_instruction=construir_prompt()
+    )
+    # google-generativeai==0.8.5 (fijado en requirements.txt): GenerativeModel no acepta un
+    # cliente en el constructor; usa `_client` y solo cae en el cliente global (el de
+    # genai.configure) si es None. Se asigna antes de publicarlo en la caché.
+    model._client = cliente
 
-# Configuración inicial con la primera key
-_configure_genai(_api_keys[0])
+    with _modelos_lock:
+        _modelos_cache[clave] = model
+        _modelos_cache.move_to_end(clave)
+        while len(_modelos_cache) > _MAX_MODELOS_CACHEADOS:
+            _modelos_cache.popitem(last=False)
+    return model
 
 
 def texto_a_voz_bytes(texto, voice_code='es-US-Wavenet-A', speaking_rate=1.0):
-    """Convierte texto a audio MP3 (bytes) usando Google Cloud"""
-    client = texttospeech.TextToSpeechClient()
+    """Convierte texto a audio MP3 (bytes) usando Google Cloud (con caché memoria + disco)"""
+    clave = clave_tts(texto, voice_code, speaking_rate, 'MP3')
+    audio_cacheado = cache_tts.obtener(clave)
+    if audio_cacheado is not None:
+        return audio_cacheado
+
+    texttospeech = sdks.texttospeech()
     synthesis_input = texttospeech.SynthesisInput(text=texto)
     
     # Configuración de voz
@@ -53,75 +88,167 @@ def texto_a_voz_bytes(texto, voice_code='es-US-Wavenet-A', speaking_rate=1.0):
         speaking_rate=speaking_rate
     )
 
-    response = client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+    # Cliente compartido por el proceso: las llamadas en caliente no crean canal gRPC
+    response = cliente_tts.llamar(
+        lambda client: client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+    )
+    cache_tts.guardar(clave, response.audio_content)
     return response.audio_content
 
-def actualizar_progreso(user):
+def texto_a_voz_url(texto, voice_code='es-US-Wavenet-A', speaking_rate=1.0, conservar=False):
+    """
+    Igual que texto_a_voz_bytes pero devuelve la URL del audio (blob direccionado por
+    contenido, servido con ETag/Range) en vez de los bytes. conservar=True si la URL se
+    va a guardar en la BD (el blob queda fuera de la evicción de la caché).
+    """
+    audio_bytes = texto_a_voz_bytes(texto, voice_code, speaking_rate)
+    audio_hash = cache_tts.guardar_blob(audio_bytes, conservar=conservar)
+    return reverse('audio_blob', args=[audio_hash])
+
+# --- TTS EN SEGUNDO PLANO ---
+# Pool pequeño para sintetizar audio mientras el hilo del request hace las escrituras en BD.
+# Los hilos se crean recién al primer submit (después del fork de gunicorn).
+_tts_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'TTS_WORKERS', 4), thread_name_prefix='tts')
+
+def texto_a_voz_url_async(texto, voice_code='es-US-Wavenet-A', speaking_rate=1.0, conservar=False):
+    """Lanza texto_a_voz_url en el pool y devuelve un Future con la URL del audio."""
+    return _tts_executor.submit(texto_a_voz_url, texto, voice_code, speaking_rate, conservar)
+
+# Fórmula simple: cada 100 XP subes de nivel
+XP_POR_NIVEL = 100
+
+
+def _nivel_para(experiencia):
+    return experiencia // XP_POR_NIVEL + 1
+
+
+def _update_progreso(usuario, filtro, valores):
+    """
+    UPDATE condicional de ProgresoUsuario. Devuelve (nivel, experiencia, racha_actual,
+    publico_en_leaderboard) ya actualizados, o None si ninguna fila cumplía el filtro.
+    En PostgreSQL/SQLite se leen con RETURNING en la misma sentencia; MySQL no soporta
+    UPDATE ... RETURNING, así que ahí se relee la fila.
+    """
+    qs = ProgresoUsuario.objects.filter(usuario=usuario, **filtro)
+    conexion = connections[qs.db]
+    if conexion.vendor != 'mysql' and conexion.features.can_return_columns_from_insert:
+        query = qs.query.chain(UpdateQuery)
+        query.add_update_values(valores)
+        sql_update, params = query.get_compiler(qs.db).as_sql()
+        with conexion.cursor() as cursor:
+            cursor.execute(f"{sql_update} RETURNING nivel, experiencia, racha_actual, publico_en_leaderboard", params)
+            return cursor.fetchone()
+    if not qs.update(**valores):
+        return None
+    return ProgresoUsuario.objects.filter(usuario=usuario).values_list(
+        'nivel', 'experiencia', 'racha_actual', 'publico_en_leaderboard'
+    ).first()
+
+
+def actualizar_progreso(user, xp=10):
     """
     Calcula XP, subida de nivel y rachas.
     Retorna un diccionario con los cambios para notificar al frontend.
+
+    Sin leer-modificar-guardar: cada caso es un único UPDATE condicional con expresiones
+    F (racha y nivel se calculan en la misma sentencia), así dos mensajes simultáneos del
+    mismo usuario no se pisan la XP.
     """
-    progreso, created = ProgresoUsuario.objects.get_or_create(usuario=user)
     hoy = timezone.now().date()
     ayer = hoy - timedelta(days=1)
-    
+
     eventos = {
         'subio_nivel': False,
         'racha_aumentada': False,
-        'xp_ganada': 10 # 10 puntos por mensaje
+        'xp_ganada': xp  # 10 puntos por mensaje
     }
 
-    # 1. Lógica de Rachas (Solo se actualiza una vez al día)
-    if progreso.ultima_interaccion < hoy:
-        if progreso.ultima_interaccion == ayer:
-            # Si practicó ayer, aumenta racha
-            progreso.racha_actual += 1
-            eventos['racha_aumentada'] = True
-        elif progreso.ultima_interaccion < ayer and not created:
-            # Si dejó pasar días, reinicia a 1
-            progreso.racha_actual = 1
-        else:
-            # Primera vez hoy (o usuario nuevo)
-            if progreso.racha_actual == 0: progreso.racha_actual = 1
-            
-        progreso.ultima_interaccion = hoy
-
-    # 2. Lógica de XP y Niveles
-    # Fórmula simple: Cada 100 XP subes de nivel
-    progreso.experiencia += eventos['xp_ganada']
-    nuevo_nivel = (progreso.experiencia // 100) + 1
-    
-    if nuevo_nivel > progreso.nivel:
-        progreso.nivel = nuevo_nivel
-        eventos['subio_nivel'] = True
-    
-    progreso.save()
-    
+    # OJO: el orden importa. MySQL evalúa el SET de izquierda a derecha con los valores
+    # ya asignados, así que nivel y racha van antes de experiencia y ultima_interaccion.
+    nivel = Greatest(F('nivel'), Floor((F('experiencia') + xp) / XP_POR_NIVEL) + 1)
+    casos = [
+        # Ya practicó hoy: la racha no cambia (salvo que estuviera en 0)
+        ({'ultima_interaccion__gte': hoy}, {'racha_actual': Greatest(F('racha_actual'), Value(1))}, False),
+        # Practicó ayer: aumenta la racha
+        ({'ultima_interaccion': ayer}, {'racha_actual': F('racha_actual') + 1}, True),
+        # Dejó pasar días: reinicia a 1
+        ({'ultima_interaccion__lt': ayer}, {'racha_actual': Value(1)}, False),
+    ]
+
+    estado = None
+    for _ in range(2):
+        for filtro, racha, aumenta_racha in casos:
+            valores = {'nivel': nivel, **racha, 'experiencia': F('experiencia') + xp, 'ultima_interaccion': hoy}
+            estado = _update_progreso(user, filtro, valores)
+            if estado is not None:
+                eventos['racha_aumentada'] = aumenta_racha
+                break
+        if estado is not None:
+            break
+        # Usuario nuevo: primera fila con su primera racha
+        try:
+            with transaction.atomic():
+                creado = ProgresoUsuario.objects.create(
+                    usuario=user, experiencia=xp, nivel=_nivel_para(xp), racha_actual=1, ultima_interaccion=hoy
+                )
+            estado = (creado.nivel, creado.experiencia, creado.racha_actual, creado.publico_en_leaderboard)
+            break
+        except IntegrityError:
+            continue  # Otro request la creó en medio: se actualiza con los casos de arriba
+
+    nivel_actual, xp_actual, racha_actual, publico = estado
+    leaderboard.actualizar_xp(user, xp_actual, nivel_actual, publico)
+    # Subió de nivel si este UPDATE cruzó un múltiplo de XP_POR_NIVEL y el nivel quedó en la fórmula
+    eventos['subio_nivel'] = (
+        _nivel_para(xp_actual) > _nivel_para(xp_actual - xp) and nivel_actual == _nivel_para(xp_actual)
+    )
+
     # Añadimos el estado actual para mostrarlo
-    eventos['nivel_actual'] = progreso.nivel
-    eventos['xp_actual'] = progreso.experiencia
-    eventos['racha_actual'] = progreso.racha_actual
-    
+    eventos['nivel_actual'] = nivel_actual
+    eventos['xp_actual'] = xp_actual
+    eventos['racha_actual'] = racha_actual
+
     return eventos
 
-def render_to_pdf(template_src, context_dict={}):
+def pdf_desde_template(template_src, context_dict={}):
     """
-    Función auxiliar para convertir un template HTML a PDF
+    Renderiza un template HTML a PDF y devuelve los bytes (None si xhtml2pdf falla)
     """
     template = get_template(template_src)
     html  = template.render(context_dict)
     result = BytesIO()
     
     # Generar el PDF
-    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding='UTF-8')
+    pdf = sdks.pisa().pisaDocument(BytesIO(html.encode("UTF-8")), result, encoding='UTF-8')
     
     if not pdf.err:
-        return HttpResponse(result.getvalue(), content_type='application/pdf')
+        return result.getvalue()
     return None
 
-def obtener_respuesta_gemini(historial_chat, texto_usuario, idioma_detectado='es-ES', scenario='general', confidence=1.0, user_facts=[], idioma_nativo='Español', idioma_objetivo='Inglés'):
+def render_to_pdf(template_src, context_dict={}):
     """
-    Cerebro con Soporte de Roleplay, MEMORIA A LARGO PLAZO y MULTILENGUAJE DINÁMICO.
+    Función auxiliar para convertir un template HTML a PDF
+    """
+    contenido = pdf_desde_template(template_src, context_dict)
+    if contenido is not None:
+        return HttpResponse(contenido, content_type='application/pdf')
+    return None
+
+# Configuración del modelo de chat (compartida por la versión normal y la de streaming)
+_generation_config_chat = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 4096, 
+    "response_mime_type": "application/json",
+}
+
+
+def _construir_prompt_chat(scenario, idioma_nativo, idioma_objetivo):
+    """
+    Arma el system prompt del chat: rol, reglas y formato JSON.
+    Solo depende del escenario y los idiomas (es lo que se cachea junto al modelo);
+    lo que cambia en cada mensaje va en _construir_contexto_turno.
     """
     
     # 1. DICCIONARIO DE ROLES
@@ -160,53 +287,16 @@ def obtener_respuesta_gemini(historial_chat, texto_usuario, idioma_detectado='es
 
     personalidad_seleccionada = roles.get(scenario, roles['general'])
 
-    # Configuración del modelo
-    generation_config = {
-        "temperature": 0.7,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 4096, 
-        "response_mime_type": "application/json",
-    }
-    
-    # INSTRUCCIÓN EXTRA PARA PRONUNCIACIÓN
-    instruccion_pronunciacion = ""
-    if confidence < 0.85:
-        instruccion_pronunciacion = f"""
-        ¡ATENCIÓN! El sistema de reconocimiento de voz reporta confianza media/baja ({confidence}).
-        
-        ACCIÓN REQUERIDA PARA PRONUNCIACIÓN (MANDATORIO):
-        1. EL CAMPO 'tip_pronunciacion' NO PUEDE SER NULL. DEBES GENERARLO.
-        2. Tu prioridad es DETECTAR la palabra que el usuario INTENTÓ decir. Adivínala por el contexto fonético.
-        3. ASUME SIEMPRE que hubo un error de articulación del usuario, NO asumas ruido.
-        4. GENERA un consejo TÉCNICO sobre cómo poner la boca/lengua para esa palabra adivinada.
-           - Ejemplo: "Tu 'Drink' sonó como 'Dreenk'. Acorta la 'i' y marca la 'k' final fuerte."
-        5. IMPORTANTE: Aunque no estés 100% seguro, MEJOR DAR UN CONSEJO SOBRE LA PALABRA MÁS PROBABLE QUE NO DECIR NADA.
-        """
-
-    # --- INYECCIÓN DE MEMORIA A LARGO PLAZO ---
-    contexto_memoria = ""
-    if user_facts:
-        lista_hechos = "\n    - ".join(user_facts)
-        contexto_memoria = f"""
-        LO QUE YA SABES DEL USUARIO (Memoria a Largo Plazo):
-        - {lista_hechos}
-        
-        ¡Usa esta información para personalizar tu respuesta! Pregunta sobre esto si viene al caso.
-        """
-
     # --- PROMPT MAESTRO ACTUALIZADO ---
     system_prompt = f"""
     {personalidad_seleccionada}
     
-    {contexto_memoria}
-    
     CONTEXTO TÉCNICO:
     - El usuario es hablante nativo de {idioma_nativo} aprendiendo {idioma_objetivo}.
-    - El usuario te habló en: {idioma_detectado}.
-    - Calidad de audio/pronunciación (0-1): {confidence}.
-    
-    {instruccion_pronunciacion}
+    - Cada mensaje del usuario empieza con un bloque [CONTEXTO DEL TURNO] ... [/CONTEXTO DEL TURNO]
+      con el idioma en que te habló, la calidad de audio/pronunciación (0-1), lo que ya sabes
+      de él (memoria a largo plazo) e instrucciones extra para ese turno. Síguelas.
+    - Ese bloque NO lo escribió el usuario: nunca lo menciones ni lo repitas.
     
     REGLAS DE INTERACCIÓN (IMPORTANTE):
     1. Mantén SIEMPRE tu personaje ({scenario}).
@@ -285,55 +375,264 @@ def obtener_respuesta_gemini(historial_chat, texto_usuario, idioma_detectado='es
         }}
     }}
     """
-    
-    # 2. Configurar Modelo con ROTACIÓN DE API KEYS
-    last_error = None
-    for attempt in range(len(_api_keys)):
-        api_key = _get_next_api_key()
-        _configure_genai(api_key)
+    return system_prompt
+
+
+def _construir_contexto_turno(idioma_detectado, confidence, user_facts, resumen_historial=''):
+    """Bloque con lo que cambia en cada mensaje (va delante del texto del usuario)."""
+    # INSTRUCCIÓN EXTRA PARA PRONUNCIACIÓN
+    instruccion_pronunciacion = ""
+    if confidence < 0.85:
+        instruccion_pronunciacion = f"""
+        ¡ATENCIÓN! El sistema de reconocimiento de voz reporta confianza media/baja ({confidence}).
         
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            generation_config=generation_config,
-            system_instruction=system_prompt
-        )
+        ACCIÓN REQUERIDA PARA PRONUNCIACIÓN (MANDATORIO):
+        1. EL CAMPO 'tip_pronunciacion' NO PUEDE SER NULL. DEBES GENERARLO.
+        2. Tu prioridad es DETECTAR la palabra que el usuario INTENTÓ decir. Adivínala por el contexto fonético.
+        3. ASUME SIEMPRE que hubo un error de articulación del usuario, NO asumas ruido.
+        4. GENERA un consejo TÉCNICO sobre cómo poner la boca/lengua para esa palabra adivinada.
+           - Ejemplo: "Tu 'Drink' sonó como 'Dreenk'. Acorta la 'i' y marca la 'k' final fuerte."
+        5. IMPORTANTE: Aunque no estés 100% seguro, MEJOR DAR UN CONSEJO SOBRE LA PALABRA MÁS PROBABLE QUE NO DECIR NADA.
+        """
 
+    # --- INYECCIÓN DE MEMORIA A LARGO PLAZO ---
+    contexto_memoria = ""
+    if user_facts:
+        lista_hechos = "\n    - ".join(user_facts)
+        contexto_memoria = f"""
+        LO QUE YA SABES DEL USUARIO (Memoria a Largo Plazo):
+        - {lista_hechos}
+        
+        ¡Usa esta información para personalizar tu respuesta! Pregunta sobre esto si viene al caso.
+        """
+
+    # --- RESUMEN DE LA PARTE ANTIGUA DE LA CONVERSACIÓN ---
+    contexto_resumen = ""
+    if resumen_historial:
+        contexto_resumen = f"""
+        RESUMEN DE LO QUE SE HABLÓ ANTES EN ESTA CONVERSACIÓN (los mensajes más recientes van en el historial):
+        {resumen_historial}
+        """
+
+    return f"""[CONTEXTO DEL TURNO]
+    - El usuario te habló en: {idioma_detectado}.
+    - Calidad de audio/pronunciación (0-1): {confidence}.
+    {contexto_memoria}
+    {contexto_resumen}
+    {instruccion_pronunciacion}
+    [/CONTEXTO DEL TURNO]
+
+    """
+
+
+def _respuesta_fallback(texto_bot):
+    """Respuesta mínima con la misma forma que el JSON de Gemini (para errores)."""
+    return {
+        "respuesta_bot": texto_bot,
+        "idioma_respuesta": "en-US",
+        "hay_error": False,
+        "tip_pronunciacion": None,
+        "texto_corregido_fonetico": None
+    }
+
+
+def parsear_respuesta_gemini(texto_crudo):
+    """Limpia los ```json del modelo y parsea. Si el JSON viene cortado devuelve un fallback."""
+    cleaned_text = texto_crudo.replace('```json', '').replace('```', '').strip()
+    try:
+        return json.loads(cleaned_text)
+    except json.JSONDecodeError:
+        logger.error(f"Error JSON Gemini: {cleaned_text[:200]}...", exc_info=True)
+        return _respuesta_fallback("Sorry, I got cut off. Could you say that again?")
+
+
+def obtener_respuesta_gemini(historial_chat, texto_usuario, idioma_detectado='es-ES', scenario='general', confidence=1.0, user_facts=[], idioma_nativo='Español', idioma_objetivo='Inglés', resumen_historial=''):
+    """
+    Cerebro con Soporte de Roleplay, MEMORIA A LARGO PLAZO y MULTILENGUAJE DINÁMICO.
+    """
+    mensaje = _construir_contexto_turno(idioma_detectado, confidence, user_facts, resumen_historial) + texto_usuario
+
+    # Modelo (cacheado) con ROTACIÓN DE API KEYS: cada key con su propio cliente
+    last_error = "ninguna key disponible (todas en enfriamiento)"
+    for indice_key in pool_gemini.orden_de_intento():
         try:
-            # 3. Iniciar Chat con Historial (Memoria)
-            chat_session = model.start_chat(history=historial_chat)
-            
-            # 4. Enviar MENSAJE ACTUAL
-            response = chat_session.send_message(texto_usuario)
-            
-            cleaned_text = response.text.replace('```json', '').replace('```', '').strip()
-            
-            # INTENTO DE PARSEO SEGURO
-            parsed_data = json.loads(cleaned_text)
-            return parsed_data
-            
-        except json.JSONDecodeError:
-            logger.error(f"Error JSON Gemini (Key #{attempt+1}): {cleaned_text[:200]}...", exc_info=True)
-            return {
-                "respuesta_bot": "Sorry, I got cut off. Could you say that again?",
-                "idioma_respuesta": "en-US",
-                "hay_error": False,
-                "tip_pronunciacion": None,
-                "texto_corregido_fonetico": None
-            }
+            with pool_gemini.arrendar(indice_key) as arriendo:
+                model = _modelo_gemini(
+                    indice_key, arriendo.cliente, _generation_config_chat,
+                    ('chat', scenario, idioma_nativo, idioma_objetivo),
+                    lambda: _construir_prompt_chat(scenario, idioma_nativo, idioma_objetivo)
+                )
+                # Iniciar Chat con Historial (Memoria) y enviar MENSAJE ACTUAL
+                chat_session = model.start_chat(history=historial_chat)
+                response = chat_session.send_message(mensaje)
+                # Dentro del arriendo: un candidato bloqueado o vacío hace que .text lance
+                # ValueError, y eso es un fallo de ESTA key (se prueba la siguiente)
+                texto = response.text
         except Exception as e:
             last_error = str(e)
-            logger.warning(f"⚠️ API Key #{attempt+1} falló: {last_error}. Intentando siguiente key...")
+            logger.warning(f"⚠️ API Key #{indice_key+1} falló: {last_error}. Intentando siguiente key...")
             continue  # Intentar con la siguiente key
+
+        return parsear_respuesta_gemini(texto)
     
     # Si todas las keys fallaron
     logger.error(f"❌ Todas las API keys fallaron. Último error: {last_error}")
-    return {
-        "respuesta_bot": f"Error: Todas las API keys están agotadas. Último error: {last_error}",
-        "idioma_respuesta": "en-US",
-        "hay_error": False,
-        "tip_pronunciacion": None,
-        "texto_corregido_fonetico": None
-    }
+    return _respuesta_fallback(f"Error: Todas las API keys están agotadas. Último error: {last_error}")
+
+
+def _texto_chunk(chunk):
+    """El último chunk de un stream puede no traer texto (solo finish_reason)."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ''
+
+
+def obtener_respuesta_gemini_stream(historial_chat, texto_usuario, idioma_detectado='es-ES', scenario='general', confidence=1.0, user_facts=[], idioma_nativo='Español', idioma_objetivo='Inglés', resumen_historial=''):
+    """
+    Igual que obtener_respuesta_gemini, pero genera el texto crudo (JSON parcial) a medida
+    que Gemini lo produce. El que consume debe acumularlo y pasarlo a parsear_respuesta_gemini.
+    Solo se rota de API key mientras no haya llegado ningún fragmento.
+    """
+    mensaje = _construir_contexto_turno(idioma_detectado, confidence, user_facts, resumen_historial) + texto_usuario
+
+    last_error = "ninguna key disponible (todas en enfriamiento)"
+    for indice_key in pool_gemini.orden_de_intento():
+        # El cliente queda arrendado mientras dure el stream
+        with pool_gemini.arrendar(indice_key) as arriendo:
+            model = _modelo_gemini(
+                indice_key, arriendo.cliente, _generation_config_chat,
+                ('chat', scenario, idioma_nativo, idioma_objetivo),
+                lambda: _construir_prompt_chat(scenario, idioma_nativo, idioma_objetivo)
+            )
+
+            try:
+                chat_session = model.start_chat(history=historial_chat)
+                chunks = iter(chat_session.send_message(mensaje, stream=True))
+                primero = next(chunks, None)
+            except Exception as e:
+                arriendo.fallo(e)
+                last_error = str(e)
+                logger.warning(f"⚠️ API Key #{indice_key+1} falló (stream): {last_error}. Intentando siguiente key...")
+                continue
+
+            if primero is not None:
+                yield _texto_chunk(primero)
+            for chunk in chunks:
+                yield _texto_chunk(chunk)
+            return
+
+    logger.error(f"❌ Todas las API keys fallaron (stream). Último error: {last_error}")
+    yield json.dumps(_respuesta_fallback(f"Error: Todas las API keys están agotadas. Último error: {last_error}"))
+
+
+_generation_config_resumen = {
+    "temperature": 0.3,
+    "max_output_tokens": 1024,
+    "response_mime_type": "text/plain",
+}
+
+_PROMPT_RESUMEN = """
+Resumes conversaciones de práctica de idiomas entre un usuario y su tutor (bot).
+Recibes el resumen anterior (puede estar vacío) y los mensajes que vinieron después.
+Devuelve UN resumen actualizado, en español, de máximo 150 palabras, con: temas tratados,
+datos que el usuario contó, errores que se le corrigieron y lo que quedó pendiente.
+Solo el texto del resumen, sin títulos ni formato.
+"""
+
+
+def resumir_historial_gemini(resumen_previo, mensajes):
+    """
+    Resumen incremental: combina el resumen anterior con `mensajes` (lista de (rol, texto)).
+    Devuelve el texto del resumen o None si ninguna key respondió.
+    """
+    transcripcion = "\n".join(f"{'Usuario' if rol == 'usuario' else 'Tutor'}: {texto}" for rol, texto in mensajes)
+    contenido = f"RESUMEN ANTERIOR:\n{resumen_previo or '(vacío)'}\n\nMENSAJES NUEVOS:\n{transcripcion}"
+
+    last_error = "ninguna key disponible (todas en enfriamiento)"
+    for indice_key in pool_gemini.orden_de_intento():
+        try:
+            with pool_gemini.arrendar(indice_key) as arriendo:
+                model = _modelo_gemini(
+                    indice_key, arriendo.cliente, _generation_config_resumen,
+                    ('resumen',), lambda: _PROMPT_RESUMEN
+                )
+                texto = model.generate_content(contenido).text
+            return texto.strip()
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"⚠️ API Key #{indice_key+1} falló (resumen): {last_error}. Intentando siguiente key...")
+            continue
+
+    logger.error(f"❌ No se pudo resumir el historial. Último error: {last_error}")
+    return None
+
+
+_ESCAPES_JSON = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+
+class ExtractorCampoJSON:
+    """
+    Extrae de forma incremental el valor (string) de un campo de un JSON que llega por partes.
+    Se usa para reenviar 'respuesta_bot' al navegador mientras Gemini sigue generando el resto.
+    """
+
+    def __init__(self, campo):
+        self._patron = re.compile(r'"%s"\s*:\s*"' % re.escape(campo))
+        self._buffer = ''
+        self._pos = None  # Inicio del valor (o lo siguiente por leer) dentro del buffer
+        self.terminado = False
+
+    def feed(self, fragmento):
+        """Agrega un fragmento y devuelve el texto nuevo del campo (ya sin escapes)."""
+        if self.terminado:
+            return ''
+        self._buffer += fragmento
+        if self._pos is None:
+            match = self._patron.search(self._buffer)
+            if not match:
+                return ''
+            self._pos = match.end()
+
+        salida = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self.terminado = True
+                i += 1
+                break
+            if c == '\\':
+                # Escape partido entre dos fragmentos: esperamos al siguiente
+                if i + 1 >= len(buf):
+                    break
+                esc = buf[i + 1]
+                if esc == 'u':
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        salida.append(chr(int(buf[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                salida.append(_ESCAPES_JSON.get(esc, esc))
+                i += 2
+                continue
+            salida.append(c)
+            i += 1
+        self._pos = i
+        return ''.join(salida)
+
+
+_generation_config_quiz = {
+    "temperature": 0.8,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 4096,
+    "response_mime_type": "application/json",
+}
 
 
 def generar_quiz_gemini(mensajes_texto, idioma_objetivo, idioma_nativo='Español', num_preguntas=8):
@@ -341,28 +640,50 @@ def generar_quiz_gemini(mensajes_texto, idioma_objetivo, idioma_nativo='Español
     Genera un quiz de selección simple basado en las conversaciones del usuario.
     Retorna una lista de preguntas con opciones y respuesta correcta.
     """
-    generation_config = {
-        "temperature": 0.8,
-        "top_p": 0.95,
-        "top_k": 40,
-        "max_output_tokens": 4096,
-        "response_mime_type": "application/json",
-    }
-
-    # Construir contexto de conversaciones
+    # Construir contexto de conversaciones (va en el contenido, no en el prompt de sistema)
     contexto_conversaciones = "\n".join(mensajes_texto[:100])  # Máx 100 mensajes
 
-    system_prompt = f"""
+    last_error = "ninguna key disponible (todas en enfriamiento)"
+    for indice_key in pool_gemini.orden_de_intento():
+        try:
+            with pool_gemini.arrendar(indice_key) as arriendo:
+                model = _modelo_gemini(
+                    indice_key, arriendo.cliente, _generation_config_quiz,
+                    ('quiz', idioma_objetivo, idioma_nativo, num_preguntas),
+                    lambda: _construir_prompt_quiz(idioma_objetivo, idioma_nativo, num_preguntas)
+                )
+                response = model.generate_content(
+                    f"CONVERSACIONES DEL USUARIO:\n{contexto_conversaciones}\n\n"
+                    f"Genera un quiz de {num_preguntas} preguntas basado en las conversaciones proporcionadas."
+                )
+                texto = response.text
+
+            cleaned_text = texto.replace('```json', '').replace('```', '').strip()
+            parsed_data = json.loads(cleaned_text)
+            return parsed_data
+
+        except json.JSONDecodeError as e:
+            logger.error(f"Error JSON Quiz Gemini (Key #{indice_key+1}): {e}", exc_info=True)
+            return None
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"[Warning] Quiz API Key #{indice_key+1} fallo: {last_error}. Intentando siguiente key...")
+            continue
+    
+    logger.error(f"[Error] Todas las API keys fallaron para Quiz. Ultimo error: {last_error}")
+    return None
+
+
+def _construir_prompt_quiz(idioma_objetivo, idioma_nativo, num_preguntas):
+    """Prompt de sistema del generador de quizzes (estable por idiomas y cantidad de preguntas)."""
+    return f"""
     Eres un generador de quizzes educativos para aprendizaje de idiomas.
     
     CONTEXTO:
     - El usuario habla {idioma_nativo} y está aprendiendo {idioma_objetivo}.
-    - A continuación tienes fragmentos de sus conversaciones recientes de práctica.
+    - En el mensaje recibirás fragmentos de sus conversaciones recientes de práctica (CONVERSACIONES DEL USUARIO).
     - Usa las conversaciones SOLO para extraer vocabulario, estructuras gramaticales y conjugaciones que el usuario practicó.
     
-    CONVERSACIONES DEL USUARIO:
-    {contexto_conversaciones}
-    
     REGLAS PARA GENERAR EL QUIZ:
     1. Las preguntas deben evaluar HABILIDADES LINGÜÍSTICAS: vocabulario, gramática, conjugación y traducción.
     2. NUNCA hagas preguntas sobre preferencias, opiniones u datos personales del usuario (ej: "¿qué bebida prefiere?", "¿a dónde viajó?").
@@ -411,34 +732,3 @@ def generar_quiz_gemini(mensajes_texto, idioma_objetivo, idioma_nativo='Español
     IMPORTANTE: respuesta_correcta es el ÍNDICE (0=A, 1=B, 2=C, 3=D).
     IMPORTANTE: categoria debe ser uno de: "vocabulario", "gramatica", "conjugacion".
     """
-
-    last_error = None
-    for attempt in range(len(_api_keys)):
-        api_key = _get_next_api_key()
-        _configure_genai(api_key)
-
-        model = genai.GenerativeModel(
-            model_name="gemini-2.5-flash",
-            generation_config=generation_config,
-            system_instruction=system_prompt
-        )
-
-        try:
-            response = model.generate_content(
-                f"Genera un quiz de {num_preguntas} preguntas basado en las conversaciones proporcionadas."
-            )
-            
-            cleaned_text = response.text.replace('```json', '').replace('```', '').strip()
-            parsed_data = json.loads(cleaned_text)
-            return parsed_data
-
-        except json.JSONDecodeError as e:
-            logger.error(f"Error JSON Quiz Gemini (Key #{attempt+1}): {e}", exc_info=True)
-            return None
-        except Exception as e:
-            last_error = str(e)
-            logger.warning(f"[Warning] Quiz API Key #{attempt+1} fallo: {last_error}. Intentando siguiente key...")
-            continue
-    
-    logger.error(f"[Error] Todas las API keys fallaron para Quiz. Ultimo error: {last_error}")
-    return None
\ No newline at end of file
@@ -2,34 +2,53 @@
 
 import json
 import base64
+import os
+import re
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.mail import send_mail # <--- Importante
 from django.conf import settings # <--- FIXED
 import random # <--- Importante
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from google.cloud import texttospeech, speech
+from django.db import transaction
 from django.db.models import Count
-from django.db.models.functions import TruncDate
+from django.db.models.functions import TruncDate, Lower
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import User
 from django.db.models import Q, Exists, OuterRef
 from .models import AlertaSistema
-from .utils import render_to_pdf, generar_quiz_gemini
+from .utils import generar_quiz_gemini
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth import logout
 from django.views.decorators.http import require_POST
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 
 # Importamos nuestros modelos y formularios
-from .models import Conversacion, Mensaje, RegistroError, ConfiguracionVoz, ProgresoUsuario, ErrorPronunciacion, Vocabulario
+from .models import Conversacion, Mensaje, RegistroError, ConfiguracionVoz, ProgresoUsuario, ErrorPronunciacion, Vocabulario, TrabajoReporte
 from .forms import RegistroForm
+from .tts_cache import cache_tts
+from .gemini_pool import pool_gemini
+from .historial import construir_historial, registrar_mensaje
+from .hechos import hechos_relevantes, borrar_indice as borrar_indice_hechos, estadisticas as estadisticas_hechos
+from .estadisticas import estadisticas_dashboard
+from .actividad import descontar_conversacion, registrar_actividad
+from . import leaderboard
+from .paginacion import CursorInvalido, limite_pedido, paginar
+from .exportacion import exportar_conversacion
+from .stt import idiomas_reconocimiento
+from .clientes_google import cliente_stt
+from . import sdks
+from .preproceso_audio import normalizar_audio
+from .perfil_idioma import invalidar_perfil, perfil_idioma
+from .reportes import encolar_reporte_errores, ruta_archivo as ruta_archivo_reporte
 # Importamos la lógica de IA
-from .utils import obtener_respuesta_gemini, texto_a_voz_bytes, actualizar_progreso
+from .utils import obtener_respuesta_gemini, texto_a_voz_url, texto_a_voz_url_async, actualizar_progreso
+from .utils import obtener_respuesta_gemini_stream, parsear_respuesta_gemini, ExtractorCampoJSON
 
 
 # ---------------------------------------------------------
@@ -60,7 +79,7 @@ def register(request):
             progreso, _ = ProgresoUsuario.objects.get_or_create(usuario=user)
             progreso.codigo_verificacion = codigo
             progreso.cuenta_verificada = False
-            progreso.save()
+            progreso.save(update_fields=['codigo_verificacion', 'cuenta_verificada'])
             
             # 3. Enviar Correo
             asunto = "Verifica tu cuenta en Naza Bot"
@@ -108,7 +127,7 @@ def verify_email(request):
             # ¡ÉXITO!
             progreso.cuenta_verificada = True
             progreso.codigo_verificacion = None # Limpiamos por seguridad
-            progreso.save()
+            progreso.save(update_fields=['cuenta_verificada', 'codigo_verificacion'])
             
             # Logueamos al usuario
             login(request, user)
@@ -139,7 +158,7 @@ def resend_verification_code(request):
     # Reutilizamos el código existente o generamos uno nuevo si se prefiere
     if not progreso.codigo_verificacion:
          progreso.codigo_verificacion = str(random.randint(100000, 999999))
-         progreso.save()
+         progreso.save(update_fields=['codigo_verificacion'])
     
     codigo = progreso.codigo_verificacion
 
@@ -176,12 +195,14 @@ def resend_verification_code(request):
 
     return redirect('verify_email')
 
+# Tamaños de página (paginación por cursor, ver core/paginacion.py)
+CONVERSACIONES_POR_PAGINA = 30
+MENSAJES_POR_PAGINA = 100
+ERRORES_POR_PAGINA = 50
+
 @login_required
 def home(request):
-    # 1. Cargar conversaciones
-    mis_conversaciones = Conversacion.objects.filter(usuario=request.user).order_by('-fecha_inicio')
-    
-    # 2. OBTENER EL PROGRESO (CRÍTICO)
+    # 1. OBTENER EL PROGRESO (CRÍTICO)
     # Usamos get_or_create para que nunca sea None
     progreso, created = ProgresoUsuario.objects.get_or_create(usuario=request.user)
 
@@ -192,9 +213,15 @@ def home(request):
         request.session['verification_user_id'] = request.user.id
         return redirect('verify_email')
 
+    # 2. Cargar la primera página de conversaciones (el resto, con "Cargar más")
+    mis_conversaciones, chats_next_cursor = paginar(
+        Conversacion.objects.filter(usuario=request.user), 'fecha_inicio', limite=CONVERSACIONES_POR_PAGINA
+    )
+
     # 3. Enviar al contexto
     context = {
         'chats': mis_conversaciones,
+        'chats_next_cursor': chats_next_cursor,
         'progreso': progreso  # <--- ¡ESTA VARIABLE ES LA CLAVE!
     }
     return render(request, 'core/chat.html', context)
@@ -202,6 +229,292 @@ def home(request):
 # SECCIÓN 2: LÓGICA DEL CHAT (CEREBRO)
 # ---------------------------------------------------------
 
+def _evento_sse(evento, datos):
+    """Formatea un evento Server-Sent Events (text/event-stream)."""
+    return f"event: {evento}\ndata: {json.dumps(datos)}\n\n"
+
+
+def _preparar_turno_chat(user, data):
+    """
+    Primera mitad del turno (todo lo que va ANTES de llamar a Gemini):
+    conversación, mensaje del usuario, memoria corta/larga e idiomas.
+    Devuelve un diccionario con lo que necesita el resto del turno.
+    """
+    user_text = data.get('text')
+
+    # Recibimos el idioma detectado y el ESCENARIO (Roleplay)
+    detected_lang = data.get('detected_lang', 'es-ES') 
+    scenario = data.get('scenario', 'general') 
+    confidence = data.get('confidence', 1.0) 
+    
+    # --- GESTIÓN DE CONVERSACIÓN ---
+    conversation_id = data.get('conversation_id')
+    conversacion = None
+    
+    # Buscar conversación existente
+    if conversation_id:
+        conversacion = Conversacion.objects.filter(id_conversacion=conversation_id, usuario=user).first()
+    
+    # Si no existe, crear nueva
+    if not conversacion:
+        titulo_chat = f"Rol: {scenario.capitalize()}" if scenario != 'general' else f"{user_text[:20]}..."
+        conversacion = Conversacion.objects.create(
+            usuario=user,
+            titulo=titulo_chat,
+            idioma_actual='es-en'
+        )
+        registrar_actividad(user, conversaciones=1)
+
+    # Guardar el mensaje del Usuario
+    mensaje_usuario = Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto=user_text)
+    registrar_mensaje(conversacion, mensaje_usuario)
+    registrar_actividad(user, mensajes=1)
+
+    # --- MEMORIA A CORTO PLAZO ---
+    # Mensajes recientes textuales (con presupuesto de tokens) + resumen de los antiguos
+    historial_gemini, resumen_historial = construir_historial(conversacion, excluir_id=mensaje_usuario.id_mensaje)
+
+    # --- MEMORIA A LARGO PLAZO (USER FACTS) ---
+    # Solo los hechos relevantes para este mensaje y el historial reciente
+    lista_hechos = hechos_relevantes(user, user_text, historial_gemini)
+
+    # --- MULTILENGUAJE DINÁMICO ---
+    # Perfil de idioma del usuario (en caché: sin consulta en la mayoría de los turnos)
+    perfil = perfil_idioma(user)
+
+    return {
+        'user': user,
+        'user_text': user_text,
+        'confidence': confidence,
+        'conversacion': conversacion,
+        'mensaje_usuario': mensaje_usuario,
+        'perfil': perfil,
+        'gemini_kwargs': {
+            'historial_chat': historial_gemini,
+            'texto_usuario': user_text,
+            'idioma_detectado': detected_lang,
+            'scenario': scenario,
+            'confidence': confidence,
+            'user_facts': lista_hechos,
+            'idioma_nativo': perfil.idioma_nativo,
+            'idioma_objetivo': perfil.idioma_objetivo,
+            'resumen_historial': resumen_historial,
+        },
+    }
+
+
+def _guardar_hechos_nuevos(user, datos):
+    """
+    Inserta en lote los hechos que el usuario aún no tiene: una consulta para ver cuáles
+    existen y un bulk_create. La restricción única (usuario, dato) cubre las carreras
+    entre requests simultáneos (ignore_conflicts).
+    """
+    from .models import UserFact
+    candidatos = list(dict.fromkeys(d.strip()[:255] for d in datos if isinstance(d, str) and d.strip()))
+    if not candidatos:
+        return
+    existentes = set(UserFact.objects.filter(usuario=user, dato__in=candidatos).values_list('dato', flat=True))
+    UserFact.objects.bulk_create(
+        [UserFact(usuario=user, dato=dato) for dato in candidatos if dato not in existentes],
+        ignore_conflicts=True
+    )
+
+
+def _guardar_vocabulario_nuevo(user, items):
+    """
+    Igual que _guardar_hechos_nuevos pero para el SRS: la palabra se compara sin
+    distinguir mayúsculas (restricción única sobre Lower(palabra)).
+    """
+    candidatos = {}
+    for item in items:
+        palabra = (item.get('palabra') or '').strip()[:100]
+        traduccion = (item.get('traduccion') or '').strip()[:150]
+        if palabra and traduccion:
+            candidatos.setdefault(palabra.lower(), (palabra, traduccion, item.get('ejemplo')))
+    if not candidatos:
+        return
+    existentes = set(
+        Vocabulario.objects.filter(usuario=user)
+        .annotate(palabra_lower=Lower('palabra'))
+        .filter(palabra_lower__in=list(candidatos))
+        .values_list('palabra_lower', flat=True)
+    )
+    Vocabulario.objects.bulk_create(
+        [
+            Vocabulario(usuario=user, palabra=palabra, traduccion=traduccion, ejemplo=ejemplo, nivel_dominio=0)
+            for clave, (palabra, traduccion, ejemplo) in candidatos.items() if clave not in existentes
+        ],
+        ignore_conflicts=True
+    )
+
+
+def _guardar_respuesta_chat(turno, gemini_data):
+    """
+    Segunda mitad del turno (sin audio): auditoría, hechos, mensaje del bot,
+    errores y vocabulario. Devuelve el payload de texto para el frontend.
+    """
+    user = turno['user']
+    user_text = turno['user_text']
+    confidence = turno['confidence']
+    conversacion = turno['conversacion']
+    mensaje_usuario = turno['mensaje_usuario']
+    from .models import UserFact
+
+    print(f"DEBUG: gemini_data type: {type(gemini_data)}")
+    print(f"DEBUG: gemini_data: {gemini_data}")
+    
+    # --- AUDITORIA IA (NUEVO) ---
+    if 'auditoria' in gemini_data:
+        audit = gemini_data['auditoria']
+        mensaje_usuario.es_toxico = audit.get('es_toxico', False)
+        mensaje_usuario.categoria_seguridad = audit.get('categoria', 'SAFE')
+        mensaje_usuario.confianza_seguridad = audit.get('confianza', 0.0)
+        mensaje_usuario.save()
+    
+    # Si gemini_data es string (por alguna razón rara), intentamos parsear por seguridad
+    if isinstance(gemini_data, str):
+        print("DEBUG: gemini_data IS STRING! Parsing manually...")
+        gemini_data = json.loads(gemini_data)
+    
+    # --- GUARDAR NUEVOS HECHOS APRENDIDOS ---
+    nuevos_datos = gemini_data.get('nuevos_datos_aprendidos', [])
+    if nuevos_datos:
+        print(f"🧠 MEMORY: Learning new facts: {nuevos_datos}")
+        _guardar_hechos_nuevos(user, nuevos_datos)
+
+    bot_text = gemini_data['respuesta_bot']
+
+    # Guardar mensaje del Bot (TEXTO LIMPIO)
+    msg_bot = Mensaje.objects.create(conversacion=conversacion, rol='bot', contenido_texto=bot_text)
+    registrar_mensaje(conversacion, msg_bot)
+    turno['msg_bot'] = msg_bot
+    
+    # 4. GUARDAR ERRORES (GRAMATICALES Y PRONUNCIACIÓN)
+    if gemini_data.get('hay_error') and gemini_data.get('correccion'):
+        RegistroError.objects.create(
+            usuario=user,
+            mensaje=msg_bot,
+            texto_original=gemini_data.get('texto_original', user_text),
+            texto_corregido=gemini_data.get('correccion'),
+            explicacion_regla=gemini_data.get('explicacion')
+        )
+    
+    # --- GUARDAR ERROR DE PRONUNCIACIÓN ---
+    tip_pronunciacion = gemini_data.get('tip_pronunciacion')
+    texto_corregido_fonetico = gemini_data.get('texto_corregido_fonetico')
+
+    # --- SRS - GUARDAR VOCABULARIO ---
+    nuevas_palabras = gemini_data.get('nuevas_palabras', [])
+    if nuevas_palabras:
+        try:
+            _guardar_vocabulario_nuevo(user, nuevas_palabras)
+        except Exception as e:
+            print(f"Error SRS Save: {e}")
+
+    print(f"DEBUG PRONUNCIATION: Confidence={confidence}, Tip={tip_pronunciacion}")
+
+    if tip_pronunciacion:
+         try:
+             nuevo_error = ErrorPronunciacion.objects.create(
+                 usuario=user,
+                 conversacion=conversacion,
+                 texto_original=user_text,
+                 texto_corregido_fonetico=texto_corregido_fonetico,
+                 tip_fonetico=tip_pronunciacion,
+                 confidence=confidence
+             )
+             print(f"DEBUG PRONUNCIATION: Saved Error ID {nuevo_error.id} for user {user.username}")
+         except Exception as e:
+             print(f"DEBUG PRONUNCIATION: ERROR SAVING TO DB: {e}")
+
+    return {
+        'bot_text': bot_text,
+        'correccion': gemini_data.get('correccion') if gemini_data.get('hay_error') else None,
+        'explicacion_regla': gemini_data.get('explicacion'),
+        'tip_pronunciacion': tip_pronunciacion,
+        'texto_corregido_fonetico': texto_corregido_fonetico, # <--- NUEVO CAMPO PARA UI
+        'nuevas_palabras': nuevas_palabras,
+        'conversation_id': conversacion.id_conversacion,
+        'conversation_title': conversacion.titulo,
+        'conversation_date': conversacion.fecha_inicio.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def _iniciar_audio_chat(turno, gemini_data):
+    """
+    Elige la voz según el idioma de la respuesta y lanza la síntesis en segundo plano.
+    Devuelve el Future del TTS: las escrituras en BD del turno corren mientras tanto.
+    """
+    bot_text = gemini_data['respuesta_bot']
+    # --- NUEVO: VOZ PERSONALIZADA ---
+    # Usamos el texto con "fillers" para el audio, y el limpio para el chat
+    audio_text = gemini_data.get('respuesta_audio', bot_text)
+    
+    idioma_respuesta = gemini_data.get('idioma_respuesta', 'es-ES')
+
+    # --- VOZ DINÁMICA (SOPORTE MULTILENGUAJE MEJORADO) ---
+    # Voz nativa, del tutor o de un tercer idioma según el idioma de la respuesta
+    perfil = turno['perfil']
+    voice_code = perfil.voz_para(idioma_respuesta)
+
+    # Generar el audio (USA audio_text con fillers). La URL queda en Mensaje.audio_url:
+    # el blob se conserva fuera de la evicción de la caché
+    return texto_a_voz_url_async(audio_text, voice_code, perfil.velocidad, conservar=True)
+
+
+def _esperar_audio_chat(turno, futuro_audio):
+    """
+    Espera el TTS lanzado por _iniciar_audio_chat y devuelve la URL del audio ('' si falla).
+    La URL queda guardada en Mensaje.audio_url del mensaje del bot.
+    """
+    try:
+        audio_url = futuro_audio.result(timeout=30)
+    except Exception as e:
+        print(f"Error TTS Google: {e}")
+        return ""
+    Mensaje.objects.filter(pk=turno['msg_bot'].pk).update(audio_url=audio_url)
+    return audio_url
+
+
+def _eventos_chat_sse(turno):
+    """
+    Generador del modo streaming: manda 'respuesta_bot' token a token mientras Gemini
+    escribe y después, como eventos separados, correcciones, vocabulario, audio y el
+    payload final ('fin', idéntico a la respuesta JSON del modo normal).
+    """
+    try:
+        extractor = ExtractorCampoJSON('respuesta_bot')
+        texto_crudo = []
+        for fragmento in obtener_respuesta_gemini_stream(**turno['gemini_kwargs']):
+            texto_crudo.append(fragmento)
+            texto_nuevo = extractor.feed(fragmento)
+            if texto_nuevo:
+                yield _evento_sse('token', {'texto': texto_nuevo})
+
+        gemini_data = parsear_respuesta_gemini(''.join(texto_crudo))
+        futuro_audio = _iniciar_audio_chat(turno, gemini_data)
+
+        respuesta = _guardar_respuesta_chat(turno, gemini_data)
+        yield _evento_sse('correccion', {
+            'correccion': respuesta['correccion'],
+            'explicacion_regla': respuesta['explicacion_regla'],
+            'tip_pronunciacion': respuesta['tip_pronunciacion'],
+            'texto_corregido_fonetico': respuesta['texto_corregido_fonetico'],
+        })
+        yield _evento_sse('vocabulario', {'nuevas_palabras': respuesta['nuevas_palabras']})
+
+        # --- GAMIFICACIÓN ---
+        respuesta['gamification'] = actualizar_progreso(turno['user'])
+
+        respuesta['audio_url'] = _esperar_audio_chat(turno, futuro_audio)
+        yield _evento_sse('audio', {'audio_url': respuesta['audio_url']})
+        yield _evento_sse('fin', respuesta)
+
+    except Exception as e:
+        print(f"Error CRÍTICO en Chat (stream): {e}")
+        yield _evento_sse('error', {'error': str(e)})
+
+
 @login_required
 def chat_interaction(request):
     """
@@ -210,6 +523,7 @@ def chat_interaction(request):
     - Soporte de Roleplay (Escenarios).
     - Voz Dinámica (Espejo de género).
     - Gamificación y Registro de Errores.
+    - Modo streaming (SSE) si el cliente manda "stream": true o Accept: text/event-stream.
     """
     if request.method == 'POST':
         try:
@@ -217,231 +531,33 @@ def chat_interaction(request):
             print(f"DEBUG: request.body type: {type(request.body)}")
             data = json.loads(request.body)
             print(f"DEBUG: data type after json.loads: {type(data)}")
-            
-            user_text = data.get('text')
-            user = request.user
-            
-            # Recibimos el idioma detectado y el ESCENARIO (Roleplay)
-            detected_lang = data.get('detected_lang', 'es-ES') 
-            scenario = data.get('scenario', 'general') 
-            confidence = data.get('confidence', 1.0) 
-            
-            # --- GESTIÓN DE CONVERSACIÓN ---
-            conversation_id = data.get('conversation_id')
-            conversacion = None
-            
-            # Buscar conversación existente
-            if conversation_id:
-                conversacion = Conversacion.objects.filter(id_conversacion=conversation_id, usuario=user).first()
-            
-            # Si no existe, crear nueva
-            if not conversacion:
-                titulo_chat = f"Rol: {scenario.capitalize()}" if scenario != 'general' else f"{user_text[:20]}..."
-                conversacion = Conversacion.objects.create(
-                    usuario=user,
-                    titulo=titulo_chat,
-                    idioma_actual='es-en'
-                )
 
-            # Guardar el mensaje del Usuario
-            mensaje_usuario = Mensaje.objects.create(conversacion=conversacion, rol='usuario', contenido_texto=user_text)
+            turno = _preparar_turno_chat(request.user, data)
 
-            # --- MEMORIA A CORTO PLAZO (NUEVO) ---
-            # Recuperar últimos 30 mensajes (suficiente para una conversación larga sin romper contexto)
-            # Gemini 1.5 Flash tiene 1M de tokens, así que 30 mensajes es muy seguro y rápido.
-            mensajes_db = Mensaje.objects.filter(conversacion=conversacion).order_by('-timestamp')[1:31] # Saltamos el 0 (actual)
-            mensajes_db = reversed(mensajes_db) # Poner en orden cronológico
-            
-            historial_gemini = []
-            for m in mensajes_db:
-                role = 'user' if m.rol == 'usuario' else 'model'
-                historial_gemini.append({'role': role, 'parts': [m.contenido_texto]})
-            
-            print(f"DEBUG MEMORY: Sending {len(historial_gemini)} methods of context.")
-
-            # --- MEMORIA A LARGO PLAZO (USER FACTS) ---
-            # 1. Recuperar hechos conocidos extraidos de UserFacts
-            # (Se importó UserFact arriba? Asegurarse de importar)
-            from .models import UserFact # Importación local para evitar líos circulares si los hubiera
-            hechos_db = UserFact.objects.filter(usuario=user).values_list('dato', flat=True)
-            lista_hechos = list(hechos_db)
-
-            # --- MULTILENGUAJE DINÁMICO ---
-            # Recuperar configuración de idioma del usuario
-            config_voz = ConfiguracionVoz.objects.filter(usuario=user).first()
-            idioma_nativo = config_voz.idioma_nativo if config_voz else 'Español'
-            idioma_objetivo = config_voz.idioma_objetivo if config_voz else 'Inglés'
+            # --- MODO STREAMING (SSE) ---
+            # El primer byte sale con el primer token de Gemini en vez de esperar todo el turno
+            if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+                response = StreamingHttpResponse(_eventos_chat_sse(turno), content_type='text/event-stream')
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no' # Evita que un proxy (nginx) acumule el stream
+                return response
 
             # --- CEREBRO (GEMINI) ---
             print("DEBUG: Calling obtaining_respuesta_gemini...")
-            gemini_data = obtener_respuesta_gemini(
-                historial_gemini, 
-                user_text, 
-                detected_lang, 
-                scenario, 
-                confidence, 
-                user_facts=lista_hechos,
-                idioma_nativo=idioma_nativo,
-                idioma_objetivo=idioma_objetivo
-            )
-            print(f"DEBUG: gemini_data type: {type(gemini_data)}")
-            print(f"DEBUG: gemini_data: {gemini_data}")
-            
-            # --- AUDITORIA IA (NUEVO) ---
-            if 'auditoria' in gemini_data:
-                audit = gemini_data['auditoria']
-                mensaje_usuario.es_toxico = audit.get('es_toxico', False)
-                mensaje_usuario.categoria_seguridad = audit.get('categoria', 'SAFE')
-                mensaje_usuario.confianza_seguridad = audit.get('confianza', 0.0)
-                mensaje_usuario.save()
-            
-            # Si gemini_data es string (por alguna razón rara), intentamos parsear por seguridad
-            if isinstance(gemini_data, str):
-                print("DEBUG: gemini_data IS STRING! Parsing manually...")
-                gemini_data = json.loads(gemini_data)
-            
-            # --- GUARDAR NUEVOS HECHOS APRENDIDOS ---
-            nuevos_datos = gemini_data.get('nuevos_datos_aprendidos', [])
-            if nuevos_datos:
-                print(f"🧠 MEMORY: Learning new facts: {nuevos_datos}")
-                for dato in nuevos_datos:
-                    # Evitar duplicados exactos
-                    if not UserFact.objects.filter(usuario=user, dato=dato).exists():
-                        UserFact.objects.create(usuario=user, dato=dato)
-
-            bot_text = gemini_data['respuesta_bot']
-            # --- NUEVO: VOZ PERSONALIZADA ---
-            # Usamos el texto con "fillers" para el audio, y el limpio para el chat
-            audio_text = gemini_data.get('respuesta_audio', bot_text)
-            
-            idioma_respuesta = gemini_data.get('idioma_respuesta', 'es-ES')
-
-            # Guardar mensaje del Bot (TEXTO LIMPIO)
-            msg_bot = Mensaje.objects.create(conversacion=conversacion, rol='bot', contenido_texto=bot_text)
-            
-            # 4. GUARDAR ERRORES (GRAMATICALES Y PRONUNCIACIÓN)
-            if gemini_data.get('hay_error') and gemini_data.get('correccion'):
-                RegistroError.objects.create(
-                    usuario=user,
-                    mensaje=msg_bot,
-                    texto_original=gemini_data.get('texto_original', user_text),
-                    texto_corregido=gemini_data.get('correccion'),
-                    explicacion_regla=gemini_data.get('explicacion')
-                )
-            
-            # --- GUARDAR ERROR DE PRONUNCIACIÓN ---
-            tip_pronunciacion = gemini_data.get('tip_pronunciacion')
-            texto_corregido_fonetico = gemini_data.get('texto_corregido_fonetico')
-
-            # --- SRS - GUARDAR VOCABULARIO ---
-            nuevas_palabras = gemini_data.get('nuevas_palabras', [])
-            if nuevas_palabras:
-                try:
-                    from .models import Vocabulario
-                    for item in nuevas_palabras:
-                        palabra = item.get('palabra')
-                        traduccion = item.get('traduccion')
-                        ejemplo = item.get('ejemplo')
-                        
-                        if palabra and traduccion:
-                            existe = Vocabulario.objects.filter(usuario=user, palabra__iexact=palabra).exists()
-                            if not existe:
-                                Vocabulario.objects.create(
-                                    usuario=user,
-                                    palabra=palabra,
-                                    traduccion=traduccion,
-                                    ejemplo=ejemplo,
-                                    nivel_dominio=0
-                                )
-                except Exception as e:
-                    print(f"Error SRS Save: {e}")
-
-            print(f"DEBUG PRONUNCIATION: Confidence={confidence}, Tip={tip_pronunciacion}")
-
-            if tip_pronunciacion:
-                 try:
-                     nuevo_error = ErrorPronunciacion.objects.create(
-                         usuario=user,
-                         conversacion=conversacion,
-                         texto_original=user_text,
-                         texto_corregido_fonetico=texto_corregido_fonetico,
-                         tip_fonetico=tip_pronunciacion,
-                         confidence=confidence
-                     )
-                     print(f"DEBUG PRONUNCIATION: Saved Error ID {nuevo_error.id} for user {user.username}")
-                 except Exception as e:
-                     print(f"DEBUG PRONUNCIATION: ERROR SAVING TO DB: {e}")
-
-            # --- VOZ DINÁMICA (SOPORTE MULTILENGUAJE MEJORADO) ---
-            # --- VOZ DINÁMICA (SOPORTE MULTILENGUAJE MEJORADO) ---
-            config_voz = ConfiguracionVoz.objects.filter(usuario=user).first()
-            
-            # 1. Obtener las voces configuradas por el usuario
-            voz_target = config_voz.voice_code_tts if config_voz else 'en-US-Studio-O'
-            voz_native = config_voz.voice_code_native_tts if config_voz else 'es-ES-Neural2-B'
-            
-            # 2. Detectar idioma de la respuesta (ISO code, ej: 'es-ES', 'en-US')
-            lang_respuesta = idioma_respuesta.split('-')[0].lower() # 'es', 'en'
-            
-            # 3. Idiomas del usuario (Códigos aproximados)
-            # Mapa simple basado en nombres de idioma en BD
-            LANG_CODE_MAP = {
-                'Inglés': 'en', 'Español': 'es', 'Francés': 'fr', 'Alemán': 'de', 
-                'Italiano': 'it', 'Portugués': 'pt', 'Japonés': 'ja', 
-                'Chino': 'zh', 'Ruso': 'ru'
-            }
-            
-            user_native_lang = LANG_CODE_MAP.get(config_voz.idioma_nativo, 'es') if config_voz else 'es'
-            user_target_lang = LANG_CODE_MAP.get(config_voz.idioma_objetivo, 'en') if config_voz else 'en'
-
-            # 4. Selección de Voz Inteligente
-            if lang_respuesta == user_native_lang:
-                # Si Naza habla en tu idioma nativo -> Usa tu voz nativa de alta calidad
-                voice_code = voz_native
-            elif lang_respuesta == user_target_lang:
-                 # Si Naza habla en el idioma que aprendes -> Usa la voz del tutor
-                voice_code = voz_target
-            else:
-                # Fallback para terceros idiomas (ej: si aprendes Inglés pero pides una frase en Francés)
-                if lang_respuesta == 'en': voice_code = 'en-US-Studio-O'
-                elif lang_respuesta == 'es': voice_code = 'es-ES-Studio-C'
-                elif lang_respuesta == 'fr': voice_code = 'fr-FR-Studio-A'
-                elif lang_respuesta == 'de': voice_code = 'de-DE-Studio-C'
-                elif lang_respuesta == 'it': voice_code = 'it-IT-Neural2-A'
-                elif lang_respuesta == 'pt': voice_code = 'pt-BR-Neural2-A'
-                elif lang_respuesta == 'ja': voice_code = 'ja-JP-Neural2-B'
-                elif lang_respuesta == 'zh': voice_code = 'zh-CN-Wavenet-A'
-                elif lang_respuesta == 'ru': voice_code = 'ru-RU-Wavenet-A'
-                else: voice_code = voz_target # Último recurso 
-
-            # Velocidad de voz
-            speaking_rate = float(config_voz.velocidad) if config_voz else 1.0
-
-            # Generar el audio (USA audio_text con fillers)
-            try:
-                audio_bytes = texto_a_voz_bytes(audio_text, voice_code, speaking_rate)
-                audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-            except Exception as e:
-                print(f"Error TTS Google: {e}")
-                audio_base64 = ""
+            gemini_data = obtener_respuesta_gemini(**turno['gemini_kwargs'])
 
+            # Pipeline: el TTS arranca apenas tenemos la respuesta y las escrituras
+            # en BD (hechos, errores, vocabulario, progreso) corren mientras sintetiza.
+            futuro_audio = _iniciar_audio_chat(turno, gemini_data)
+            respuesta = _guardar_respuesta_chat(turno, gemini_data)
 
             # --- GAMIFICACIÓN ---
-            datos_juego = actualizar_progreso(user)
+            respuesta['gamification'] = actualizar_progreso(request.user)
+
+            respuesta['audio_url'] = _esperar_audio_chat(turno, futuro_audio)
 
             # --- RESPUESTA JSON ---
-            return JsonResponse({
-                'bot_text': bot_text,
-                'audio_base64': audio_base64,
-                'correccion': gemini_data.get('correccion') if gemini_data.get('hay_error') else None,
-                'explicacion_regla': gemini_data.get('explicacion'),
-                'tip_pronunciacion': tip_pronunciacion,
-                'texto_corregido_fonetico': texto_corregido_fonetico, # <--- NUEVO CAMPO PARA UI
-                'conversation_id': conversacion.id_conversacion,
-                'conversation_title': conversacion.titulo,
-                'conversation_date': conversacion.fecha_inicio.strftime('%Y-%m-%d %H:%M:%S'),
-                'gamification': datos_juego
-            })
+            return JsonResponse(respuesta)
 
         except Exception as e:
             print(f"Error CRÍTICO en Chat: {e}")
@@ -453,22 +569,12 @@ def chat_interaction(request):
 # SECCIÓN 3: APIs DE GOOGLE CLOUD (STT y TTS)
 # ---------------------------------------------------------
 
-# Cliente STT global para reutilizar conexión (inicializado lazy)
-stt_client = None
-
 @csrf_exempt
 def speech_to_text_api(request):
     """API para convertir audio del micrófono a texto"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Solo POST'}, status=405)
 
-    global stt_client
-    if stt_client is None:
-        try:
-            stt_client = speech.SpeechClient()
-        except Exception as e:
-            return JsonResponse({'error': f'STT init error: {str(e)}'}, status=500)
-
     try:
         data = json.loads(request.body)
         audio_base64 = data.get('audio_base64')
@@ -477,51 +583,30 @@ def speech_to_text_api(request):
         if not audio_base64:
             return JsonResponse({'error': 'Falta audio'}, status=400)
 
-        audio_content = base64.b64decode(audio_base64)
-        recognition_audio = speech.RecognitionAudio(content=audio_content)
+        # Detecta el formato real, recorta silencios y pasa a mono 16 kHz (ver preproceso_audio.py)
+        audio = normalizar_audio(base64.b64decode(audio_base64))
+        if not audio.contenido:
+            # Audio vacío: no hace falta llamar a Google
+            return JsonResponse({'transcript': '', 'detected_lang': 'es-ES', 'confidence': 0.0})
+        speech = sdks.speech()
+        recognition_audio = speech.RecognitionAudio(content=audio.contenido)
         
         # --- CONFIGURACIÓN DINÁMICA DE IDIOMA (STT) ---
-        # 1. Mapeo de nombres de idioma (BD) a Códigos Google (ISO)
-        LANG_MAP = {
-            'Español': 'es-ES', 'Inglés': 'en-US', 'Francés': 'fr-FR',
-            'Alemán': 'de-DE', 'Italiano': 'it-IT', 'Portugués': 'pt-BR',
-            'Japonés': 'ja-JP', 'Chino': 'zh-CN', 'Ruso': 'ru-RU'
-        }
+        # Principal: el idioma que quiere APRENDER; alternativos: su idioma nativo, etc.
+        primary_lang, alternative_langs = idiomas_reconocimiento(request.user)
 
-        # 2. Valores por defecto
-        primary_lang = 'es-ES'
-        alternative_langs = ['en-US']
-
-        # 3. Intentar sacar la configuración real del usuario
-        if request.user.is_authenticated:
-            try:
-                # Importación local para evitar ciclos si fuera necesario, aunque ya está arriba
-                config_voz = ConfiguracionVoz.objects.filter(usuario=request.user).first()
-                if config_voz:
-                    # Prioridad 1: El idioma que quiere APRENDER (ej: Francés)
-                    primary_lang = LANG_MAP.get(config_voz.idioma_objetivo, 'es-ES')
-                    
-                    # Prioridad 2: Su idioma nativo (ej: Español)
-                    native_lang = LANG_MAP.get(config_voz.idioma_nativo, 'es-ES')
-                    
-                    # Construimos lista de alternatives (sin duplicados)
-                    alts = set([native_lang, 'en-US', 'es-ES'])
-                    if primary_lang in alts: alts.remove(primary_lang) # Quitar si ya es el primario
-                    alternative_langs = list(alts)[:3] # Google permite máx 3
-            except Exception as e:
-                print(f"Error cargando config de voz usuario: {e}")
-
-        # 4. Configurar Google Cloud STT
+        # Configurar Google Cloud STT con el encoding y la frecuencia que el audio tiene de verdad
         config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.MP3,
-            sample_rate_hertz=16000,
+            encoding=speech.RecognitionConfig.AudioEncoding[audio.encoding],
+            sample_rate_hertz=audio.sample_rate or 0,
             language_code=primary_lang, # <--- ¡AHORA ES DINÁMICO! (ej: fr-FR)
             alternative_language_codes=alternative_langs, # <--- Escucha también en su idioma nativo
             enable_automatic_punctuation=True
         )
 
         # 2. Reconocimiento
-        response = stt_client.recognize(config=config, audio=recognition_audio)
+        # Cliente del worker (creado al arrancar; se recrea solo si el canal falla)
+        response = cliente_stt.llamar(lambda client: client.recognize(config=config, audio=recognition_audio))
 
         transcript = ""
         detected_lang = "es-ES" # Por defecto
@@ -565,23 +650,94 @@ def text_to_speech_api(request):
         if not texto:
             return JsonResponse({'error': 'Falta texto'}, status=400)
 
-        audio_bytes = texto_a_voz_bytes(texto, voice_code)
-        audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+        audio_url = texto_a_voz_url(texto, voice_code)
         
-        return JsonResponse({'audio_base64': audio_base64})
+        return JsonResponse({'audio_url': audio_url})
 
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _rango_http(cabecera, tamano):
+    """Parsea 'Range: bytes=inicio-fin' (un solo rango). Devuelve (inicio, fin) o None si no aplica."""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (cabecera or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    inicio, fin = match.groups()
+    if inicio == '':
+        # Sufijo: los últimos N bytes
+        inicio, fin = max(0, tamano - int(fin)), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    return inicio, fin
+
+
+def _leer_archivo(ruta, inicio, largo, bloque=64 * 1024):
+    """Generador que lee `largo` bytes desde `inicio` en bloques (para StreamingHttpResponse)."""
+    with open(ruta, 'rb') as f:
+        f.seek(inicio)
+        while largo > 0:
+            datos = f.read(min(bloque, largo))
+            if not datos:
+                break
+            largo -= len(datos)
+            yield datos
+
+
+def audio_blob(request, audio_hash):
+    """
+    Sirve un audio TTS por su hash de contenido. Como el contenido nunca cambia para una
+    URL dada, los audios conservados (los de los mensajes) se cachean "para siempre" en el
+    navegador (ETag + immutable); los de la caché de TTS pueden desaparecer por la
+    evicción, así que solo por un rato. Soporta Range para que <audio> pueda hacer seek
+    sin bajar todo.
+    """
+    ruta = cache_tts.ruta_audio(audio_hash)
+    try:
+        tamano = os.path.getsize(ruta)
+    except OSError:
+        return JsonResponse({'error': 'Audio no encontrado'}, status=404)
+
+    etag = f'"{audio_hash}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+    else:
+        rango = _rango_http(request.headers.get('Range'), tamano)
+        if rango and (rango[0] >= tamano or rango[0] > rango[1]):
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{tamano}'
+            return response
+        inicio, fin = rango if rango else (0, tamano - 1)
+        largo = fin - inicio + 1
+        response = StreamingHttpResponse(_leer_archivo(ruta, inicio, largo), content_type='audio/mpeg',
+                                         status=206 if rango else 200)
+        response['Content-Length'] = str(largo)
+        if rango:
+            response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    if ruta == cache_tts.ruta_conservado(audio_hash):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
 @login_required
 def get_conversation_detail(request, conversation_id):
-    """API para obtener los mensajes de una conversación específica"""
+    """
+    API para obtener los mensajes de una conversación específica.
+    Devuelve la página más reciente (en orden cronológico); `next_cursor` pide la anterior.
+    """
     try:
         # 1. Buscamos la conversación y aseguramos que pertenezca al usuario
         conversacion = Conversacion.objects.get(id_conversacion=conversation_id, usuario=request.user)
         
-        # 2. Obtenemos los mensajes ordenados cronológicamente
-        mensajes = conversacion.mensajes.all().order_by('timestamp')
+        # 2. Página de mensajes (de la más reciente hacia atrás) y la damos vuelta para mostrarla
+        mensajes, next_cursor = paginar(
+            conversacion.mensajes.all(), 'timestamp', cursor=request.GET.get('cursor'),
+            limite=limite_pedido(request, MENSAJES_POR_PAGINA, MENSAJES_POR_PAGINA * 2)
+        )
+        mensajes.reverse()
         
         # 3. Convertimos a datos simples (lista de diccionarios) para JSON
         mensajes_data = []
@@ -592,8 +748,8 @@ def get_conversation_detail(request, conversation_id):
                 'audio_url': msg.audio_url # Por si guardamos audios en el futuro
             })
             
-        # 4. Obtenemos los errores de esta conversación
-        errores = RegistroError.objects.filter(mensaje__conversacion=conversacion).order_by('timestamp')
+        # 4. Obtenemos los errores de los mensajes de esta página
+        errores = RegistroError.objects.filter(mensaje__in=[msg.pk for msg in mensajes]).order_by('timestamp', 'id_error')
         errores_data = []
         for error in errores:
             errores_data.append({
@@ -603,10 +759,27 @@ def get_conversation_detail(request, conversation_id):
                 'fecha': error.timestamp.strftime("%H:%M")
             })
 
-        return JsonResponse({'mensajes': mensajes_data, 'errores': errores_data, 'titulo': conversacion.titulo})
+        return JsonResponse({
+            'mensajes': mensajes_data, 'errores': errores_data, 'titulo': conversacion.titulo,
+            'next_cursor': next_cursor,
+        })
         
     except Conversacion.DoesNotExist:
         return JsonResponse({'error': 'Conversación no encontrada'}, status=404)
+    except CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+@login_required
+def export_conversation(request, conversation_id):
+    """Descarga el historial completo de una conversación en streaming (?formato=json|ndjson)"""
+    conversacion = get_object_or_404(Conversacion, id_conversacion=conversation_id, usuario=request.user)
+    formato = 'ndjson' if request.GET.get('formato') == 'ndjson' else 'json'
+    content_type = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+
+    response = StreamingHttpResponse(exportar_conversacion(conversacion, formato),
+                                     content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="conversacion_{conversacion.id_conversacion}.{formato}"'
+    return response
 
 @login_required
 def get_pronunciation_errors(request):
@@ -633,10 +806,13 @@ def get_pronunciation_errors(request):
 
 @login_required
 def get_conversations(request):
-    """API para obtener todas las conversaciones del usuario"""
+    """API para obtener las conversaciones del usuario, de a una página (?cursor=&limit=)"""
     try:
-        # 1. Obtenemos todas las conversaciones del usuario
-        conversaciones = Conversacion.objects.filter(usuario=request.user).order_by('-fecha_inicio')
+        # 1. Obtenemos una página de conversaciones del usuario, de la más reciente a la más antigua
+        conversaciones, next_cursor = paginar(
+            Conversacion.objects.filter(usuario=request.user), 'fecha_inicio', cursor=request.GET.get('cursor'),
+            limite=limite_pedido(request, CONVERSACIONES_POR_PAGINA, 100)
+        )
         
         # 2. Convertimos a datos simples (lista de diccionarios) para JSON
         conversaciones_data = []
@@ -648,8 +824,10 @@ def get_conversations(request):
             })
 
             
-        return JsonResponse({'conversaciones': conversaciones_data})
+        return JsonResponse({'conversaciones': conversaciones_data, 'next_cursor': next_cursor})
         
+    except CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -659,11 +837,14 @@ from .forms import ConfiguracionVozForm # <-- Asegúrate de importar esto
 def perfil(request):
     # Intentamos obtener la config, si no existe, se crea una por defecto
     config, created = ConfiguracionVoz.objects.get_or_create(usuario=request.user)
+    if created:
+        invalidar_perfil(request.user.pk)  # El perfil en caché era el de "sin configuración"
 
     if request.method == 'POST':
         form = ConfiguracionVozForm(request.POST, instance=config)
         if form.is_valid():
             form.save()
+            invalidar_perfil(request.user.pk)
             return redirect('home') # O redirigir a 'perfil' para mostrar mensaje de éxito
     else:
         form = ConfiguracionVozForm(instance=config)
@@ -682,6 +863,7 @@ def update_voice_settings_api(request):
             config.voice_code_native_tts = data.get('voice_code_native', config.voice_code_native_tts)
             config.velocidad = float(data.get('speed', config.velocidad))
             config.save()
+            invalidar_perfil(request.user.pk)
             
             return JsonResponse({'status': 'ok'})
         except Exception as e:
@@ -706,24 +888,37 @@ def get_user_errors_api(request):
 
 @login_required
 def historial_errores_view(request):
-    """Renderiza la página completa de historial de errores con filtros"""
+    """Renderiza la página de historial de errores con filtros, de a ERRORES_POR_PAGINA (?cursor=)"""
     # 1. Obtener conversación seleccionada (filtro)
     conversation_id = request.GET.get('conversation_id')
     selected_chat = None
 
     # Base QuerySet
-    errores = RegistroError.objects.filter(usuario=request.user).select_related('mensaje__conversacion').order_by('-timestamp')
+    errores = RegistroError.objects.filter(usuario=request.user).select_related('mensaje__conversacion')
 
     # Aplicar filtro si existe
     if conversation_id:
         errores = errores.filter(mensaje__conversacion__id_conversacion=conversation_id)
         selected_chat = get_object_or_404(Conversacion, id_conversacion=conversation_id, usuario=request.user)
+
+    total_errores = errores.count()
+    try:
+        pagina, next_cursor = paginar(errores, 'timestamp', cursor=request.GET.get('cursor'), limite=ERRORES_POR_PAGINA)
+    except CursorInvalido:
+        return redirect('historial_errores')
     
-    # 2. Obtener lista de chats para el dropdown (solo los que tienen errores sería ideal, pero todos está bien)
-    conversaciones = Conversacion.objects.filter(usuario=request.user).order_by('-fecha_inicio')
+    # 2. Obtener lista de chats recientes para el dropdown (más el seleccionado, si es más antiguo)
+    conversaciones = list(
+        Conversacion.objects.filter(usuario=request.user).order_by('-fecha_inicio', '-id_conversacion')[:CONVERSACIONES_POR_PAGINA]
+    )
+    if selected_chat and selected_chat not in conversaciones:
+        conversaciones.append(selected_chat)
     
     context = {
-        'errores': errores,
+        'errores': pagina,
+        'total_errores': total_errores,
+        'next_cursor': next_cursor,
+        'es_primera_pagina': not request.GET.get('cursor'),
         'chats': conversaciones,
         'selected_chat': selected_chat, # Para resaltar en UI
     }
@@ -749,10 +944,9 @@ def preview_voice_api(request):
             speed = float(data.get('speed', 1.0))
             
             # Usamos tu utilidad existente
-            audio_bytes = texto_a_voz_bytes(texto, voice_code, speed)
-            audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+            audio_url = texto_a_voz_url(texto, voice_code, speed)
             
-            return JsonResponse({'audio_base64': audio_base64})
+            return JsonResponse({'audio_url': audio_url})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     return JsonResponse({'error': 'POST required'}, status=400)
@@ -821,7 +1015,10 @@ def admin_user_delete(request, user_id):
     if user.is_superuser and user == request.user:
         messages.error(request, "No puedes eliminarte a ti mismo.")
     else:
+        user_id = user.pk
         user.delete()
+        leaderboard.invalidar()
+        borrar_indice_hechos(user_id)
         messages.success(request, "Usuario eliminado correctamente.")
     return redirect('admin_users_list')
 
@@ -908,6 +1105,21 @@ def admin_audit_logs(request):
     
     return render(request, 'core/admin_audit.html', context)
 
+@user_passes_test(es_admin)
+def admin_tts_cache_stats(request):
+    """Contadores de la caché de audio TTS (hits/misses por nivel) del worker que responde."""
+    return JsonResponse(cache_tts.estadisticas())
+
+@user_passes_test(es_admin)
+def admin_gemini_keys_stats(request):
+    """Salud de cada API key de Gemini (circuit breaker, errores, cuota) en el worker que responde."""
+    return JsonResponse({'pid': os.getpid(), 'keys': pool_gemini.estadisticas()})
+
+@user_passes_test(es_admin)
+def admin_hechos_stats(request):
+    """Recuperación de UserFacts: consultas, ms promedio y tokens de prompt ahorrados (worker que responde)."""
+    return JsonResponse(estadisticas_hechos())
+
 @user_passes_test(es_admin)
 def admin_broadcast(request):
     """Permite al admin crear o apagar alertas globales"""
@@ -939,53 +1151,76 @@ def get_system_alert(request):
         return JsonResponse({'mensaje': alerta.mensaje, 'activa': True})
     return JsonResponse({'activa': False})
 
+def _estado_reporte(trabajo):
+    datos = {
+        'id': trabajo.pk,
+        'estado': trabajo.estado,
+        'url_estado': reverse('estado_reporte', args=[trabajo.pk]),
+    }
+    if trabajo.estado == 'listo':
+        datos['url_descarga'] = reverse('descargar_reporte', args=[trabajo.pk])
+    elif trabajo.estado == 'error':
+        datos['error'] = trabajo.error
+    return datos
+
+def _encolar_reporte(request):
+    conversation_id = request.GET.get('conversation_id') or request.POST.get('conversation_id')
+    chat = None
+    if conversation_id:
+        chat = get_object_or_404(Conversacion, id_conversacion=conversation_id, usuario=request.user)
+    return encolar_reporte_errores(request.user, chat)
+
 @login_required
 def export_errors_pdf(request):
-    """Genera un PDF con el historial de errores para imprimir"""
-    # 1. Filtro opcional
-    conversation_id = request.GET.get('conversation_id')
-    selected_chat_title = "Resumen General"
+    """
+    PDF con el historial de errores para imprimir. Se genera en segundo plano
+    (worker_reportes): si ya está listo se sirve directo; si no, una página espera y lo descarga.
+    """
+    trabajo = _encolar_reporte(request)
+    if trabajo.estado == 'listo':
+        return descargar_reporte(request, trabajo.pk)
+    return render(request, 'core/reporte_pendiente.html', {'reporte': _estado_reporte(trabajo)})
 
-    errores = RegistroError.objects.filter(usuario=request.user).select_related('mensaje__conversacion').order_by('-timestamp')
+@login_required
+@require_POST
+def encolar_reporte_api(request):
+    """Encola (o reutiliza) el reporte PDF de errores y devuelve su estado"""
+    return JsonResponse(_estado_reporte(_encolar_reporte(request)), status=202)
 
-    if conversation_id:
-        errores = errores.filter(mensaje__conversacion__id_conversacion=conversation_id)
-        chat = get_object_or_404(Conversacion, id_conversacion=conversation_id, usuario=request.user)
-        selected_chat_title = f"Reporte: {chat.titulo}"
-    
-    # Datos para el PDF
-    context = {
-        'usuario': request.user,
-        'errores': errores,
-        'fecha_generacion': timezone.now(),
-        'report_title': selected_chat_title
-    }
-    
-    # Renderizamos usando un template específico para PDF
-    return render_to_pdf('core/pdf_template.html', context)
+@login_required
+def estado_reporte_api(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoReporte, pk=trabajo_id, usuario=request.user)
+    return JsonResponse(_estado_reporte(trabajo))
+
+@login_required
+def descargar_reporte(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoReporte, pk=trabajo_id, usuario=request.user, estado='listo')
+    try:
+        archivo = open(ruta_archivo_reporte(trabajo), 'rb')
+    except FileNotFoundError:
+        raise Http404("El reporte ya no está disponible")
+    return FileResponse(archivo, content_type='application/pdf', filename=f'reporte_errores_{trabajo.pk}.pdf')
 
 @login_required
 def get_leaderboard_api(request):
-    """Devuelve el Top 10"""
-    
-    # 1. FIX: Asegurar que EL USUARIO ACTUAL tenga su registro creado
-    # Si no existía, lo crea ahora mismo para que aparezca en la lista
-    ProgresoUsuario.objects.get_or_create(usuario=request.user)
-
-    # 2. Obtener Top 10
-    top_players = ProgresoUsuario.objects.filter(publico_en_leaderboard=True)\
-                                         .select_related('usuario')\
-                                         .order_by('-experiencia')[:10]
-    
-    data = []
-    for p in top_players:
-        data.append({
-            'username': p.usuario.username,
-            'xp': p.experiencia,
-            'nivel': p.nivel,
-            'es_yo': p.usuario == request.user # Bool para resaltar
-        })
-    return JsonResponse({'leaderboard': data})
+    """Devuelve el Top 10 (desde la caché compartida) y la posición del usuario"""
+
+    # Asegurar que EL USUARIO ACTUAL tenga su registro creado para que aparezca en la lista.
+    # Basta con comprobarlo una vez por sesión, no en cada sondeo del chat.
+    if not request.session.get('progreso_asegurado'):
+        progreso, creado = ProgresoUsuario.objects.get_or_create(usuario=request.user)
+        if creado:
+            leaderboard.actualizar_xp(request.user, progreso.experiencia, progreso.nivel,
+                                      progreso.publico_en_leaderboard)
+        request.session['progreso_asegurado'] = True
+
+    data = [{
+        'username': e['username'],
+        'xp': e['experiencia'],
+        'nivel': e['nivel'],
+        'es_yo': e['usuario_id'] == request.user.id  # Bool para resaltar
+    } for e in leaderboard.top()]
+    return JsonResponse({'leaderboard': data, 'mi_posicion': leaderboard.posicion(request.user.id)})
 
 @login_required
 def save_gamification_settings_api(request):
@@ -996,7 +1231,8 @@ def save_gamification_settings_api(request):
             progreso = request.user.progresousuario
             progreso.mostrar_gamificacion = data.get('mostrar', True)
             progreso.publico_en_leaderboard = data.get('publico', True)
-            progreso.save()
+            progreso.save(update_fields=['mostrar_gamificacion', 'publico_en_leaderboard'])
+            leaderboard.invalidar()
             return JsonResponse({'status': 'ok'})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -1027,10 +1263,9 @@ def tts_word_api(request):
             voice_code = 'en-US-Wavenet-D' if lang == 'en-US' else 'es-ES-Wavenet-C'
 
             # Generar audio
-            audio_bytes = texto_a_voz_bytes(text, voice_code)
-            audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+            audio_url = texto_a_voz_url(text, voice_code)
 
-            return JsonResponse({'audio_base64': audio_base64})
+            return JsonResponse({'audio_url': audio_url})
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -1041,7 +1276,9 @@ def tts_word_api(request):
 def delete_conversation(request, conversation_id):
     """Elimina una conversación específica del usuario"""
     chat = get_object_or_404(Conversacion, id_conversacion=conversation_id, usuario=request.user)
-    chat.delete()
+    with transaction.atomic():
+        descontar_conversacion(chat)  # Antes del delete: los mensajes se borran en cascada
+        chat.delete()
     return JsonResponse({'status': 'deleted', 'id': conversation_id})
 
 @login_required
@@ -1091,7 +1328,8 @@ def repaso_vocabulario(request):
             nuevas_fecha = now + timedelta(days=dias_extra)
             
         vocab.proximo_repaso = nuevas_fecha
-        vocab.save()
+        vocab.save(update_fields=['nivel_dominio', 'proximo_repaso'])
+        registrar_actividad(request.user, flashcards_repasadas=1)
         
         return JsonResponse({'status': 'ok'})
 
@@ -1127,196 +1365,9 @@ from datetime import timedelta
 @login_required
 def quiz_dashboard(request):
     """Dashboard de Quizzes: lista todos los quizzes del usuario con score acumulativo."""
-    quizzes = Quiz.objects.filter(usuario=request.user).order_by('-fecha_creacion')
-    
-    # Calcular score acumulativo (promedio de TODOS los intentos completados)
-    intentos_completados = IntentoQuiz.objects.filter(
-        usuario=request.user, completado=True
-    )
-    total_intentos = intentos_completados.count()
-    
-    if total_intentos > 0:
-        suma_puntajes = sum(i.puntaje for i in intentos_completados)
-        score_acumulativo = round(suma_puntajes / total_intentos, 1)
-    else:
-        score_acumulativo = None
-    
-    # --- NUEVOS DATOS PARA DASHBOARD UNIFICADO (PHASE 3) ---
-    # 1. Progreso del Usuario (Nivel, XP, Racha)
-    progreso, _ = ProgresoUsuario.objects.get_or_create(usuario=request.user)
-    
-    # 2. Flashcards Pendientes (SRS)
-    flashcards_pendientes = Vocabulario.objects.filter(
-        usuario=request.user,
-        proximo_repaso__lte=timezone.now()
-    ).count()
-
-    # 3. Leaderboard (Top 5 XP)
-    leaderboard = ProgresoUsuario.objects.filter(
-        publico_en_leaderboard=True
-    ).select_related('usuario').order_by('-experiencia')[:5]
-
-    # --- PHASE 7: NEW WIDGET DATA ---
-    
-    today = timezone.now().date()
-    
-    # 4. Streak Calendar (last 30 days activity heatmap)
-    thirty_days_ago = today - timedelta(days=29)
-    
-    # Get conversation dates
-    convo_dates = Conversacion.objects.filter(
-        usuario=request.user,
-        fecha_inicio__date__gte=thirty_days_ago
-    ).values('fecha_inicio__date').annotate(count=Count('id_conversacion'))
-    
-    # Get quiz attempt dates
-    quiz_dates = IntentoQuiz.objects.filter(
-        usuario=request.user,
-        completado=True,
-        fecha__date__gte=thirty_days_ago
-    ).values('fecha__date').annotate(count=Count('id'))
-    
-    # Merge into a single dict {date_str: activity_count}
-    activity_map = {}
-    for entry in convo_dates:
-        d = entry['fecha_inicio__date'].isoformat()
-        activity_map[d] = activity_map.get(d, 0) + entry['count']
-    for entry in quiz_dates:
-        d = entry['fecha__date'].isoformat()
-        activity_map[d] = activity_map.get(d, 0) + entry['count']
-    
-    # Build 30-day calendar list
-    calendar_data = []
-    for i in range(30):
-        day = thirty_days_ago + timedelta(days=i)
-        day_str = day.isoformat()
-        calendar_data.append({
-            'date': day_str,
-            'day_num': day.day,
-            'weekday': day.strftime('%a'),
-            'count': activity_map.get(day_str, 0),
-        })
-    
-    # 5. Weekly Progress (last 7 days breakdown)
-    seven_days_ago = today - timedelta(days=6)
-    weekly_data = []
-    day_labels = {'Mon': 'Lun', 'Tue': 'Mar', 'Wed': 'Mié', 'Thu': 'Jue', 'Fri': 'Vie', 'Sat': 'Sáb', 'Sun': 'Dom'}
-    
-    for i in range(7):
-        day = seven_days_ago + timedelta(days=i)
-        convos = Conversacion.objects.filter(
-            usuario=request.user, fecha_inicio__date=day
-        ).count()
-        quizzes_day = IntentoQuiz.objects.filter(
-            usuario=request.user, completado=True, fecha__date=day
-        ).count()
-        en_label = day.strftime('%a')
-        weekly_data.append({
-            'label': day_labels.get(en_label, en_label),
-            'date': day.isoformat(),
-            'convos': convos,
-            'quizzes': quizzes_day,
-            'total': convos + quizzes_day,
-        })
-    
-    max_weekly = max((d['total'] for d in weekly_data), default=1) or 1
-    
-    # 6. Achievement Badges
-    total_convos = Conversacion.objects.filter(usuario=request.user).count()
-    total_mensajes = Mensaje.objects.filter(conversacion__usuario=request.user, rol='usuario').count()
-    total_vocab = Vocabulario.objects.filter(usuario=request.user).count()
-    total_quizzes_completed = IntentoQuiz.objects.filter(usuario=request.user, completado=True).count()
-    has_perfect = IntentoQuiz.objects.filter(usuario=request.user, completado=True, puntaje=100).exists()
-    
-    badges = [
-        {'icon': 'chat', 'name': 'Primera Conversación', 'desc': 'Inicia tu primera conversación', 'unlocked': total_convos >= 1},
-        {'icon': 'quiz', 'name': 'Primer Quiz', 'desc': 'Completa tu primer quiz', 'unlocked': total_quizzes_completed >= 1},
-        {'icon': 'local_fire_department', 'name': 'Racha de 7', 'desc': 'Mantén una racha de 7 días', 'unlocked': progreso.racha_actual >= 7},
-        {'icon': 'emoji_events', 'name': 'Score Perfecto', 'desc': 'Obtén 100% en un quiz', 'unlocked': has_perfect},
-        {'icon': 'menu_book', 'name': '50 Palabras', 'desc': 'Aprende 50 palabras nuevas', 'unlocked': total_vocab >= 50},
-        {'icon': 'military_tech', 'name': 'Nivel 5', 'desc': 'Alcanza el nivel 5', 'unlocked': progreso.nivel >= 5},
-        {'icon': 'forum', 'name': '100 Mensajes', 'desc': 'Envía 100 mensajes', 'unlocked': total_mensajes >= 100},
-        {'icon': 'school', 'name': '10 Quizzes', 'desc': 'Completa 10 quizzes', 'unlocked': total_quizzes_completed >= 10},
-    ]
-    badges_unlocked = sum(1 for b in badges if b['unlocked'])
-    
-    # 7. Daily Goals (today's progress)
-    convos_today = Conversacion.objects.filter(
-        usuario=request.user, fecha_inicio__date=today
-    ).count()
-    quizzes_today = IntentoQuiz.objects.filter(
-        usuario=request.user, completado=True, fecha__date=today
-    ).count()
-    flashcards_today = Vocabulario.objects.filter(
-        usuario=request.user, ultimo_repaso__date=today
-    ).count()
-    
-    daily_goals = [
-        {'icon': 'chat', 'label': 'Conversaciones', 'current': min(convos_today, 3), 'target': 3, 'pct': min(100, round(convos_today / 3 * 100))},
-        {'icon': 'quiz', 'label': 'Quizzes', 'current': min(quizzes_today, 1), 'target': 1, 'pct': min(100, round(quizzes_today / 1 * 100))},
-        {'icon': 'style', 'label': 'Flashcards', 'current': min(flashcards_today, 5), 'target': 5, 'pct': min(100, round(flashcards_today / 5 * 100))},
-    ]
-    
-    # 8. Skill Progress (accuracy per QuizPregunta category)
-    skill_progress = []
-    for cat_code, cat_name in [('vocabulario', 'Vocabulario'), ('gramatica', 'Gramática'), ('conjugacion', 'Conjugación')]:
-        total_resp = RespuestaIntento.objects.filter(
-            intento__usuario=request.user,
-            intento__completado=True,
-            pregunta__categoria=cat_code
-        ).count()
-        correct_resp = RespuestaIntento.objects.filter(
-            intento__usuario=request.user,
-            intento__completado=True,
-            pregunta__categoria=cat_code,
-            es_correcta=True
-        ).count()
-        accuracy = round(correct_resp / total_resp * 100) if total_resp > 0 else 0
-        skill_progress.append({
-            'name': cat_name,
-            'accuracy': accuracy,
-            'total': total_resp,
-            'correct': correct_resp,
-        })
-
-    # Preparar datos de quizzes con info de estado
-    quizzes_data = []
-    for quiz in quizzes:
-        mejor = quiz.mejor_puntaje()
-        puede_reintentar = quiz.puede_reintentar()
-        dias_restantes = quiz.dias_para_reintentar()
-        num_intentos = quiz.intentos.filter(completado=True).count()
-        
-        quizzes_data.append({
-            'quiz': quiz,
-            'mejor_puntaje': mejor,
-            'puede_reintentar': puede_reintentar,
-            'dias_restantes': dias_restantes,
-            'num_intentos': num_intentos,
-        })
-    
-    context = {
-        'quizzes_data': quizzes_data,
-        'score_acumulativo': score_acumulativo,
-        'total_intentos': total_intentos,
-        'total_quizzes': quizzes.count(),
-        
-        # Phase 3 Contexts
-        'progreso': progreso,
-        'flashcards_pendientes': flashcards_pendientes,
-        'leaderboard': leaderboard,
-        'user': request.user,
-        
-        # Phase 7 Contexts
-        'calendar_data': calendar_data,
-        'weekly_data': weekly_data,
-        'max_weekly': max_weekly,
-        'badges': badges,
-        'badges_unlocked': badges_unlocked,
-        'badges_total': len(badges),
-        'daily_goals': daily_goals,
-        'skill_progress': skill_progress,
-    }
+    # Todo sale de consultas agregadas (ver core/estadisticas.py)
+    context = estadisticas_dashboard(request.user)
+    context['user'] = request.user
     return render(request, 'core/quiz_dashboard.html', context)
 
 
@@ -1331,9 +1382,8 @@ def generar_quiz_api(request):
         user = request.user
         
         # 1. Obtener configuración de idioma
-        config_voz = ConfiguracionVoz.objects.filter(usuario=user).first()
-        idioma_nativo = config_voz.idioma_nativo if config_voz else 'Español'
-        idioma_objetivo = config_voz.idioma_objetivo if config_voz else 'Inglés'
+        perfil = perfil_idioma(user)
+        idioma_nativo, idioma_objetivo = perfil.idioma_nativo, perfil.idioma_objetivo
         
         # 2. Recopilar mensajes de TODAS las conversaciones recientes
         mensajes = Mensaje.objects.filter(
@@ -1454,34 +1504,24 @@ def tomar_quiz(request, quiz_id):
         intento.puntaje = puntaje
         intento.completado = True
         
-        # GAMIFICACIÓN: Otorgar XP por completar intento
-        xp_ganada = 50
-        progreso, _ = ProgresoUsuario.objects.get_or_create(usuario=request.user)
-        progreso.experiencia += xp_ganada
-        progreso.racha_actual += 1 # Aumentar racha por actividad (opcional)
-        progreso.ultima_interaccion = timezone.now()
-        
-        # Level Up Check (Simple: cada 1000 XP sube nivel, o formula actual)
-        xp_necesaria = progreso.nivel * 500
-        subio_nivel = False
-        if progreso.experiencia >= xp_necesaria:
-            progreso.nivel += 1
-            progreso.experiencia -= xp_necesaria
-            subio_nivel = True
-            
-        progreso.save()
+        # GAMIFICACIÓN: Otorgar XP por completar intento (mismas reglas de nivel y racha que el chat)
+        recompensa = actualizar_progreso(request.user, xp=50)
         
         # Guardar info en sesión para mostrar en resultado
         request.session['quiz_rewards'] = {
-            'xp': xp_ganada,
-            'levelup': subio_nivel,
-            'nivel_nuevo': progreso.nivel
+            'xp': recompensa['xp_ganada'],
+            'levelup': recompensa['subio_nivel'],
+            'nivel_nuevo': recompensa['nivel_actual']
         }
 
         # La fecha de desbloqueo ahora es dinámica en el modelo, no necesitamos guardarla aquí.
         # Solo guardamos para referencia si se desea, o lo dejamos null.
         # intento.disponible_desde = ... (IGNORADO POR MODELO)
         intento.save()
+        registrar_actividad(
+            request.user, fecha=timezone.localdate(intento.fecha),
+            quizzes_completados=1, suma_puntajes=puntaje, quizzes_perfectos=int(puntaje == 100)
+        )
         
         return redirect('resultado_quiz', intento_id=intento.id)
 
@@ -0,0 +1,154 @@
+# core/ws_stt.py
+"""
+WebSocket /ws/stt/ (ASGI, ver naza/asgi.py): reconocimiento de voz en streaming.
+
+Protocolo:
+- El navegador manda los fragmentos del MediaRecorder (WebM/Opus) como mensajes binarios
+  a medida que graba, y el texto "fin" cuando el usuario deja de hablar.
+- El servidor responde JSON: {"tipo": "parcial", "transcript"} mientras se habla y
+  {"tipo": "final", "transcript", "detected_lang", "confidence"} al terminar (los mismos
+  campos que /api/stt/). Ante un fallo: {"tipo": "error", "error"}.
+
+La llamada a Google (bloqueante, gRPC) corre en un hilo; los fragmentos le llegan por una
+cola y sus resultados vuelven al event loop con call_soon_threadsafe.
+"""
+import asyncio
+import json
+import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+
+from .stt import FIN_DE_AUDIO, idiomas_reconocimiento, reconocer_en_streaming
+
+logger = logging.getLogger('core')
+
+MAX_FRAGMENTOS_EN_COLA = 200  # ~50 s de audio con fragmentos de 250 ms
+MAX_BYTES_FRAGMENTO = 256 * 1024
+SEGUNDOS_ESPERA_COLA = 10  # Si Google no consume audio en este tiempo, se aborta
+
+# Cada reconocimiento en curso ocupa un hilo durante toda la locución: pool propio para no
+# agotar el executor por defecto del event loop
+_hilos_reconocimiento = ThreadPoolExecutor(max_workers=32, thread_name_prefix='stt')
+
+
+def _cabeceras(scope):
+    return {nombre.decode('latin-1').lower(): valor.decode('latin-1') for nombre, valor in scope.get('headers', [])}
+
+
+def _mismo_origen(cabeceras):
+    """El WebSocket no tiene CSRF: se exige que Origin coincida con Host."""
+    origen = cabeceras.get('origin')
+    return bool(origen) and urlparse(origen).netloc == cabeceras.get('host')
+
+
+def _usuario_de_sesion(cabeceras):
+    """Usuario autenticado a partir de la cookie de sesión de Django (o AnonymousUser)."""
+    cookies = {}
+    for par in cabeceras.get('cookie', '').split(';'):
+        nombre, _, valor = par.strip().partition('=')
+        cookies[nombre] = valor
+    store = import_module(settings.SESSION_ENGINE).SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(SimpleNamespace(session=store))
+
+
+def _preparar(cabeceras):
+    """Idiomas de reconocimiento del usuario de la sesión, o None si no está autenticado."""
+    try:
+        usuario = _usuario_de_sesion(cabeceras)
+        return idiomas_reconocimiento(usuario) if usuario.is_authenticated else None
+    finally:
+        # Corre fuera del ciclo request/response de Django: la conexión no se cerraría sola
+        close_old_connections()
+
+
+async def _enviar_json(send, datos):
+    await send({'type': 'websocket.send', 'text': json.dumps(datos)})
+
+
+async def stt_websocket(scope, receive, send):
+    evento = await receive()
+    if evento['type'] != 'websocket.connect':
+        return
+
+    cabeceras = _cabeceras(scope)
+    if not _mismo_origen(cabeceras):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    idiomas = await sync_to_async(_preparar, thread_sensitive=False)(cabeceras)
+    if idiomas is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    loop = asyncio.get_running_loop()
+    fragmentos = queue.Queue(maxsize=MAX_FRAGMENTOS_EN_COLA)
+    resultados = asyncio.Queue()
+
+    def emitir(datos):
+        loop.call_soon_threadsafe(resultados.put_nowait, datos)
+
+    def reconocer():
+        try:
+            reconocer_en_streaming(*idiomas, fragmentos, emitir)
+        except Exception as e:
+            logger.error(f"[STT] Error en streaming_recognize: {e}")
+            emitir({'tipo': 'error', 'error': str(e)})
+
+    async def reenviar_resultados():
+        while True:
+            datos = await resultados.get()
+            await _enviar_json(send, datos)
+            if datos['tipo'] in ('final', 'error'):
+                return
+
+    reconocimiento = loop.run_in_executor(_hilos_reconocimiento, reconocer)
+    reenvio = asyncio.ensure_future(reenviar_resultados())
+
+    async def poner(dato):
+        # put bloquea si Google va atrasado: se hace en un hilo para no frenar el loop
+        await loop.run_in_executor(None, fragmentos.put, dato, True, SEGUNDOS_ESPERA_COLA)
+
+    audio_cerrado = False
+    try:
+        while not audio_cerrado and not reenvio.done():
+            recibir = asyncio.ensure_future(receive())
+            await asyncio.wait({recibir, reenvio}, return_when=asyncio.FIRST_COMPLETED)
+            if not recibir.done():
+                recibir.cancel()  # Terminó el reconocimiento (error) antes de que llegara más audio
+                break
+            mensaje = recibir.result()
+            if mensaje['type'] == 'websocket.disconnect':
+                reenvio.cancel()
+                return
+            if mensaje.get('bytes'):
+                if len(mensaje['bytes']) > MAX_BYTES_FRAGMENTO:
+                    raise ValueError("Fragmento de audio demasiado grande")
+                await poner(mensaje['bytes'])
+            elif mensaje.get('text') == 'fin':
+                await poner(FIN_DE_AUDIO)
+                audio_cerrado = True
+
+        await reenvio
+        await send({'type': 'websocket.close', 'code': 1000})
+    except Exception as e:
+        if isinstance(e, queue.Full):
+            e = RuntimeError("El reconocimiento no da abasto con el audio")
+        logger.error(f"[STT] WebSocket: {e}")
+        reenvio.cancel()
+        await _enviar_json(send, {'tipo': 'error', 'error': str(e)})
+        await send({'type': 'websocket.close', 'code': 1011})
+    finally:
+        # Siempre se cierra el flujo de audio para que el hilo de Google termine
+        if not audio_cerrado and not reconocimiento.done():
+            try:
+                await poner(FIN_DE_AUDIO)
+            except queue.Full:
+                logger.warning("[STT] El reconocimiento no consume audio; el hilo terminará por timeout de Google")
@@ -0,0 +1,33 @@
+# gunicorn.conf.py
+"""
+Configuración de gunicorn (start.sh la usa para el HTTP por WSGI y, con SERVIDOR_ASGI=1,
+para el proceso uvicorn que sólo atiende el WebSocket /ws/stt/).
+
+Ciclo de vida de los clientes de Google por worker (ver core/clientes_google.py):
+- post_fork: el worker descarta cualquier cliente heredado del master (con --preload el
+  master ya pudo haber creado canales gRPC, que no sobreviven a un fork).
+- post_worker_init: con la app ya cargada, crea y verifica los clientes en un hilo aparte
+  (sin retrasar el arranque ni el heartbeat del worker); el primer request de voz los
+  encuentra listos o espera, bajo el lock del cliente, a que termine su creación.
+"""
+import os
+import sys
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+threads = 4  # El worker de uvicorn (sólo WebSocket) lo ignora
+timeout = 60
+accesslog = '-'
+errorlog = '-'
+loglevel = 'debug'
+
+
+def post_fork(server, worker):
+    if 'core.clientes_google' in sys.modules:
+        sys.modules['core.clientes_google'].reiniciar_tras_fork()
+
+
+def post_worker_init(worker):
+    from core.clientes_google import precalentar
+    threading.Thread(target=precalentar, name='precalentar-google', daemon=True).start()
@@ -3,6 +3,12 @@ ASGI config for naza project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Además de las peticiones HTTP normales (la app de Django), atiende el WebSocket
+/ws/stt/ de reconocimiento de voz en streaming (core/ws_stt.py).
+
+En producción (start.sh con SERVIDOR_ASGI=1) el HTTP lo sirve WSGI y el proceso de
+uvicorn carga ``websocket_application``, que sólo atiende los WebSocket.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +19,39 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'naza.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Después de get_asgi_application (que configura Django) para poder importar modelos
+from core.ws_stt import stt_websocket  # noqa: E402
+
+RUTAS_WEBSOCKET = {
+    '/ws/stt/': stt_websocket,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        manejador = RUTAS_WEBSOCKET.get(scope['path'])
+        if manejador is None:
+            await receive()  # websocket.connect
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        return await manejador(scope, receive, send)
+    return await django_application(scope, receive, send)
+
+
+async def websocket_application(scope, receive, send):
+    """Sólo los WebSocket; cualquier petición HTTP que llegue a este proceso es un 404."""
+    if scope['type'] == 'websocket':
+        return await application(scope, receive, send)
+    if scope['type'] == 'lifespan':
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    await send({'type': 'http.response.start', 'status': 404,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': b'Not Found'})
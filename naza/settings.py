@@ -163,6 +163,40 @@ GEMINI_API_KEYS = [
     ] if key  # Filtrar None/vacías
 ]
 
+# --- CACHÉ DE AUDIO TTS ---
+# Memoria (por proceso) + disco (compartido por los workers de gunicorn)
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', os.path.join(BASE_DIR, 'cache_tts'))
+TTS_CACHE_MEMORIA_ITEMS = int(os.getenv('TTS_CACHE_MEMORIA_ITEMS', 256))
+TTS_CACHE_MEMORIA_MB = int(os.getenv('TTS_CACHE_MEMORIA_MB', 32))
+TTS_CACHE_DISCO_MB = int(os.getenv('TTS_CACHE_DISCO_MB', 512))
+
+# --- HISTORIAL DEL CHAT ---
+# Tokens (aprox.) de mensajes textuales por turno; lo anterior va resumido
+HISTORIAL_PRESUPUESTO_TOKENS = int(os.getenv('HISTORIAL_PRESUPUESTO_TOKENS', 3000))
+# Caché de historial por worker (conversaciones y segundos de vida)
+HISTORIAL_CACHE_CONVERSACIONES = int(os.getenv('HISTORIAL_CACHE_CONVERSACIONES', 500))
+HISTORIAL_CACHE_TTL = int(os.getenv('HISTORIAL_CACHE_TTL', 1800))
+
+# --- MEMORIA A LARGO PLAZO (USER FACTS) ---
+# Hechos que van al prompt por turno y dónde se guardan los índices TF-IDF por usuario
+HECHOS_TOP_K = int(os.getenv('HECHOS_TOP_K', 8))
+HECHOS_INDICE_DIR = os.getenv('HECHOS_INDICE_DIR', os.path.join(BASE_DIR, 'cache_hechos'))
+
+# Reportes PDF generados por `manage.py worker_reportes` y días que se conservan
+REPORTES_DIR = os.getenv('REPORTES_DIR', os.path.join(BASE_DIR, 'reportes_pdf'))
+REPORTES_DIAS_RETENCION = int(os.getenv('REPORTES_DIAS_RETENCION', 7))
+
+# 'compartida' la ven todos los workers de gunicorn (ranking global, etc.); la de por defecto es local al proceso
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_COMPARTIDA_DIR', os.path.join(BASE_DIR, 'cache_compartida')),
+    },
+}
+
 LOGIN_URL = 'login'
 
 # A dónde ir después de iniciar sesión exitosamente:
@@ -2,11 +2,28 @@
 echo "Ejecutando migraciones..."
 python manage.py migrate --noinput
 
+echo "Cargando historial de actividad diaria (solo la primera vez)..."
+python manage.py backfill_actividad --si-vacia || true
+
 echo "Creando superusuario de emergencia..."
 # Esto crea un usuario llamado 'admin' con clave 'admin123' y correo 'admin@naza.com'. 
 # Si el usuario ya existe, esto simplemente dará un error menor que ignoraremos, pero no dañará la app.
 python manage.py createsuperuser --noinput --username admin --email admin@naza.com || true
 python manage.py shell -c "from django.contrib.auth.models import User; u = User.objects.get(username='admin'); u.set_password('123admin123'); u.save()" || true
 
+echo "Iniciando worker de reportes PDF..."
+python manage.py worker_reportes &
+
+if [ "${SERVIDOR_ASGI:-0}" = "1" ]; then
+    # Proceso ASGI (uvicorn) SOLO para el WebSocket /ws/stt/ de reconocimiento en streaming.
+    # El HTTP sigue en WSGI (gthread): el handler ASGI de Django acumula en memoria los
+    # StreamingHttpResponse síncronos (chat SSE, exportación) y corre las vistas síncronas
+    # de a una por worker. El proxy de delante debe mandar /ws/ a PUERTO_WS conservando
+    # el Host (ws_stt exige Origin == Host); sin esa ruta el chat usa POST /api/stt/.
+    echo "Iniciando Gunicorn (ASGI, WebSocket) en el puerto ${PUERTO_WS:-8001}..."
+    gunicorn naza.asgi:websocket_application -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker \
+        --bind "0.0.0.0:${PUERTO_WS:-8001}" --workers "${GUNICORN_WORKERS_WS:-1}" &
+fi
+
 echo "Iniciando Gunicorn..."
-exec gunicorn naza.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 2 --threads 4 --timeout 60 --access-logfile - --error-logfile - --log-level debug
+exec gunicorn naza.wsgi:application -c gunicorn.conf.py